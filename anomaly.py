@@ -8,6 +8,7 @@ import os
 #import sys
 #sys.path.append("./modules")
 from cmip5 import *
+from cdo_chain import run_cdo
 
 def calc_ano(scen,model,run,v,startyr,endyr,realm=None):
     """Subtracts the climatology from the annual mean data using CDO.
@@ -44,30 +45,27 @@ def calc_ano(scen,model,run,v,startyr,endyr,realm=None):
     "_ann_"+app+".nc" 
     cdo="cdo -v sub "+OUTPATH+subdir_out+infile+" "+OUTPATH+subdir_clim+infile_clim+" "+\
     OUTPATH+subdir_out+outfile
-    print(cdo)
-    os.system(cdo)
+    run_cdo(cdo)
     print ("Infile:      "+infile)
     print ("Climatology: "+infile_clim)
     print ("Outfile:     "+outfile)
     print ("Folder:      "+OUTPATH+subdir_out)
     return
 
-# Loop over scenarios
-iscen=0
-for scen in SCENARIOLIST:
-    print ("scenario: "+scen)
-    nmodel=0
-    for model in MODELLIST:
-        for run in ENSEMBLELIST:
-            i=0
-            for v in VARLIST:
-                calc_ano(scen,model,run,v,START,END,realm='ocn')
-                i+=1
-        nmodel+=1
-    print ("----------------------------------------------------------")
-    print ("stats for simulations "+scen+" : variable "+v)
-    print ("models: "+str(nmodel)+" variables: "+str(i))
-    iscen+=1
-
-
- 
+if __name__ == "__main__":
+    # Loop over scenarios
+    iscen=0
+    for scen in SCENARIOLIST:
+        print ("scenario: "+scen)
+        nmodel=0
+        for model in MODELLIST:
+            for run in ENSEMBLELIST:
+                i=0
+                for v in VARLIST:
+                    calc_ano(scen,model,run,v,START,END,realm='ocn')
+                    i+=1
+            nmodel+=1
+        print ("----------------------------------------------------------")
+        print ("stats for simulations "+scen+" : variable "+v)
+        print ("models: "+str(nmodel)+" variables: "+str(i))
+        iscen+=1
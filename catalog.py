@@ -0,0 +1,218 @@
+#!/usr/bin/python
+###############################################################################
+# Metadata catalog of the input and intermediate netcdf files
+# The file headers are scanned in parallel (only the header and the
+# time coordinate are read) and stored in a SQLite data base
+# (default OUTPATH+"catalog.sqlite") with the dimensions, grid,
+# calendar, units, time range and a checksum of each file (by default of
+# the first block of the file only, CATALOG_CHECKSUM=True for the whole
+# content).
+# The stages can use the catalog to plan their work and to check their
+# input files (missing files, wrong units or number of time steps)
+# without opening the data (journal.py checks the task inputs with
+# check_input when JOURNAL_CATALOG is True).
+# Files are scanned again only if the size or modification time changed.
+###############################################################################
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import xarray
+import numpy as np
+from multiprocessing.pool import ThreadPool
+from cmip5 import *
+import cmip5_io
+
+# number of parallel header scans
+CATALOG_THREADS=8
+# checksum (sha1) of the whole file content (False: first block only,
+# which contains the netcdf header)
+CATALOG_CHECKSUM=False
+
+COLUMNS=['path','size','mtime','variables','dims','grid','calendar','units',\
+    'time_start','time_end','ntime','checksum','scanned']
+
+
+def catalog_file():
+    """Default catalog data base."""
+    return OUTPATH+"catalog.sqlite"
+
+
+def connect(dbfile=None):
+    """Opens (and creates) the catalog data base."""
+    if dbfile is None:
+        dbfile=catalog_file()
+    db=sqlite3.connect(dbfile)
+    db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, "+\
+        "size INTEGER, mtime REAL, variables TEXT, dims TEXT, grid TEXT, "+\
+        "calendar TEXT, units TEXT, time_start TEXT, time_end TEXT, "+\
+        "ntime INTEGER, checksum TEXT, scanned REAL)")
+    return db
+
+
+def file_checksum(path,full=True,blocksize=2**22):
+    """sha1 checksum of the file (or of its first block only)."""
+    sha=hashlib.sha1()
+    with open(path,"rb") as f:
+        while True:
+            block=f.read(blocksize)
+            if not block:
+                break
+            sha.update(block)
+            if not full:
+                break
+    return sha.hexdigest()
+
+
+def scan_header(path):
+    """Reads the header information of one netcdf file (or OPENDAP source).
+
+    Returns a dictionary with the catalog columns.
+    Only the header and the time coordinate values are read.
+    """
+    info={'path':path}
+    if os.path.exists(path):
+        info['size']=os.path.getsize(path)
+        info['mtime']=os.path.getmtime(path)
+    else:
+        info['size']=None
+        info['mtime']=None
+    nc=xarray.open_dataset(path,decode_times=False)
+    info['variables']=json.dumps(list(nc.data_vars))
+    info['dims']=json.dumps(dict([(d,int(n)) for d,n in nc.sizes.items()]))
+    units={}
+    for name in nc.data_vars:
+        units[name]=nc[name].attrs.get('units','')
+    info['units']=json.dumps(units)
+    grid={}
+    for c in ['lat','lon']:
+        if c in nc.coords:
+            x=nc[c].values
+            grid[c]=[int(np.size(x)),float(np.min(x)),float(np.max(x))]
+    info['grid']=json.dumps(grid)
+    info['calendar']=None
+    info['time_start']=None
+    info['time_end']=None
+    info['ntime']=None
+    if 'time' in nc.variables:
+        tvar=nc['time']
+        info['calendar']=tvar.attrs.get('calendar','standard')
+        info['ntime']=int(tvar.size)
+        if tvar.size>0:
+            tdec=xarray.decode_cf(nc[['time']])['time'].values
+            info['time_start']=str(tdec[0])
+            info['time_end']=str(tdec[-1])
+    nc.close()
+    if info['size'] is not None:
+        info['checksum']=file_checksum(path,CATALOG_CHECKSUM)
+    else:
+        info['checksum']=None
+    info['scanned']=time.time()
+    return info
+
+
+def _scan(path):
+    """scan_header() for the thread pool (errors are returned, not raised)."""
+    try:
+        return scan_header(path)
+    except Exception as e:
+        return {'path':path,'error':str(e)}
+
+
+def update_catalog(paths,dbfile=None,threads=CATALOG_THREADS):
+    """Scans the files in parallel and stores the results in the catalog.
+
+    Files that are already in the catalog with the same size and
+    modification time are not scanned again. Missing files are skipped.
+    Returns the number of scanned files.
+    """
+    db=connect(dbfile)
+    todo=[]
+    for path in paths:
+        if os.path.exists(path):
+            row=db.execute("SELECT size,mtime FROM files WHERE path=?",(path,)).fetchone()
+            if row is not None and row[0]==os.path.getsize(path) and \
+                row[1]==os.path.getmtime(path):
+                continue
+        elif not path.startswith("http"):
+            continue
+        todo.append(path)
+    pool=ThreadPool(threads)
+    results=pool.map(_scan,todo)
+    pool.close()
+    for info in results:
+        if 'error' in info:
+            print("could not scan "+info['path']+": "+info['error'])
+            continue
+        db.execute("INSERT OR REPLACE INTO files VALUES ("+\
+            ",".join(["?"]*len(COLUMNS))+")",[info[c] for c in COLUMNS])
+    db.commit()
+    db.close()
+    return len(todo)
+
+
+def lookup(path,dbfile=None):
+    """Returns the catalog entry of a file as dictionary (or None)."""
+    db=connect(dbfile)
+    row=db.execute("SELECT "+",".join(COLUMNS)+" FROM files WHERE path=?",\
+        (path,)).fetchone()
+    db.close()
+    if row is None:
+        return None
+    info=dict(zip(COLUMNS,row))
+    for c in ['variables','dims','grid','units']:
+        info[c]=json.loads(info[c])
+    return info
+
+
+def check_input(path,v=None,units=None,ntime=None,dbfile=None):
+    """Checks an input file with the catalog (without opening the file).
+
+    Input parameters:
+        path: file name
+        v: variable that must be in the file
+        units: expected units of variable v
+        ntime: expected number of time steps
+    Returns an empty string if the file is fine, otherwise the problem.
+    """
+    if not os.path.exists(path):
+        return "missing file"
+    info=lookup(path,dbfile)
+    if info is None or info['size'] != os.path.getsize(path) or \
+        info['mtime'] != os.path.getmtime(path):
+        return "not in catalog (or changed since the scan)"
+    if v is not None and v not in info['variables']:
+        return "variable "+v+" not in file"
+    if units is not None and info['units'].get(v) != units:
+        return "units "+str(info['units'].get(v))+" instead of "+units
+    if ntime is not None and info['ntime'] != ntime:
+        return "time steps "+str(info['ntime'])+" instead of "+str(ntime)
+    return ""
+
+
+def pipeline_files(realm=None):
+    """Source files and processed files of the configuration in cmip5.py."""
+    apps=["ann","ann_clim","ann_ano","ann_ano_fldmean","ann_ano_resid",\
+        "ann_ano_resid_eof","ann_ano_resid_pc","ann_ano_resid_pdo_proj"]
+    paths=[]
+    for scen in SCENARIOLIST:
+        model_scen=TRANSLATE[scen]['scen']
+        for model in MODELLIST:
+            for run in ENSEMBLELIST:
+                for v in VARLIST:
+                    paths.append(DPATH+"cmip5_"+model_scen+"_"+v+"_"+model+"_"+run+".nc")
+                    for app in apps:
+                        paths.append(cmip5_io.fpath(scen,model,run,v,app,realm))
+    return paths
+
+
+realm='ocn' # or set to None, depending of sub-folder structure
+
+if __name__ == "__main__":
+    paths=pipeline_files(realm)
+    print("files in configuration: "+str(len(paths)))
+    nscan=update_catalog(paths)
+    print("files scanned: "+str(nscan))
+    print("catalog: "+catalog_file())
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+###############################################################################
+# CDO command builder
+# Composes CDO operator chains into one CDO call (CDO operator chaining:
+# the output of an operator is the input of the operator to its left),
+# sets the number of OpenMP threads (cdo -P) and runs the command
+# with subprocess. The return code is checked and the run time is
+# reported.
+#
+# As script: annual mean, anomaly and field mean without intermediate
+# files of the annual means:
+#   cdo -P n -timmean -selyear,START/END -selyear,y1/y2 -yearmean hist.nc
+#                 *_ann_clim.nc   (historical folder, once per model/run)
+#   cdo -P n -sub -selyear,y1/y2 -yearmean src.nc *_ann_clim.nc
+#                 *_ann_ano.nc
+#   cdo -P n -fldmean *_ann_ano.nc *_ann_ano_fldmean.nc
+# The climatology file is reused by all scenarios of a member (it is
+# recomputed if it is older than the historical source file), so each
+# scenario source is read once for the anomalies and the historical
+# source once more for the climatology. The field mean reads the
+# anomaly file.
+###############################################################################
+
+import os
+import shlex
+import subprocess
+import time
+from cmip5 import *
+import cmip5_io
+
+
+class CdoError(RuntimeError):
+    """CDO command returned a non-zero exit status."""
+    pass
+
+
+def operator(name,*args):
+    """Returns a CDO operator with its arguments, for example -selyear,1900/2005"""
+    if len(args)==0:
+        return "-"+name
+    return "-"+name+","+",".join([str(a) for a in args])
+
+
+def chain(*parts):
+    """Combines operators, input files and other chains into one chain (list)."""
+    tokens=[]
+    for part in parts:
+        if isinstance(part,(list,tuple)):
+            tokens.extend(chain(*part))
+        else:
+            tokens.append(part)
+    return tokens
+
+
+def cdo_command(ops,outfile,threads=None,options=None):
+    """Returns the CDO command (list) for an operator chain.
+
+    Input parameters:
+        ops: operator chain (see chain())
+        outfile: output file name
+        threads: number of OpenMP threads (default CDO_THREADS)
+        options: additional CDO options (list), default ['-O'] (overwrite)
+    """
+    if threads is None:
+        threads=CDO_THREADS
+    if options is None:
+        options=['-O']
+    return ["cdo","-P",str(threads)]+list(options)+chain(ops)+[outfile]
+
+
+def run_cdo(cmd):
+    """Runs a CDO command and checks the exit status.
+
+    Input parameter cmd is the command list (cdo_command) or a
+    command string. Raises CdoError if CDO fails.
+    Returns the run time in seconds.
+    """
+    if isinstance(cmd,str):
+        cmd=shlex.split(cmd)
+    print(" ".join(cmd))
+    t0=time.time()
+    try:
+        result=subprocess.run(cmd,stdout=subprocess.PIPE,stderr=subprocess.PIPE,\
+            universal_newlines=True)
+    except OSError as e:
+        raise CdoError("cdo could not be started ("+str(e)+"): "+" ".join(cmd))
+    elapsed=time.time()-t0
+    if result.returncode != 0:
+        print(result.stderr)
+        raise CdoError("cdo failed with exit status "+str(result.returncode)+\
+            ": "+" ".join(cmd))
+    print("cdo run time: %.1f s" % elapsed)
+    return elapsed
+
+
+def source_file(scen,model,run,v):
+    """Source file name (DPATH)."""
+    model_scen=TRANSLATE[scen]['scen']
+    return DPATH+"cmip5_"+model_scen+"_"+v+"_"+model+"_"+run+".nc"
+
+
+def source_chain(scen,model,run,v,select=None):
+    """Source file (DPATH); with select (list of variables) only these
+    variables are read (-selname on the source file)."""
+    infile=source_file(scen,model,run,v)
+    if select:
+        return chain(operator("selname",*select),infile)
+    return [infile]
+
+
+def ann_chain(scen,model,run,v,select=None):
+    """Operator chain for the annual mean of the source data (DPATH)."""
+    infile=source_chain(scen,model,run,v,select)
+    first_year=TRANSLATE[scen]['first_year']
+    last_year=TRANSLATE[scen]['last_year']
+    if CORRECT_ANN_CALENDAR:
+        return chain(operator("setcalendar","standard"),\
+            operator("settaxis",str(first_year)+"-01-01","00:00:00","365day"),\
+            operator("selyear",str(first_year)+"/"+str(last_year)),\
+            operator("timselmean",12),infile)
+    return chain(operator("selyear",str(first_year)+"/"+str(last_year)),\
+        operator("yearmean"),infile)
+
+
+def clim_chain(model,run,v,startyr,endyr,select=None):
+    """Operator chain for the climatology (historical annual means)."""
+    return chain(operator("timmean"),\
+        operator("selyear",str(startyr)+"/"+str(endyr)),\
+        ann_chain('historical',model,run,v,select))
+
+
+def ano_chain(scen,model,run,v,startyr,endyr,select=None,climfile=None):
+    """Operator chain for the annual anomalies (with climfile: the
+    climatology is read from this file instead of the historical source)."""
+    if climfile is None:
+        clim=clim_chain(model,run,v,startyr,endyr,select)
+    else:
+        clim=[climfile]
+    return chain(operator("sub"),ann_chain(scen,model,run,v,select),clim)
+
+
+def calc_clim_pipe(model,run,v,startyr,endyr,realm=None,select=None,app="ann_clim"):
+    """Climatology of the historical annual means (*_ann_clim.nc in the
+    historical folder). An existing file that is not older than the
+    historical source file is reused.
+    Returns the climatology file and the CDO run time (seconds)."""
+    climfile=cmip5_io.fpath('historical',model,run,v,app,realm)
+    srcfile=source_file('historical',model,run,v)
+    if os.path.exists(climfile) and os.path.exists(srcfile) and \
+        os.path.getmtime(climfile)>=os.path.getmtime(srcfile):
+        print("Climatology: "+climfile)
+        return climfile,0.
+    outdir=os.path.dirname(climfile)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    cmd=cdo_command(clim_chain(model,run,v,startyr,endyr,select),climfile)
+    return climfile,run_cdo(cmd)
+
+
+def fldmean_chain(infile):
+    """Operator chain for the field mean of the annual anomalies
+    (infile: the anomaly file *_ann_ano.nc)."""
+    return chain(operator("fldmean"),infile)
+
+
+def calc_ano_pipe(scen,model,run,v,startyr,endyr,realm=None,fldmean=True):
+    """Annual anomalies from the source data with one CDO call (and the
+    climatology file, see calc_clim_pipe), and the field mean of the
+    anomaly file.
+
+    Input variables:
+        scen,model,run,v: strings indicating the scenario,
+            model,ensemble member run, and the variable name.
+        startyr, endyr: integer numbers for the first and last year
+            of the climatology
+        realm: optional string argument corresponding to the
+            variable processed that is used for the subfolder structure
+            of the CMIP5 model.
+        fldmean: also write the field mean (*_ann_ano_fldmean.nc)
+    Returns the run times (seconds) of the CDO calls.
+    """
+    times=[]
+    climfile,t=calc_clim_pipe(model,run,v,startyr,endyr,realm)
+    times.append(t)
+    anofile=cmip5_io.fpath(scen,model,run,v,"ann_ano",realm)
+    cmd=cdo_command(ano_chain(scen,model,run,v,startyr,endyr,climfile=climfile),anofile)
+    times.append(run_cdo(cmd))
+    if fldmean:
+        outfile=cmip5_io.fpath(scen,model,run,v,"ann_ano_fldmean",realm)
+        cmd=cdo_command(fldmean_chain(anofile),outfile)
+        times.append(run_cdo(cmd))
+    return times
+
+
+if __name__ == "__main__":
+    # Loop over scenarios
+    iscen=0
+    for scen in SCENARIOLIST:
+        print ("scenario: "+scen)
+        nmodel=0
+        total=0.
+        for model in MODELLIST:
+            for run in ENSEMBLELIST:
+                i=0
+                for v in VARLIST:
+                    total+=sum(calc_ano_pipe(scen,model,run,v,START,END,realm='ocn'))
+                    i+=1
+            nmodel+=1
+        print ("----------------------------------------------------------")
+        print ("stats for simulations "+scen+" : variable "+v)
+        print ("models: "+str(nmodel)+" variables: "+str(i))
+        print ("cdo run time: %.1f s" % total)
+        iscen+=1
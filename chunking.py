@@ -0,0 +1,443 @@
+#!/usr/bin/python
+###############################################################################
+# Memory-budgeted block processing for large or high-resolution fields
+# plan_blocks() chooses the block size (time steps or latitude rows)
+# of a stage for the memory budget MEMORY_BUDGET (cmip5.py).
+# The chunked_* functions run the stages block by block with the same
+# results as the stages that hold the whole (time,lat,lon) array:
+#   'ann_mean'   annual mean of monthly data      (time blocks, whole years)
+#   'anomaly'    annual anomalies                 (time blocks)
+#   'fldmean'    area-weighted field means        (time blocks)
+#   'linreg'     regression on the global mean    (latitude blocks)
+#   'proj'       projection onto the EOFs         (time blocks)
+#   'covariance' covariance matrix for the PCA    (time blocks)
+# The input blocks are read with xarray (only the block is loaded),
+# the output files are written block by block with netCDF4.
+# run_chunked() runs all stages of one model run (mon2ann.py to
+# fld_proj.py) with the same output files as the stage scripts.
+###############################################################################
+
+import xarray
+import numpy as np
+import netCDF4
+from cmip5 import *
+import cmip5_io
+import fld_engine
+import grid_area
+import fld_pca
+import fld_proj
+
+
+def plan_blocks(stage,shape,budget=None,itemsize=None,nextra=0):
+    """Block size of a stage for the memory budget.
+
+    Input parameters:
+        stage: 'ann_mean','anomaly','fldmean','linreg','proj' or 'covariance'
+        shape: (time,lat,lon) shape of the input field
+            (time in months for 'ann_mean')
+        budget: memory budget in bytes (default MEMORY_BUDGET)
+        itemsize: bytes per number (default from PRECISION)
+        nextra: number of patterns ('proj') or grid points ('covariance')
+    Returns (axis,size): the block axis ('time' or 'lat') and the
+    number of time steps (months for 'ann_mean') or latitude rows.
+    """
+    if budget is None:
+        budget=MEMORY_BUDGET
+    if itemsize is None:
+        itemsize=np.dtype(PRECISION).itemsize
+    ntime,nlat,nlon=shape
+    npoint=nlat*nlon
+    if stage=='ann_mean':
+        # 12 months in, 1 year out (accumulated in float64)
+        fixed=0
+        per_step=(12*itemsize+2*8)*npoint
+        axis='time'
+    elif stage in ['anomaly','fldmean']:
+        # climatology / weights (fixed), block in and out
+        fixed=8*npoint*2
+        per_step=3*itemsize*npoint
+        axis='time'
+    elif stage=='linreg':
+        # all time steps of a latitude row: field, residual, temporary
+        fixed=0
+        per_step=3*itemsize*ntime*nlon
+        axis='lat'
+    elif stage=='proj':
+        # patterns (fixed); block, masks and zero-filled copy
+        fixed=8*npoint*max(1,nextra)
+        per_step=3*itemsize*npoint+8*max(1,nextra)
+        axis='time'
+    elif stage=='covariance':
+        # covariance accumulator and product buffer (float64), block copies
+        fixed=2*8*nextra*nextra+2*8*nextra
+        per_step=3*8*nextra
+        axis='time'
+    else:
+        raise ValueError("unknown stage "+stage)
+    if fixed+per_step>budget:
+        raise MemoryError("stage "+stage+" needs at least "+\
+            str(fixed+per_step)+" bytes, budget is "+str(budget))
+    nsize=int((budget-fixed)//per_step)
+    if axis=='time':
+        nmax=ntime
+    else:
+        nmax=nlat
+    if stage=='ann_mean':
+        # blocks of whole years
+        return axis,max(12,min(nmax,12*nsize))
+    return axis,max(1,min(nmax,nsize))
+
+
+def create_output(outfile,v,src,time_values,lat,lon,dtype,attrs=None):
+    """Creates a (time,lat,lon) netcdf output file for block-wise writing.
+
+    Input parameters:
+        outfile: output file name
+        v: variable name
+        src: source dataset (opened with decode_times=False) for the
+            time and variable attributes
+        time_values: numeric time coordinate values
+        lat,lon: coordinates
+        dtype: data type of the variable
+        attrs: variable attributes (default: attributes of src[v])
+    Returns the open netCDF4 dataset.
+    """
+    nc=netCDF4.Dataset(outfile,"w",format="NETCDF4")
+    nc.createDimension('time',None)
+    nc.createDimension('lat',len(lat))
+    nc.createDimension('lon',len(lon))
+    tvar=nc.createVariable('time','f8',('time',))
+    for key in ['units','calendar','standard_name','axis']:
+        if key in src['time'].attrs:
+            tvar.setncattr(key,src['time'].attrs[key])
+    tvar[:]=time_values
+    latvar=nc.createVariable('lat','f8',('lat',))
+    latvar.units='degrees_north'
+    latvar[:]=lat
+    lonvar=nc.createVariable('lon','f8',('lon',))
+    lonvar.units='degrees_east'
+    lonvar[:]=lon
+    var=nc.createVariable(v,dtype,('time','lat','lon'),fill_value=np.nan)
+    if attrs is None:
+        attrs=src[v].attrs
+    for key in attrs:
+        if key not in ['_FillValue','missing_value']:
+            var.setncattr(key,attrs[key])
+    return nc
+
+
+def read_block(ds,v,axis,i0,i1):
+    """Reads one block of a (time,lat,lon) variable (3dim array)."""
+    if axis=='time':
+        x=ds[v].isel(time=slice(i0,i1)).values
+    else:
+        x=ds[v].isel(lat=slice(i0,i1)).values
+    x=np.reshape(x,(np.shape(x)[0],)+np.shape(x)[-2:])
+    return x.astype(PRECISION,copy=False)
+
+
+def chunked_ann_mean(infile,outfile,v,first_year,last_year,budget=None,\
+    correct_calendar=None):
+    """Annual means of monthly data (years first_year to last_year),
+    as cdo -selyear,first_year/last_year -yearmean.
+    The time coordinate is the first month of each year.
+    With correct_calendar (default CORRECT_ANN_CALENDAR) the means are
+    taken over groups of 12 consecutive time steps and the time axis is
+    set to yearly steps of 365 days from first_year in the standard
+    calendar (as cdo_chain.ann_chain and mon2ann.py).
+    """
+    if correct_calendar is None:
+        correct_calendar=CORRECT_ANN_CALENDAR
+    src=xarray.open_dataset(infile,decode_times=False)
+    years=xarray.decode_cf(src[['time']])['time'].dt.year.values
+    if correct_calendar:
+        # -timselmean,12: groups of 12 time steps from the first step
+        starts=12*np.arange(len(years)//12)
+        ends=starts+12
+    else:
+        uyears,starts,counts=np.unique(years,return_index=True,return_counts=True)
+        ends=starts+counts
+    is_sel=np.logical_and(years[starts]>=first_year,years[starts]<=last_year)
+    starts=starts[is_sel]
+    ends=ends[is_sel]
+    nyear=len(starts)
+    shape=(int(np.sum(ends-starts)),src.sizes['lat'],src.sizes['lon'])
+    axis,nblock=plan_blocks('ann_mean',shape,budget)
+    nyear_block=nblock//12
+    out=create_output(outfile,v,src,src['time'].values[starts],\
+        src.lat.values,src.lon.values,PRECISION)
+    if correct_calendar:
+        # -settaxis,first_year-01-01,00:00:00,365day -setcalendar,standard
+        out['time'].units="days since "+str(first_year)+"-01-01 00:00:00"
+        out['time'].calendar="standard"
+        out['time'][:]=365.*np.arange(nyear)
+    print("annual mean in blocks of "+str(nyear_block)+" years")
+    iy=0
+    while iy<nyear:
+        i0=starts[iy]
+        x=read_block(src,v,'time',i0,ends[min(iy+nyear_block,nyear)-1])
+        for k in range(iy,min(iy+nyear_block,nyear)):
+            out[v][k]=np.mean(x[starts[k]-i0:ends[k]-i0],axis=0,dtype=np.float64)
+        iy+=nyear_block
+    out.close()
+    src.close()
+    return
+
+
+def chunked_clim(infile,v,startyr,endyr,budget=None):
+    """Climatology (mean over the years startyr to endyr) of annual data,
+    accumulated in time blocks. Returns the (lat,lon) climatology.
+    """
+    src=xarray.open_dataset(infile)
+    years=src['time'].dt.year.values
+    isel=np.where(np.logical_and(years>=startyr,years<=endyr))[0]
+    shape=(len(isel),src.sizes['lat'],src.sizes['lon'])
+    axis,nblock=plan_blocks('anomaly',shape,budget)
+    total=np.zeros(shape[1:])
+    i=0
+    while i<len(isel):
+        x=read_block(src,v,'time',isel[i],isel[min(i+nblock,len(isel))-1]+1)
+        total+=np.sum(x,axis=0,dtype=np.float64)
+        i+=nblock
+    src.close()
+    return total/len(isel)
+
+
+def chunked_anomaly(infile,clim,outfile,v,budget=None):
+    """Annual anomalies (annual data minus climatology) in time blocks."""
+    src=xarray.open_dataset(infile,decode_times=False)
+    shape=(src.sizes['time'],src.sizes['lat'],src.sizes['lon'])
+    axis,nblock=plan_blocks('anomaly',shape,budget)
+    out=create_output(outfile,v,src,src['time'].values,src.lat.values,\
+        src.lon.values,PRECISION)
+    clim=clim.astype(PRECISION)
+    i=0
+    while i<shape[0]:
+        x=read_block(src,v,'time',i,i+nblock)
+        out[v][i:i+np.shape(x)[0]]=x-clim[None,:,:]
+        i+=nblock
+    out.close()
+    src.close()
+    return
+
+
+def chunked_fldmean(infile,v,regions,budget=None):
+    """Area-weighted field means (time,nregion) in time blocks
+    (same results as grid_area.fld_means)."""
+    src=xarray.open_dataset(infile)
+    shape=(src.sizes['time'],src.sizes['lat'],src.sizes['lon'])
+    axis,nblock=plan_blocks('fldmean',shape,budget)
+    w=grid_area.region_weights(src.lat.values,src.lon.values,regions)
+    x=np.empty((shape[0],len(regions)))
+    i=0
+    while i<shape[0]:
+        x[i:i+nblock]=grid_area.fld_means(read_block(src,v,'time',i,i+nblock),w)
+        i+=nblock
+    src.close()
+    return x
+
+
+def chunked_linreg(infile,ts,outfile,v,budget=None):
+    """Regression residuals (see fld_linreg.py) in latitude blocks.
+
+    Input parameters:
+        infile: anomaly field file
+        ts: global mean time series (1dim array)
+        outfile: residual output file
+        v: variable name
+    """
+    src=xarray.open_dataset(infile,decode_times=False)
+    shape=(src.sizes['time'],src.sizes['lat'],src.sizes['lon'])
+    if len(ts) != shape[0]:
+        raise ValueError("input files do not have same number of samples in time dimension")
+    axis,nblock=plan_blocks('linreg',shape,budget)
+    out=create_output(outfile,v,src,src['time'].values,src.lat.values,\
+        src.lon.values,PRECISION)
+    print("regression in blocks of "+str(nblock)+" latitudes")
+    j=0
+    while j<shape[1]:
+        x=read_block(src,v,'lat',j,j+nblock)
+        a,b,r,res=fld_engine.linreg_field(ts,x)
+        out[v][:,j:j+nblock,:]=res
+        j+=nblock
+    out.close()
+    src.close()
+    return
+
+
+def chunked_proj(infile,eof,v,region=REGION_PDO,budget=None):
+    """Projection indices (time,nmodes) of the field onto the patterns
+    (nmodes,lat,lon of the region) in time blocks."""
+    src=xarray.open_dataset(infile)
+    is_lon,is_lat=fld_engine.region_mask(src.lon.values,src.lat.values,region)
+    shape=(src.sizes['time'],int(np.sum(is_lat)),int(np.sum(is_lon)))
+    axis,nblock=plan_blocks('proj',shape,budget,nextra=len(eof))
+    proj=np.empty((shape[0],len(eof)))
+    i=0
+    while i<shape[0]:
+        x=fld_engine.sel_region(read_block(src,v,'time',i,i+nblock),is_lon,is_lat)
+        proj[i:i+nblock]=fld_engine.proj_fields(x,eof)
+        i+=nblock
+    src.close()
+    return proj
+
+
+def chunked_covariance(infile,v,region=REGION_PDO,budget=None):
+    """Covariance matrix of the valid grid points of the region,
+    accumulated in float64 over time blocks.
+
+    Returns the covariance matrix (npoint,npoint) of the grid points
+    without missing values, their index (as field2matrix in fld_pca.py),
+    the region size (nlat,nlon) and the coordinates.
+    """
+    src=xarray.open_dataset(infile)
+    is_lon,is_lat=fld_engine.region_mask(src.lon.values,src.lat.values,region)
+    nlat=int(np.sum(is_lat))
+    nlon=int(np.sum(is_lon))
+    ntime=src.sizes['time']
+    npoint=nlat*nlon
+    axis,nblock=plan_blocks('covariance',(ntime,nlat,nlon),budget,nextra=npoint)
+    s1=np.zeros(npoint)
+    s2=np.zeros((npoint,npoint))
+    tmp=np.empty((npoint,npoint)) # product buffer (no temporary per block)
+    nvalid=np.zeros(npoint)
+    i=0
+    while i<ntime:
+        x=fld_engine.sel_region(read_block(src,v,'time',i,i+nblock),is_lon,is_lat)
+        x=np.reshape(x,(np.shape(x)[0],npoint)).astype(np.float64)
+        is_x=np.isfinite(x)
+        x=np.where(is_x,x,0.)
+        nvalid+=np.sum(is_x,axis=0)
+        s1+=np.sum(x,axis=0)
+        np.dot(x.T,x,out=tmp)
+        s2+=tmp
+        i+=nblock
+    del tmp
+    valid_index=np.where(nvalid==ntime)[0]
+    s1=s1[valid_index]
+    cov=s2[np.ix_(valid_index,valid_index)]
+    del s2
+    cov-=np.outer(s1,s1/ntime)
+    cov/=(ntime-1)
+    lat=src.lat.values[is_lat]
+    lon=src.lon.values[is_lon]
+    src.close()
+    return cov,valid_index,(nlat,nlon),lat,lon
+
+
+def eof_from_covariance(cov,valid_index,nlat,nlon,nmodes=10):
+    """EOFs (nmodes,nlat,nlon) and explained variances from the covariance
+    matrix (same as sklearn PCA in fld_pca.py, the sign is arbitrary)."""
+    evals,evecs=np.linalg.eigh(cov)
+    order=np.argsort(evals)[::-1][0:nmodes]
+    eof=np.empty((len(order),nlat*nlon))
+    eof[:]=np.nan
+    eof[:,valid_index]=evecs[:,order].T
+    return np.reshape(eof,(len(order),nlat,nlon)),evals[order]
+
+
+def save_clim(clim,histfile,outfile,v,startyr):
+    """Saves the climatology (1,lat,lon) in the layout of climatology.py
+    (time: first year of the climatology period)."""
+    src=xarray.open_dataset(histfile)
+    years=src['time'].dt.year.values
+    t=src['time'][np.where(years>=startyr)[0][0:1]]
+    xclim=xarray.DataArray(clim[None,:,:].astype(PRECISION),\
+        coords=[t,src.lat,src.lon],dims=['time','lat','lon'])
+    xclim.name=v
+    xclim.attrs.update(src[v].attrs)
+    src.close()
+    cmip5_io.to_netcdf(xarray.Dataset({v:xclim}),outfile)
+    return
+
+
+def save_fldmean(x,anofile,outfile,v,names):
+    """Saves the field means (time,nregion) in the layout of fld_mean.py."""
+    src=xarray.open_dataset(anofile)
+    ds=grid_area.fldmean_dataset(x,src.time,v,names,src[v].attrs.get('units'))
+    src.close()
+    cmip5_io.to_netcdf(ds,outfile)
+    return
+
+
+def chunked_pca(infile,v,outfile_eof,outfile_pc,nmodes=10,budget=None):
+    """EOFs (covariance matrix in time blocks) and PC time series
+    (projection in time blocks) in the output layout of fld_pca.py."""
+    cov,valid_index,(nlat,nlon),lat,lon=chunked_covariance(infile,v,budget=budget)
+    eof,expvar=eof_from_covariance(cov,valid_index,nlat,nlon,nmodes)
+    expfrac=expvar/np.trace(cov)
+    del cov
+    pc=chunked_proj(infile,eof,v,budget=budget)
+    src=xarray.open_dataset(infile)
+    fld_pca.save_result(eof=eof,pc=pc,time=src.time,lat=lat,lon=lon,\
+        expvar=expvar,copy_from_source=src[v],expfrac=expfrac,\
+        outfile_eof=outfile_eof,outfile_pc=outfile_pc)
+    src.close()
+    return
+
+
+def chunked_pdo_proj(infile,eoffile,v,outfile,budget=None):
+    """Projection indices onto the EOFs of eoffile in time blocks
+    (output layout of fld_proj.py)."""
+    nc=xarray.open_dataset(eoffile)
+    eof=nc['eof'].values
+    lev=nc.lev
+    nc.close()
+    proj=chunked_proj(infile,eof,v,budget=budget)
+    src=xarray.open_dataset(infile)
+    fld_proj.save_result(proj,src.time,lev,copy_from_source=src[v],outfile=outfile)
+    src.close()
+    return
+
+
+def run_chunked(scen,model,run,v,realm=None,budget=None,nmodes=10):
+    """All stages of one model run, block by block, with the output files
+    of mon2ann.py (*_ann.nc), climatology.py (*_ann_clim.nc, historical),
+    anomaly.py (*_ann_ano.nc), fld_mean.py with NATIVE=True
+    (*_ann_ano_fldmean.nc), fld_linreg.py (*_ann_ano_resid.nc),
+    fld_pca.py (*_eof.nc, *_pc.nc, historical) and fld_proj.py
+    (*_pdo_proj.nc, EOFs of the historical run).
+    """
+    f=lambda s,app: cmip5_io.fpath(s,model,run,v,app,realm)
+    model_scen=TRANSLATE[scen]['scen']
+    infile=DPATH+"cmip5_"+model_scen+"_"+v+"_"+model+"_"+run+".nc"
+    annfile=f(scen,"ann")
+    print("annual mean: "+annfile)
+    chunked_ann_mean(infile,annfile,v,TRANSLATE[scen]['first_year'],\
+        TRANSLATE[scen]['last_year'],budget)
+    histfile=f('historical',"ann")
+    clim=chunked_clim(histfile,v,START,END,budget)
+    if scen=='historical':
+        save_clim(clim,histfile,f(scen,"ann_clim"),v,START)
+    anofile=f(scen,"ann_ano")
+    print("anomalies: "+anofile)
+    chunked_anomaly(annfile,clim,anofile,v,budget)
+    names,regions=grid_area.fldmean_regions()
+    x=chunked_fldmean(anofile,v,regions,budget)
+    print("field means: "+f(scen,"ann_ano_fldmean"))
+    save_fldmean(x,anofile,f(scen,"ann_ano_fldmean"),v,names)
+    residfile=f(scen,"ann_ano_resid")
+    print("residuals: "+residfile)
+    chunked_linreg(anofile,x[:,0],residfile,v,budget)
+    if scen=='historical':
+        print("EOFs: "+f(scen,"ann_ano_resid_eof"))
+        chunked_pca(residfile,v,f(scen,"ann_ano_resid_eof"),\
+            f(scen,"ann_ano_resid_pc"),nmodes,budget)
+    print("projection: "+f(scen,"ann_ano_resid_pdo_proj"))
+    chunked_pdo_proj(residfile,f('historical',"ann_ano_resid_eof"),v,\
+        f(scen,"ann_ano_resid_pdo_proj"),budget)
+    return
+
+
+realm='ocn' # or set to None, depending of sub-folder structure
+
+if __name__ == "__main__":
+    # historical first (climatology for the anomalies of all scenarios)
+    scenlist=['historical']+[s for s in SCENARIOLIST if s != 'historical']
+    for scen in scenlist:
+        print ("scenario: "+scen)
+        for model in MODELLIST:
+            for run in ENSEMBLELIST:
+                for v in VARLIST:
+                    run_chunked(scen,model,run,v,realm=realm)
+    print ("done")
@@ -9,6 +9,7 @@ import os
 #import sys
 #sys.path.append("./modules")
 from cmip5 import *
+from cdo_chain import run_cdo
 
 def calc_clim(scen,model,run,v,startyr,endyr,realm=None):
     """Calculates climatology from annual mean data using CDO.
@@ -38,25 +39,25 @@ def calc_clim(scen,model,run,v,startyr,endyr,realm=None):
     "_ann_"+app+".nc"
     cdo="cdo -v timmean -selyear,"+str(startyr)+"/"+str(endyr)+" "+\
     OUTPATH+subdir_out+infile+" "+OUTPATH+subdir_out+outfile
-    print(cdo)
-    os.system(cdo)
+    run_cdo(cdo)
     print ("Infile: "+infile)
     print ("Outfile:"+outfile)
     print ("Folder: "+OUTPATH)
     return
 
-# Loop over scenarios (historical only, usually)
-iscen=0
-scen=TRANSLATE['historical']['scen']
-nmodel=0
-for model in MODELLIST:
-    for run in ENSEMBLELIST:
-        i=0
-        for v in VARLIST:
-            calc_clim(scen,model,run,v,startyr=START,endyr=END,realm="ocn")
-            i+=1
-    nmodel+=1
-print ("----------------------------------------------------------")
-print ("stats for simulations "+scen+" : variable "+v)
-print ("models: "+str(nmodel)+" variables: "+str(i))
-iscen+=1
+if __name__ == "__main__":
+    # Loop over scenarios (historical only, usually)
+    iscen=0
+    scen=TRANSLATE['historical']['scen']
+    nmodel=0
+    for model in MODELLIST:
+        for run in ENSEMBLELIST:
+            i=0
+            for v in VARLIST:
+                calc_clim(scen,model,run,v,startyr=START,endyr=END,realm="ocn")
+                i+=1
+        nmodel+=1
+    print ("----------------------------------------------------------")
+    print ("stats for simulations "+scen+" : variable "+v)
+    print ("models: "+str(nmodel)+" variables: "+str(i))
+    iscen+=1
@@ -28,12 +28,30 @@ MODELLIST=['ACCESS1-0']
 REALMLIST= ["ocn"]
 # only SST (TOS) processed here, but can iterate over several variables in a file
 VARLIST=["tos"]
+# variables stored together in one source file (multivar.py)
+# group name (in the source file name instead of the variable): variables
+VARGROUPS={'tos':["tos"]}
 
 # standard grid for all models
 # This one is a 2.5 x 2.5 regular lon-lat grid
 OUTGRID="/network/rit/lab/elisontimmlab_rit/DATA/NCEP/gridfile.nc"
 
 
+###############################################################################
+# Observational SST products (obs_pipeline.py)
+###############################################################################
+# Path to the directory with the monthly gridded observations
+OBSPATH=DPATH+"obs/" # must always end with '/'
+# name:{'file': source file in OBSPATH, 'var': netcdf variable name,
+#       'first_year','last_year': processed years}
+# The output files use the name and the model variable name (VARLIST),
+# for example OUTPATH+obs/ocn/tos/ERSSTv5_obs_tos_1900-2005_ann_ano.nc
+OBSLIST={'ERSSTv5':{'file':'sst.mnmean.nc','var':'sst','first_year':1900,\
+            'last_year':2005},\
+         'HadISST':{'file':'HadISST_sst.nc','var':'sst','first_year':1900,\
+            'last_year':2005}}
+
+
 ###############################################################################
 # CMIP5 model specific variables
 ###############################################################################
@@ -75,6 +93,19 @@ TRANSLATE={'historical':{'scen':'historical','time':'1900-2005','first_year':190
 
 CORRECT_ANN_CALENDAR=False 
 
+# floating point precision of the field arrays in the python stages
+# ('float64' or 'float32'; float32 halves memory use and bandwidth,
+# sums and dot products are accumulated in float64)
+PRECISION='float64'
+
+# number of OpenMP threads for CDO (cdo -P)
+CDO_THREADS=4
+
+###############################################################################
+# Memory budget (bytes) for the temporary arrays of blocked calculations
+###############################################################################
+MEMORY_BUDGET=2*1024**3
+
 # climatology: start and end years for the averaging
 START=1975
 END=2005
@@ -84,6 +115,9 @@ END=2005
 ###############################################################################
 # For the PDO analysis (PCA and projection index)
 REGION_PDO=(110.0,260.0,20.0,70.0)
+# Regional means calculated in addition to the global mean (fld_mean.py)
+# name:(lonw,lone,lats,latn)
+FLDMEAN_REGIONS={'npac':REGION_PDO}
 # PCA (EOF) mode number for PDO (default value is first mode is PDO)
 MODE_PDO=0 # first PCA mode should be PDO in models
 # Lowpass filter cutoff frequency: f=1/(time steps)
@@ -0,0 +1,99 @@
+###############################################################################
+# Module with the file naming and netcdf input/output helpers
+# shared by the CMIP5 processing scripts.
+# The file names follow the same convention as in mon2ann.py,
+# anomaly.py, fld_linreg.py, fld_pca.py and fld_proj.py:
+#   OUTPATH+scen/realm/var/+model_scen_var_time_run_app.nc
+# Observations (OBSLIST, obs_pipeline.py):
+#   OUTPATH+obs/realm/var/+obs_obs_var_time_app.nc
+###############################################################################
+
+import os
+import xarray
+from cmip5 import *
+
+
+def subdir(scen,v,realm=None):
+    """Returns the sub-folder (relative to OUTPATH) of a scenario and variable.
+
+    Input variables:
+        scen,v: strings indicating the scenario and the variable name.
+        realm: optional string argument corresponding to the
+            variable processed that is used for the subfolder structure
+            of the CMIP5 model.
+    """
+    model_scen=TRANSLATE[scen]['scen']
+    if realm != None:
+        return model_scen+"/"+realm+"/"+v+"/"
+    else:
+        return model_scen+"/"+v+"/"
+
+
+def fname(scen,model,run,v,app):
+    """Returns the file name of a processed file (without the folder).
+
+    Input variables:
+        scen,model,run,v: strings indicating the scenario,
+            model,ensemble member run, and the variable name.
+        app: string with the applied operations, for example 'ann_ano'
+            or 'ann_ano_resid' (added just before '.nc')
+    """
+    model_scen=TRANSLATE[scen]['scen']
+    model_time=TRANSLATE[scen]['time']
+    return model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_"+app+".nc"
+
+
+def fpath(scen,model,run,v,app,realm=None):
+    """Returns the full path (OUTPATH, sub-folder and file name)."""
+    return OUTPATH+subdir(scen,v,realm)+fname(scen,model,run,v,app)
+
+
+def obs_subdir(v,realm=None):
+    """Returns the sub-folder (relative to OUTPATH) of the observations."""
+    if realm != None:
+        return "obs/"+realm+"/"+v+"/"
+    else:
+        return "obs/"+v+"/"
+
+
+def obs_fname(obs,v,app):
+    """Returns the file name of a processed observational file.
+
+    Input variables:
+        obs: name of the observational product (key of OBSLIST)
+        v: variable name (as in VARLIST)
+        app: string with the applied operations (see fname)
+    """
+    first_year=OBSLIST[obs]['first_year']
+    last_year=OBSLIST[obs]['last_year']
+    obs_time=str(first_year)+"-"+str(last_year)
+    return obs+"_obs_"+v+"_"+obs_time+"_"+app+".nc"
+
+
+def obs_fpath(obs,v,app,realm=None):
+    """Returns the full path of a processed observational file."""
+    return OUTPATH+obs_subdir(v,realm)+obs_fname(obs,v,app)
+
+
+def to_netcdf(ds,outfile,encoding=None):
+    """Writes a xarray dataset to netcdf.
+
+    xarray support of NETCDF4 output format is system
+    dependent. Try NETCDF4 or if fails use the default netcdf format.
+    The optional encoding (for example compression) is only used
+    with NETCDF4.
+    The file is written to a temporary file (unique per process) in the
+    output folder and renamed, so parallel tasks never share a file
+    and no partial output files are left.
+    """
+    tmp=outfile+".tmp"+str(os.getpid())
+    try:
+        ds.to_netcdf(tmp,format="NETCDF4",encoding=encoding)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        ds.to_netcdf(tmp)
+        print("Note: could not save with format='NETCDF4'")
+        print("Use default netcdf format associated with to_netcdf()")
+    os.replace(tmp,outfile)
+    return
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+###############################################################################
+# Cross-model projection indices:
+# the field of every model is projected onto the PDO pattern
+# (EOF mode MODE_PDO from fld_pca.py) of every model and onto
+# additional pattern files (for example an observed PDO pattern).
+# Each EOF file and each field file is read only once; the projections
+# are calculated as blocked matrix products within MEMORY_BUDGET.
+# Patterns and fields on other grids than the first pattern are
+# interpolated with cached operators (regrid.py).
+###############################################################################
+# Results: one netcdf file per scenario (in the scenario folder)
+#   cmip5_scen_var_time_run_ann_ano_resid_cross_proj.nc
+# with the variable proj(model,pattern,time):
+#   model: the model of the field data
+#   pattern: the model (or pattern file) of the projection vector
+###############################################################################
+
+import xarray
+import numpy as np
+import os
+from cmip5 import *
+import cmip5_io
+import fld_engine
+import regrid
+
+
+def load_patterns(models,run,v,realm=None,extra=None):
+    """Reads the PDO patterns of all models and extra pattern files once.
+
+    Input variables:
+        models: list of model names
+        run: ensemble member of the EOF files
+        v: variable name
+        realm: optional subfolder (see cmip5_io.subdir)
+        extra: dictionary name:file with additional pattern files
+            (netcdf variable 'eof' with dimensions lev,lat,lon)
+    Returns the pattern names, the (npattern,npoint) pattern matrix
+    and the lat,lon coordinates of the REGION_PDO domain
+    (None if no pattern file was found). The patterns are on the grid
+    of the first pattern (the others are interpolated).
+    """
+    files=[]
+    for model in models:
+        files.append((model,cmip5_io.fpath('historical',model,run,v,\
+            "ann_ano_resid_eof",realm)))
+    if extra:
+        for name in extra:
+            files.append((name,extra[name]))
+    names=[]
+    patterns=[]
+    lat=None
+    for name,infile in files:
+        if not os.path.exists(infile):
+            print("missing pattern file (skipped): "+infile)
+            continue
+        nc=xarray.open_dataset(infile)
+        is_lon,is_lat=fld_engine.region_mask(nc.lon.values,nc.lat.values,REGION_PDO)
+        if lat is None:
+            lat=nc.lat.values[is_lat]
+            lon=nc.lon.values[is_lon]
+        if regrid.same_grid(nc.lat.values[is_lat],nc.lon.values[is_lon],lat,lon):
+            eof=fld_engine.sel_region(nc['eof'].values[MODE_PDO],is_lon,is_lat)
+        else:
+            print("interpolate pattern to the common grid: "+infile)
+            eof=regrid.regrid_patterns(nc['eof'].values[MODE_PDO],nc.lat.values,\
+                nc.lon.values,lat,lon)
+        patterns.append(np.reshape(eof,-1))
+        names.append(name)
+        nc.close()
+    if len(names)==0:
+        return names,None,None,None
+    return names,np.stack(patterns,axis=0),lat,lon
+
+
+def cross_proj(scen,models,run,v,names,patterns,lat,lon,realm=None,resid=True):
+    """Projection of the fields of all models onto all patterns.
+
+    Input variables:
+        scen: scenario
+        models: list of model names (field data)
+        run: ensemble member of the field data
+        v: variable name
+        names,patterns,lat,lon: output of load_patterns()
+        realm: optional subfolder (see cmip5_io.subdir)
+        resid: use the regression residuals (True) or the anomalies
+    """
+    if resid:
+        app="ann_ano_resid"
+    else:
+        app="ann_ano"
+    # patterns interpolated to the grid of the fields (key: field grid)
+    regridded={}
+    proj=[]
+    found=[]
+    time=None
+    for model in models:
+        infile=cmip5_io.fpath(scen,model,run,v,app,realm)
+        if not os.path.exists(infile):
+            print("missing field file (skipped): "+infile)
+            continue
+        print("field data: "+infile)
+        nc=xarray.open_dataset(infile)
+        is_lon,is_lat=fld_engine.region_mask(nc.lon.values,nc.lat.values,REGION_PDO)
+        flat=nc.lat.values[is_lat]
+        flon=nc.lon.values[is_lon]
+        if regrid.same_grid(flat,flon,lat,lon):
+            fpatterns=patterns
+        else:
+            key=(flat.tobytes(),flon.tobytes())
+            if key not in regridded:
+                print("interpolate patterns to the field grid: "+infile)
+                x=np.reshape(patterns,(len(names),len(lat),len(lon)))
+                regridded[key]=np.reshape(regrid.regrid_patterns(x,lat,lon,flat,flon),\
+                    (len(names),-1))
+            fpatterns=regridded[key]
+        npoint=np.shape(fpatterns)[1]
+        field=fld_engine.sel_region((nc[v].values[:]).squeeze(),is_lon,is_lat)
+        if time is None:
+            time=nc.time
+            try:
+                units=nc[v].units
+            except:
+                units='k'
+        elif nc.time.size != time.size:
+            print("field has a different number of time steps (skipped): "+infile)
+            nc.close()
+            continue
+        nc.close()
+        x=np.reshape(field,(np.shape(field)[0],npoint))
+        nrow,ncol=fld_engine.block_sizes(npoint,np.shape(x)[0],len(names),\
+            MEMORY_BUDGET)
+        proj.append(fld_engine.proj_matrix(x,fpatterns,nrow,ncol).T)
+        found.append(model)
+    if len(found)==0:
+        print("Error: no field data found for scenario "+scen)
+        return None
+    xproj=xarray.DataArray(np.stack(proj,axis=0),coords=[found,names,time],\
+        dims=['model','pattern','time'])
+    xproj.name="proj"
+    xproj.attrs["long_name"]="projection index of model field onto pattern"
+    xproj.attrs['units']=units
+    ds=xarray.Dataset({'proj':xproj})
+    outfile=cmip5_io.fpath(scen,"cmip5",run,v,app+"_cross_proj",realm)
+    cmip5_io.to_netcdf(ds,outfile)
+    print("output file: "+outfile)
+    return ds
+
+
+###############################################################################
+# XPROJ_RUN: ensemble member of the fields and EOFs
+# XPROJ_PATTERNS: additional pattern files name:file
+#   (netcdf variable 'eof' (lev,lat,lon), mode MODE_PDO is used)
+# RESID: projection of residuals (True) or anomalies (False)
+###############################################################################
+XPROJ_RUN=ENSEMBLELIST[0]
+XPROJ_PATTERNS={}
+RESID=True
+
+realm='ocn' # or set to None, depending of sub-folder structure
+
+if __name__ == "__main__":
+    for v in VARLIST:
+        names,patterns,lat,lon=load_patterns(MODELLIST,XPROJ_RUN,v,\
+            realm=realm,extra=XPROJ_PATTERNS)
+        print("patterns: "+str(len(names)))
+        if patterns is None:
+            print("no PDO patterns found for "+v+" (skipped)")
+            continue
+        for scen in SCENARIOLIST:
+            print ("scenario: "+scen)
+            cross_proj(scen,MODELLIST,XPROJ_RUN,v,names,patterns,lat,lon,\
+                realm=realm,resid=RESID)
+    print ("done")
@@ -0,0 +1,192 @@
+#!/usr/bin/python
+###############################################################################
+# Dry run of the processing pipeline (nothing is calculated or written
+# except the optional csv report):
+# lists every task of the configuration in cmip5.py (tasks.py) with
+# its input and output files and estimates
+#   - bytes read and written
+#   - peak memory of the stage
+#   - which outputs exist already
+#   - missing inputs (not existing and not produced by an earlier task)
+# The estimates use the header of the source files (DPATH): from the
+# catalog (catalog.py) if the file is in the catalog, otherwise the
+# header is read with xarray (no data is read).
+###############################################################################
+
+import csv
+import json
+import os
+import xarray
+import numpy as np
+from cmip5 import *
+import catalog
+import tasks
+
+# optional csv report (None: no file)
+DRYRUN_CSV=None
+# number of saved PCA modes (fld_pca.py)
+NMODES=10
+
+
+def source_header(path):
+    """Shape (time,lat,lon), bytes per number and lat,lon coordinates
+    of a source file from the catalog or the file header.
+    Returns None if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    info=None
+    if os.path.exists(catalog.catalog_file()):
+        info=catalog.lookup(path)
+    if info is not None and 'lat' in info['grid'] and 'lon' in info['grid']:
+        dims=info['dims']
+        glat=info['grid']['lat']
+        glon=info['grid']['lon']
+        lat=np.linspace(glat[1],glat[2],glat[0])
+        lon=np.linspace(glon[1],glon[2],glon[0])
+        ntime=dims.get('time',1)
+        itemsize=4 # catalog has no data type: netcdf float
+        return (ntime,len(lat),len(lon)),itemsize,lat,lon
+    nc=xarray.open_dataset(path,decode_times=False)
+    v=[name for name in nc.data_vars if 'time' in nc[name].dims][0]
+    shape=(nc.sizes['time'],nc.sizes['lat'],nc.sizes['lon'])
+    itemsize=nc[v].encoding.get('dtype',nc[v].dtype).itemsize
+    lat=nc.lat.values
+    lon=nc.lon.values
+    nc.close()
+    return shape,itemsize,lat,lon
+
+
+def estimate(task,header):
+    """Bytes read, bytes written and peak memory (bytes) of a task.
+
+    Input parameters:
+        task: task dictionary (tasks.make_task)
+        header: source_header() of the source file of the model run
+    """
+    shape,isz,lat,lon=header
+    npoint=shape[1]*shape[2]
+    lonw,lone,lats,latn=REGION_PDO
+    nreg=int(np.sum((lat>=lats)&(lat<=latn))*np.sum((lon>=lonw)&(lon<=lone)))
+    t=TRANSLATE[task['scen']]
+    ny=t['last_year']-t['first_year']+1
+    th=TRANSLATE['historical']
+    nyh=th['last_year']-th['first_year']+1
+    p=np.dtype(PRECISION).itemsize
+    stage=task['stage']
+    if stage=='mon2ann':
+        # cdo reads the source and streams one time step at a time
+        read=shape[0]*npoint*isz
+        write=ny*npoint*isz
+        mem=2*npoint*8
+    elif stage=='climatology':
+        read=nyh*npoint*isz
+        write=npoint*isz
+        mem=2*npoint*8
+    elif stage=='anomaly':
+        read=(ny+1)*npoint*isz
+        write=ny*npoint*isz
+        mem=3*npoint*8
+    elif stage=='fld_mean':
+        # native field mean: field, zero-filled copy and mask
+        read=ny*npoint*isz
+        write=ny*8*(1+len(FLDMEAN_REGIONS))
+        mem=ny*npoint*(isz+8+1)
+    elif stage=='fld_linreg':
+        read=ny*npoint*isz+ny*8
+        write=ny*npoint*p
+        mem=ny*npoint*(isz+2*p)+3*npoint*p
+    elif stage=='fld_pca':
+        # field, region matrix and SVD of the region matrix
+        read=nyh*npoint*p
+        write=NMODES*nreg*8+nyh*NMODES*8
+        mem=nyh*npoint*p+nyh*nreg*p+3*nyh*nreg*8
+    elif stage=='fld_proj':
+        read=ny*npoint*p+NMODES*nreg*8
+        write=ny*NMODES*8
+        mem=ny*npoint*p+NMODES*nreg*8
+    return read,write,mem
+
+
+def dry_run(realm=None):
+    """Lists all tasks with the estimates. Returns the list of rows."""
+    tasklist=tasks.make_tasks(realm=realm)
+    produced=set()
+    headers={}
+    rows=[]
+    for task in tasklist:
+        src=tasks.source_file(task['scen'],task['model'],task['run'],task['var'])
+        if src not in headers:
+            headers[src]=source_header(src)
+        missing=[f for f in task['inputs'] if not os.path.exists(f) and f not in produced]
+        exists=[f for f in task['outputs'] if os.path.exists(f)]
+        produced.update(task['outputs'])
+        if headers[src] is None:
+            read,write,mem=-1,-1,-1
+        else:
+            read,write,mem=estimate(task,headers[src])
+        rows.append({'task':task['key'],'read':read,'write':write,'memory':mem,\
+            'outputs_exist':len(exists)==len(task['outputs']),\
+            'missing_inputs':missing,'inputs':task['inputs'],\
+            'outputs':task['outputs']})
+    return rows
+
+
+def mb(x):
+    if x<0:
+        return "       ?"
+    return "%8.1f" % (x/1024.**2)
+
+
+def report(rows):
+    """Prints the task table and the totals."""
+    print("%-55s %8s %8s %8s %s" % ("task","read MB","write MB","mem MB","status"))
+    total_read=0
+    total_write=0
+    peak={}
+    for row in rows:
+        if row['missing_inputs']:
+            status="MISSING INPUT"
+        elif row['outputs_exist']:
+            status="done"
+        else:
+            status="todo"
+        print("%-55s %s %s %s %s" % (row['task'],mb(row['read']),mb(row['write']),\
+            mb(row['memory']),status))
+        for f in row['missing_inputs']:
+            print("    missing: "+f)
+        stage=row['task'].split("/")[0]
+        peak[stage]=max(peak.get(stage,0),row['memory'])
+        if not row['outputs_exist']:
+            total_read+=max(0,row['read'])
+            total_write+=max(0,row['write'])
+    print("----------------------------------------------------------")
+    print("tasks: "+str(len(rows))+", to do: "+\
+        str(len([r for r in rows if not r['outputs_exist']])))
+    print("bytes to read:    "+mb(total_read)+" MB")
+    print("bytes to write:   "+mb(total_write)+" MB")
+    for stage in tasks.STAGES:
+        if stage in peak:
+            print("peak memory "+stage+": "+mb(peak[stage])+" MB")
+    return
+
+
+def write_csv(rows,outfile):
+    with open(outfile,"w") as f:
+        writer=csv.writer(f)
+        writer.writerow(['task','read','write','memory','outputs_exist',\
+            'missing_inputs','inputs','outputs'])
+        for row in rows:
+            writer.writerow([row['task'],row['read'],row['write'],row['memory'],\
+                row['outputs_exist'],json.dumps(row['missing_inputs']),\
+                json.dumps(row['inputs']),json.dumps(row['outputs'])])
+    print("report: "+outfile)
+
+
+realm='ocn' # or set to None, depending of sub-folder structure
+
+if __name__ == "__main__":
+    rows=dry_run(realm=realm)
+    report(rows)
+    if DRYRUN_CSV:
+        write_csv(rows,DRYRUN_CSV)
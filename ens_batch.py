@@ -0,0 +1,255 @@
+#!/usr/bin/python
+###############################################################################
+# Ensemble-batched processing: all members in ENSEMBLELIST of a model
+# are loaded into one (member,time,lat,lon) array and processed
+# with array operations across the member axis.
+# The files are opened once per model and the region masks, regression
+# and projection set up once for all members.
+#
+# Stages (see ENS_STAGES below):
+#   'linreg': regression on the global mean time series and residuals
+#             (same output as fld_linreg.py: *_ann_ano_resid.nc)
+#             plus the forced/internal split of the anomalies:
+#             forced signal = ensemble mean, internal = member - ensemble mean
+#             (*_ann_ano_internal.nc and *_ens_ann_ano_stats.nc)
+#   'proj':   projection onto the historical EOFs of each member
+#             (same output as fld_proj.py: *_ann_ano_resid_pdo_proj.nc)
+#             plus ensemble statistics of the projection indices
+#             (*_ens_ann_ano_resid_pdo_proj_stats.nc)
+# The 'proj' stage needs the EOFs from fld_pca.py.
+###############################################################################
+
+import xarray
+import numpy as np
+import os
+from cmip5 import *
+import cmip5_io
+import fld_engine
+import regrid
+
+
+def load_members(scen,model,v,app,realm=None,runs=None,varname=None):
+    """Loads the ensemble members of a model into one array.
+
+    Input variables:
+        scen,model,v: strings indicating the scenario, model
+            and the variable name.
+        app: string with the applied operations in the file name
+            (for example 'ann_ano')
+        realm: optional string argument corresponding to the
+            variable processed that is used for the subfolder structure
+            of the CMIP5 model.
+        runs: list of ensemble members (default ENSEMBLELIST)
+        varname: netcdf variable name (default v)
+    Returns the data array (member,...), the list of runs that
+    were found and the first dataset (for the coordinates).
+    Missing members are skipped.
+    """
+    if runs is None:
+        runs=ENSEMBLELIST
+    if varname is None:
+        varname=v
+    data=[]
+    found=[]
+    nc0=None
+    for run in runs:
+        infile=cmip5_io.fpath(scen,model,run,v,app,realm)
+        if not os.path.exists(infile):
+            print("missing ensemble member (skipped): "+infile)
+            continue
+        nc=xarray.open_dataset(infile)
+        data.append((nc[varname].values[:]).squeeze().astype(PRECISION,copy=False))
+        found.append(run)
+        if nc0 is None:
+            nc0=nc
+        else:
+            nc.close()
+    if len(found)==0:
+        return None,found,None
+    return np.stack(data,axis=0),found,nc0
+
+
+def save_members(x,runs,scen,model,v,app,nc,realm=None):
+    """Saves each member of a (member,time,lat,lon) array
+    in the file layout of fld_linreg.py.
+
+    Input parameters:
+        x: field (4dim array)
+        runs: list of ensemble members (first dimension of x)
+        nc: dataset with the time,lat,lon coordinates and the
+            source variable attributes
+    """
+    m=0
+    for run in runs:
+        xfld=xarray.DataArray(x[m],coords=[nc.time,nc.lat,nc.lon],\
+            dims=['time','lat','lon'])
+        xfld.name=v
+        try:
+            xfld.attrs['long_name']=nc[v].long_name
+        except:
+            print("save_members: could not find attribute 'long_name' for copying")
+        ds=xarray.Dataset({v:xfld})
+        outfile=cmip5_io.fpath(scen,model,run,v,app,realm)
+        cmip5_io.to_netcdf(ds,outfile)
+        print("Output file: "+outfile)
+        m+=1
+    return
+
+
+def ens_linreg(scen,model,v,realm=None):
+    """Regression residuals and forced/internal split for all members.
+
+    Input variables:
+        scen,model,v: strings indicating the scenario, model
+            and the variable name.
+        realm: optional string argument corresponding to the
+            variable processed that is used for the subfolder structure
+            of the CMIP5 model.
+    """
+    field,runs,nc1=load_members(scen,model,v,"ann_ano",realm)
+    if field is None:
+        print("Error: no ensemble members found for "+model+" "+scen)
+        return
+    x,runs_ts,nc2=load_members(scen,model,v,"ann_ano_fldmean",realm,runs=runs)
+    if runs_ts != runs or np.shape(x)[1] != np.shape(field)[1]:
+        print("Error: field and time series members or time samples do not match")
+        print(runs)
+        print(runs_ts)
+        return
+    x=np.reshape(x,np.shape(x)[0:2])
+    print("apply linear regression to "+str(len(runs))+" members ...")
+    a,b,r,res=fld_engine.linreg_field(x,field)
+    save_members(res,runs,scen,model,v,"ann_ano_resid",nc1,realm)
+    # forced signal (ensemble mean) and internal variability
+    forced,spread=fld_engine.ens_stats(field)
+    save_members(field-forced[None,:,:,:],runs,scen,model,v,\
+        "ann_ano_internal",nc1,realm)
+    coords=[nc1.time,nc1.lat,nc1.lon]
+    dims=['time','lat','lon']
+    xmean=xarray.DataArray(forced,coords=coords,dims=dims)
+    xmean.attrs['long_name']='ensemble mean (forced signal)'
+    xstd=xarray.DataArray(spread,coords=coords,dims=dims)
+    xstd.attrs['long_name']='ensemble spread (standard deviation)'
+    xres=xarray.DataArray(fld_engine.ens_stats(res)[1],coords=coords,dims=dims)
+    xres.attrs['long_name']='ensemble spread of regression residuals'
+    try:
+        for xhelp in [xmean,xstd,xres]:
+            xhelp.attrs['units']=nc1[v].units
+    except:
+        print("ens_linreg: could not find attribute 'units' for copying")
+    ds=xarray.Dataset({'ensmean':xmean,'ensstd':xstd,'resid_ensstd':xres})
+    ds.attrs['members']=" ".join(runs)
+    outfile=cmip5_io.fpath(scen,model,"ens",v,"ann_ano_stats",realm)
+    cmip5_io.to_netcdf(ds,outfile)
+    print("Ensemble statistics: "+outfile)
+    nc1.close()
+    nc2.close()
+    return
+
+
+def ens_proj(scen,model,v,realm=None,resid=True):
+    """Projection indices of all members onto their historical EOFs.
+
+    Input variables:
+        scen,model,v: strings indicating the scenario, model
+            and the variable name.
+        realm: optional string argument corresponding to the
+            variable processed that is used for the subfolder structure
+            of the CMIP5 model.
+        resid: use the regression residuals (True) or the anomalies
+    """
+    if resid:
+        app="ann_ano_resid"
+    else:
+        app="ann_ano"
+    field,runs,nc1=load_members(scen,model,v,app,realm)
+    if field is None:
+        print("Error: no ensemble members found for "+model+" "+scen)
+        return
+    eof,runs_eof,nc2=load_members('historical',model,v,"ann_ano_resid_eof",\
+        realm,runs=runs,varname='eof')
+    if runs_eof != runs:
+        print("Error: EOF files missing for some members")
+        print(runs)
+        print(runs_eof)
+        return
+    is_lon1,is_lat1=fld_engine.region_mask(nc1.lon.values,nc1.lat.values,REGION_PDO)
+    is_lon2,is_lat2=fld_engine.region_mask(nc2.lon.values,nc2.lat.values,REGION_PDO)
+    field_npac=fld_engine.sel_region(field,is_lon1,is_lat1)
+    field_eof=fld_engine.sel_region(eof,is_lon2,is_lat2)
+    lat1=nc1.lat.values[is_lat1]
+    lon1=nc1.lon.values[is_lon1]
+    if not regrid.same_grid(lat1,lon1,nc2.lat.values[is_lat2],nc2.lon.values[is_lon2]):
+        # EOFs on another grid: interpolate to the field grid (regrid.py)
+        field_eof=regrid.regrid_patterns(eof,nc2.lat.values,nc2.lon.values,\
+            lat1,lon1).astype(PRECISION)
+    print("project "+str(len(runs))+" members ...")
+    proj=fld_engine.proj_fields(field_npac,field_eof)
+    lev=nc2.lev
+    try:
+        units=nc1[v].units
+    except:
+        units='k'
+    m=0
+    for run in runs:
+        xproj=xarray.DataArray(proj[m],coords=[nc1.time,lev],dims=['time','lev'])
+        xproj.name="proj"
+        xproj.attrs["long_name"]="projection index"
+        xproj.attrs['units']=units
+        ds=xarray.Dataset({'proj':xproj})
+        outfile=cmip5_io.fpath(scen,model,run,v,app+"_pdo_proj",realm)
+        cmip5_io.to_netcdf(ds,outfile)
+        print("outfile: "+outfile)
+        m+=1
+    # forced (ensemble mean) and internal part of the indices
+    pmean,pstd=fld_engine.ens_stats(proj)
+    xmean=xarray.DataArray(pmean,coords=[nc1.time,lev],dims=['time','lev'])
+    xmean.attrs['long_name']='ensemble mean projection index (forced signal)'
+    xstd=xarray.DataArray(pstd,coords=[nc1.time,lev],dims=['time','lev'])
+    xstd.attrs['long_name']='ensemble spread of projection index'
+    xint=xarray.DataArray(proj-pmean[None,:,:],\
+        coords=[runs,nc1.time,lev],dims=['member','time','lev'])
+    xint.attrs['long_name']='internal part of projection index'
+    for xhelp in [xmean,xstd,xint]:
+        xhelp.attrs['units']=units
+    ds=xarray.Dataset({'ensmean':xmean,'ensstd':xstd,'internal':xint})
+    outfile=cmip5_io.fpath(scen,model,"ens",v,app+"_pdo_proj_stats",realm)
+    cmip5_io.to_netcdf(ds,outfile)
+    print("Ensemble statistics: "+outfile)
+    nc1.close()
+    nc2.close()
+    return
+
+
+###############################################################################
+# ENS_STAGES: stages applied to each model
+# (the 'proj' stage requires the EOF files from fld_pca.py)
+# RESID: projection of residuals (True) or anomalies (False)
+###############################################################################
+ENS_STAGES=['linreg','proj']
+RESID=True
+
+realm='ocn' # or set to None, depending of sub-folder structure
+
+if __name__ == "__main__":
+    for stage in ENS_STAGES:
+        iscen=0
+        for scen in SCENARIOLIST:
+            print ("stage: "+stage+" scenario: "+scen)
+            nmodel=0
+            for model in MODELLIST:
+                print ("model: "+model)
+                i=0
+                for v in VARLIST:
+                    if stage=='linreg':
+                        ens_linreg(scen,model,v,realm=realm)
+                    elif stage=='proj':
+                        ens_proj(scen,model,v,realm=realm,resid=RESID)
+                    i+=1
+                nmodel+=1
+            print ("----------------------------------------------------------")
+            print ("stats for simulations "+scen+" : variable "+v)
+            print ("models: "+str(nmodel)+" variables: "+str(i)+\
+                " members: "+str(len(ENSEMBLELIST)))
+            iscen+=1
+    print ("done")
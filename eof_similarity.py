@@ -0,0 +1,273 @@
+#!/usr/bin/python
+###############################################################################
+# Cross-model similarity of the PDO patterns (EOF mode MODE_PDO)
+# from fld_pca.py.
+# The EOFs of all models are loaded once into a (model,ocean_point)
+# matrix and the model-by-model pattern correlation (uncentered,
+# optionally area weighted) is calculated with matrix products.
+# Pattern correlations use the grid points where both patterns are valid.
+# EOF signs are arbitrary: the signs are aligned to a reference pattern
+# (SIM_REFERENCE file or the first model of the model list, MODELLIST).
+###############################################################################
+# Results: one netcdf file in the historical folder
+#   cmip5_historical_var_time_run_ann_ano_resid_eof_similarity.nc
+# with the patterns, the similarity matrix (raw and sign aligned)
+# and the sign of each model.
+# The netcdf file is also used as cache: models that are already in the
+# file are not read again and only the rows of the new models are
+# calculated. The modification time of each EOF file is stored: the rows
+# of models with a changed (or deleted) EOF file are recalculated. The
+# cache is recalculated if the area weighting, MODE_PDO or REGION_PDO
+# changed. Models without EOF file are skipped.
+###############################################################################
+
+import xarray
+import numpy as np
+import os
+from cmip5 import *
+import cmip5_io
+import fld_engine
+import regrid
+
+
+def eof_file(model,run,v,realm=None):
+    """EOF file of one model (fld_pca.py)."""
+    return cmip5_io.fpath('historical',model,run,v,"ann_ano_resid_eof",realm)
+
+
+def eof_mtime(model,run,v,realm=None):
+    """Modification time of the EOF file (nan if the file is missing)."""
+    infile=eof_file(model,run,v,realm)
+    if not os.path.exists(infile):
+        return np.nan
+    return os.path.getmtime(infile)
+
+
+def load_pattern(model,run,v,realm=None,mode=MODE_PDO,grid=None):
+    """Reads the EOF pattern of one model in the REGION_PDO domain.
+
+    If grid (lat,lon) is given and the EOF is on another grid, the
+    pattern is interpolated to this grid (regrid.py).
+    Returns the pattern (2dim lat,lon) and the lat,lon coordinates
+    (None if the EOF file is missing).
+    """
+    infile=eof_file(model,run,v,realm)
+    if not os.path.exists(infile):
+        print("missing pattern file (skipped): "+infile)
+        return None,None,None
+    print("EOF file: "+infile)
+    nc=xarray.open_dataset(infile)
+    is_lon,is_lat=fld_engine.region_mask(nc.lon.values,nc.lat.values,REGION_PDO)
+    lat=nc.lat.values[is_lat]
+    lon=nc.lon.values[is_lon]
+    if grid is None or regrid.same_grid(lat,lon,grid[0],grid[1]):
+        eof=fld_engine.sel_region(nc['eof'].values[mode],is_lon,is_lat)
+    else:
+        print("interpolate EOF to the common grid")
+        lat,lon=grid
+        eof=regrid.regrid_patterns(nc['eof'].values[mode],nc.lat.values,\
+            nc.lon.values,lat,lon)
+    nc.close()
+    return eof,lat,lon
+
+
+def area_weights(lat,nlon,weighting=True):
+    """Returns flattened (lat*lon) cos(lat) weights or ones."""
+    if weighting:
+        w=np.cos(np.deg2rad(lat))
+    else:
+        w=np.ones(len(lat))
+    return np.repeat(w,nlon)
+
+
+def similarity_rows(xnew,x,w):
+    """Uncentered pattern correlation of the patterns in xnew with all
+    patterns in x.
+
+    Input parameters:
+        xnew: (nnew,npoint) array with patterns (nan for missing values)
+        x: (nall,npoint) array with patterns (nan for missing values)
+        w: (npoint) weights
+    Each correlation uses only the grid points valid in both patterns
+    (pairwise overlap), computed for all pairs with three matrix products.
+    """
+    mn=np.isfinite(xnew).astype(float)
+    m=np.isfinite(x).astype(float)
+    xn=np.where(mn>0,xnew,0.)
+    xa=np.where(m>0,x,0.)
+    num=np.dot(w*xn,xa.T)
+    # squared pattern lengths on the common grid points
+    ann=np.dot(w*xn*xn,m.T)
+    aa=np.dot(mn,(w*xa*xa).T)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        return num/np.sqrt(ann*aa)
+
+
+def align_signs(s,iref):
+    """Signs (+1,-1) that align all patterns with reference row iref."""
+    sign=np.sign(s[:,iref])
+    sign[sign==0]=1.
+    sign[~np.isfinite(sign)]=1.
+    return sign
+
+
+def save_result(outfile,models,eof,lat,lon,s,sign,ref_corr,weighting,reference,\
+    mtime):
+    """Saves patterns, similarity matrix and signs in one netcdf file
+    (reference: name of the reference pattern, mtime: modification
+    times of the EOF files)."""
+    xeof=xarray.DataArray(eof,coords=[models,lat,lon],dims=['model','lat','lon'])
+    xeof.attrs['long_name']="eigenvector mode "+str(MODE_PDO+1)
+    xeof.attrs['units']='1'
+    xs=xarray.DataArray(s,coords=[models,models],dims=['model','model2'])
+    xs.attrs['long_name']='pattern correlation'
+    xs.attrs['units']='1'
+    xsa=xarray.DataArray(s*sign[:,None]*sign[None,:],coords=[models,models],\
+        dims=['model','model2'])
+    xsa.attrs['long_name']='pattern correlation (signs aligned)'
+    xsa.attrs['units']='1'
+    xsign=xarray.DataArray(sign,coords=[models],dims=['model'])
+    xsign.attrs['long_name']='sign applied to align with reference pattern'
+    xref=xarray.DataArray(ref_corr,coords=[models],dims=['model'])
+    xref.attrs['long_name']='pattern correlation with reference pattern'
+    xmtime=xarray.DataArray(mtime,coords=[models],dims=['model'])
+    xmtime.attrs['long_name']='modification time of the EOF file (seconds since 1970-01-01)'
+    xmtime.attrs['units']='s'
+    ds=xarray.Dataset({'eof':xeof,'similarity':xs,'similarity_aligned':xsa,\
+        'sign':xsign,'ref_corr':xref,'mtime':xmtime})
+    ds.attrs['area_weighting']=int(weighting)
+    ds.attrs['mode']=MODE_PDO
+    ds.attrs['region']=np.asarray(REGION_PDO,dtype=np.float64)
+    ds.attrs['reference']=reference
+    cmip5_io.to_netcdf(ds,outfile)
+    print("similarity matrix written to: "+outfile)
+    return ds
+
+
+def eof_similarity(models,run,v,realm=None,weighting=True):
+    """Similarity matrix of the PDO patterns of all models.
+
+    Input variables:
+        models: list of model names (for example MODELLIST)
+        run: ensemble member of the EOF files
+        v: variable name
+        realm: optional string argument corresponding to the
+            variable processed that is used for the subfolder structure
+            of the CMIP5 model.
+        weighting: apply cos(lat) area weighting
+    """
+    if len(models)==0:
+        print("Error: no models for the similarity matrix")
+        return None
+    outfile=cmip5_io.fpath('historical',"cmip5",run,v,\
+        "ann_ano_resid_eof_similarity",realm)
+    cached=[]
+    if os.path.exists(outfile):
+        nc=xarray.open_dataset(outfile)
+        region=np.atleast_1d(nc.attrs.get('region',[]))
+        if int(nc.attrs.get('area_weighting',-1))==int(weighting) and \
+            int(nc.attrs.get('mode',-1))==MODE_PDO and \
+            np.array_equal(region,np.asarray(REGION_PDO,dtype=np.float64)) and \
+            'mtime' in nc:
+            cached=[str(m) for m in nc.model.values]
+            eof=nc['eof'].values
+            s=nc['similarity'].values
+            mtime=nc['mtime'].values
+            lat=nc.lat.values
+            lon=nc.lon.values
+            print("cached models: "+str(len(cached)))
+        else:
+            print("cache has different area weighting, mode or region "+\
+                "(or no EOF file times), "+\
+                "recalculate all rows")
+        nc.close()
+    # models with a changed or deleted EOF file are recalculated
+    keep=[i for i in range(len(cached)) if \
+        eof_mtime(cached[i],run,v,realm)==mtime[i]]
+    if len(keep)<len(cached):
+        print("changed EOF files: "+", ".join([m for m in cached if \
+            cached.index(m) not in keep]))
+        cached=[cached[i] for i in keep]
+        eof=eof[keep]
+        s=s[np.ix_(keep,keep)]
+        mtime=mtime[keep]
+    if len(cached)>0:
+        grid=(lat,lon)
+    else:
+        grid=None
+    new=[]
+    patterns=[]
+    for model in models:
+        if model in cached:
+            continue
+        t=eof_mtime(model,run,v,realm)
+        e,lat_new,lon_new=load_pattern(model,run,v,realm,grid=grid)
+        if e is None:
+            continue
+        if grid is None:
+            grid=(lat_new,lon_new)
+            lat,lon=grid
+        new.append((model,t))
+        patterns.append(e)
+    if len(cached)+len(new)==0:
+        print("Error: no EOF files for the similarity matrix")
+        return None
+    allmodels=cached+[m for m,t in new]
+    w=area_weights(lat,len(lon),weighting)
+    if len(cached)==0:
+        eof=np.stack(patterns,axis=0)
+        mtime=np.array([t for m,t in new])
+        x=np.reshape(eof,(len(allmodels),-1))
+        s=similarity_rows(x,x,w)
+    elif len(new)>0:
+        eof=np.concatenate([eof,np.stack(patterns,axis=0)],axis=0)
+        mtime=np.concatenate([mtime,[t for m,t in new]])
+        x=np.reshape(eof,(len(allmodels),-1))
+        # only the rows (and columns) of the new models
+        snew=similarity_rows(x[len(cached):],x,w)
+        s=np.block([[s,snew[:,0:len(cached)].T],[snew]])
+    else:
+        x=np.reshape(eof,(len(allmodels),-1))
+    print("new models: "+str(len(new)))
+    # align the signs with the reference pattern
+    if SIM_REFERENCE:
+        nc=xarray.open_dataset(SIM_REFERENCE)
+        is_lon,is_lat=fld_engine.region_mask(nc.lon.values,nc.lat.values,REGION_PDO)
+        if regrid.same_grid(nc.lat.values[is_lat],nc.lon.values[is_lon],lat,lon):
+            ref=fld_engine.sel_region(nc['eof'].values[MODE_PDO],is_lon,is_lat)
+        else:
+            ref=regrid.regrid_patterns(nc['eof'].values[MODE_PDO],nc.lat.values,\
+                nc.lon.values,lat,lon)
+        nc.close()
+        ref_corr=similarity_rows(np.reshape(ref,(1,-1)),x,w)[0]
+        sign=align_signs(ref_corr[:,None],0)
+        reference=SIM_REFERENCE
+    else:
+        # first model of the list with an EOF file
+        reference=([m for m in models if m in allmodels]+allmodels)[0]
+        iref=allmodels.index(reference)
+        ref_corr=s[:,iref]
+        sign=align_signs(s,iref)
+    ds=save_result(outfile,allmodels,eof,lat,lon,s,sign,ref_corr,weighting,\
+        reference,mtime)
+    return ds
+
+
+###############################################################################
+# SIM_RUN: ensemble member used for the EOF of each model
+# SIM_WEIGHTING: cos(lat) area weighting of the pattern correlation
+# SIM_REFERENCE: netcdf file with variable 'eof' (lev,lat,lon) used as
+#   reference for the sign convention (for example an observed PDO pattern)
+#   If None, the first model in MODELLIST is the reference.
+###############################################################################
+SIM_RUN=ENSEMBLELIST[0]
+SIM_WEIGHTING=True
+SIM_REFERENCE=None
+
+realm='ocn' # or set to None, depending of sub-folder structure
+
+if __name__ == "__main__":
+    for v in VARLIST:
+        ds=eof_similarity(MODELLIST,SIM_RUN,v,realm=realm,weighting=SIM_WEIGHTING)
+        print(ds['similarity_aligned'].values)
+    print ("done")
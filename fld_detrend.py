@@ -0,0 +1,160 @@
+#!/usr/bin/python
+###############################################################################
+# Multi-predictor detrending of the annual anomalies
+# (generalization of the regression on the global mean in fld_linreg.py)
+# A design matrix with a constant and the predictors in
+# DETREND_PREDICTORS is fitted to every grid point at once (least squares
+# with the pseudoinverse of the design matrix). The pseudoinverse is
+# reused for all grid points and for all members with the same predictors.
+# Predictors:
+#   'fldmean'            global mean time series of the member
+#                        (*_ann_ano_fldmean.nc, see fld_mean.py)
+#   'fldmean_<region>'   regional mean time series of the member
+#                        (FLDMEAN_REGIONS, fld_mean.py with NATIVE=True)
+#   'ensmean_fldmean'    global mean of the ensemble mean (forced signal)
+#   'poly1','poly2',...  polynomial time trends up to 1st, 2nd ... order
+#                        ('polyN': columns t**1 ... t**N)
+# DETREND_ENSMEAN=True subtracts the ensemble mean field (forced signal
+# at each grid point) before the fit (needs at least 2 members).
+###############################################################################
+# Results: residuals in *_ann_ano_resid.nc (same layout as fld_linreg.py,
+# input for fld_pca.py and fld_proj.py) and the coefficients
+# in *_ann_ano_detrend_coef.nc
+###############################################################################
+
+import xarray
+import numpy as np
+from cmip5 import *
+import cmip5_io
+import fld_engine
+import ens_batch
+
+
+def design_matrix(predictors,ts,m,ntime):
+    """Design matrix (time,1+npredictor) of member m.
+
+    Input parameters:
+        predictors: list of predictor names (see DETREND_PREDICTORS)
+        ts: dictionary with the (member,time) arrays of the
+            field mean time series (key: netcdf variable name)
+        m: member index
+        ntime: number of time steps
+    """
+    cols=[np.ones(ntime)]
+    t=np.linspace(-1.,1.,ntime) # scaled time for polynomial trends
+    for name in predictors:
+        if name.startswith('poly'):
+            for k in range(1,int(name[4:])+1):
+                cols.append(t**k)
+        elif name=='ensmean_fldmean':
+            cols.append(np.mean(ts['fldmean'],axis=0))
+        elif name.startswith('fldmean'):
+            cols.append(ts[name][m])
+        else:
+            raise ValueError("unknown predictor "+name)
+    return np.stack(cols,axis=1)
+
+
+def column_names(predictors):
+    """Names of the columns of the design matrix ('polyN' -> t1 ... tN)."""
+    names=['const']
+    for name in predictors:
+        if name.startswith('poly'):
+            names+=['t'+str(k) for k in range(1,int(name[4:])+1)]
+        else:
+            names.append(name)
+    return names
+
+
+def detrend(scen,model,v,predictors,realm=None,ensmean=False):
+    """Removes the predictors from all members of a model.
+
+    Input variables:
+        scen,model,v: strings indicating the scenario, model
+            and the variable name.
+        predictors: list of predictor names (see DETREND_PREDICTORS)
+        realm: optional string argument corresponding to the
+            variable processed that is used for the subfolder structure
+            of the CMIP5 model.
+        ensmean: subtract the ensemble mean field before the fit
+    """
+    field,runs,nc1=ens_batch.load_members(scen,model,v,"ann_ano",realm)
+    if field is None:
+        print("Error: no ensemble members found for "+model+" "+scen)
+        return
+    ntime=np.shape(field)[1]
+    ts={}
+    tsnames=[name for name in predictors if name.startswith('fldmean')]
+    if 'ensmean_fldmean' in predictors:
+        tsnames.append('fldmean')
+    for name in set(tsnames):
+        varname=v+name[7:] # 'fldmean_npac' -> 'tos_npac'
+        x,runs_ts,nc2=ens_batch.load_members(scen,model,v,"ann_ano_fldmean",\
+            realm,runs=runs,varname=varname)
+        if runs_ts != runs or np.shape(x)[1] != ntime:
+            print("Error: field and time series members or time samples do not match")
+            return
+        ts[name]=np.reshape(x,(len(runs),ntime)).astype(np.float64)
+        nc2.close()
+    if ensmean and len(runs)<2:
+        print("Error: ensemble mean removal needs at least 2 members ("+\
+            model+" "+scen+" has "+str(len(runs))+")")
+        nc1.close()
+        return
+    if ensmean:
+        forced=np.mean(field,axis=0)
+        field=field-forced[None,:,:,:]
+    print("fit "+str(len(predictors))+" predictors to "+str(len(runs))+" members ...")
+    res=np.empty(np.shape(field),dtype=field.dtype)
+    coef=[]
+    m=0
+    for run in runs:
+        g=design_matrix(predictors,ts,m,ntime)
+        c,res[m]=fld_engine.lsq_detrend(g,field[m])
+        coef.append(c)
+        m+=1
+    ens_batch.save_members(res,runs,scen,model,v,"ann_ano_resid",nc1,realm)
+    lev=column_names(predictors)
+    m=0
+    for run in runs:
+        xcoef=xarray.DataArray(coef[m],coords=[lev,nc1.lat,nc1.lon],\
+            dims=['predictor','lat','lon'])
+        xcoef.attrs['long_name']='least-squares coefficients'
+        ds=xarray.Dataset({'coef':xcoef})
+        ds.attrs['ensmean_removed']=int(ensmean)
+        outfile=cmip5_io.fpath(scen,model,run,v,"ann_ano_detrend_coef",realm)
+        cmip5_io.to_netcdf(ds,outfile)
+        m+=1
+    nc1.close()
+    return
+
+
+###############################################################################
+# DETREND_PREDICTORS: list of predictors (see header)
+#   ['fldmean'] gives the same residuals as fld_linreg.py; other
+#   predictors overwrite the fld_linreg.py residuals (*_ann_ano_resid.nc)
+# DETREND_ENSMEAN: subtract the ensemble mean field before the fit
+###############################################################################
+DETREND_PREDICTORS=['fldmean']
+DETREND_ENSMEAN=False
+
+realm='ocn' # or set to None, depending of sub-folder structure
+
+if __name__ == "__main__":
+    iscen=0
+    for scen in SCENARIOLIST:
+        print ("scenario: "+scen)
+        nmodel=0
+        for model in MODELLIST:
+            print ("model: "+model)
+            i=0
+            for v in VARLIST:
+                detrend(scen,model,v,DETREND_PREDICTORS,realm=realm,\
+                    ensmean=DETREND_ENSMEAN)
+                i+=1
+            nmodel+=1
+        print ("----------------------------------------------------------")
+        print ("stats for simulations "+scen+" : variable "+v)
+        print ("models: "+str(nmodel)+" variables: "+str(i))
+        iscen+=1
+    print ("done")
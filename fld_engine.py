@@ -0,0 +1,345 @@
+###############################################################################
+# Array operations (numpy) shared by the processing scripts.
+# The functions work on whole arrays instead of looping over
+# grid points and time steps. Leading dimensions (for example
+# the ensemble member dimension) are handled by broadcasting:
+#   field: (...,time,lat,lon)
+#   index: (...,time)
+###############################################################################
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.stats import t as tdist
+
+
+# cache of region masks (key: coordinates and region)
+_MASK_CACHE={}
+
+
+def region_mask(lon,lat,region):
+    """Returns the boolean lon and lat masks for a lat-lon region.
+
+    The masks are cached: files on the same grid (all models on
+    OUTGRID and the remapped observations) reuse them.
+
+    Input parameters:
+        lon,lat: 1-dim coordinate arrays
+        region: tuple (lonw,lone,lats,latn), for example REGION_PDO
+    """
+    lon=np.asarray(lon)
+    lat=np.asarray(lat)
+    key=(lon.dtype.str,lon.tobytes(),lat.dtype.str,lat.tobytes(),tuple(region))
+    if key not in _MASK_CACHE:
+        sellon=region[0:2]
+        sellat=region[2:4]
+        is_lon=np.logical_and(lon>=sellon[0],lon<=sellon[1])
+        is_lat=np.logical_and(lat>=sellat[0],lat<=sellat[1])
+        is_lon.flags.writeable=False
+        is_lat.flags.writeable=False
+        _MASK_CACHE[key]=(is_lon,is_lat)
+    return _MASK_CACHE[key]
+
+
+def sel_region(field,is_lon,is_lat):
+    """Selects the sub-domain from a (...,lat,lon) field."""
+    buffer=field[...,is_lon]
+    return buffer[...,is_lat,:]
+
+
+def linreg_field(x,field):
+    """Linear regression of the field on the index at each grid point.
+
+    Same results as scipy.stats.linregress(x,field[:,j,k]) in the
+    loop of fld_linreg.linreg, but for all grid points at once.
+    Grid points with missing values (nan) return nan.
+    The results have the precision of the field (float32 or float64).
+
+    Input parameters:
+        x: index time series (...,time)
+        field: field data (...,time,lat,lon)
+    Returns intercept a, slope b, correlation r (...,lat,lon)
+    and the residual field (...,time,lat,lon).
+    """
+    # means, sums of squares and products in float64, arrays in the field precision
+    dtype=field.dtype
+    x=np.asarray(x)
+    xm=np.mean(x,axis=-1,dtype=np.float64)
+    xa=x-xm[...,None]
+    sxx=np.sum(xa*xa,axis=-1)
+    fm=np.mean(field,axis=-3,dtype=np.float64)
+    sxy=np.einsum('...t,...tjk->...jk',xa,field,dtype=np.float64)
+    b=(sxy/sxx[...,None,None]).astype(dtype)
+    a=(fm-b*xm[...,None,None]).astype(dtype)
+    res=field-a[...,None,:,:]-b[...,None,:,:]*x.astype(dtype)[...,:,None,None]
+    # total sum of squares = explained + residual sum of squares
+    syy=b*b*sxx[...,None,None]+np.sum(res*res,axis=-3,dtype=np.float64)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        r=(b*np.sqrt(sxx[...,None,None]/syy)).astype(dtype)
+    return a,b,r,res
+
+
+def proj_fields(field,eof):
+    """Projection of all time steps of the field onto the patterns.
+
+    Same results as the proj_field() loop over time steps and modes
+    in fld_pca.py and fld_proj.py: dot product over the grid points
+    where field and pattern are both valid, divided by the pattern
+    length over the same grid points. The dot products are accumulated
+    in float64, the result has the precision of the input.
+
+    Input parameters:
+        field: field data (...,time,lat,lon)
+        eof: patterns (nmodes,lat,lon) or one set of patterns for
+            each leading dimension of the field (...,nmodes,lat,lon)
+    Returns the projection indices (...,time,nmodes)
+    """
+    nlat,nlon=np.shape(field)[-2:]
+    dtype=np.result_type(field,eof)
+    x=np.reshape(field,np.shape(field)[:-2]+(nlat*nlon,))
+    e=np.reshape(eof,np.shape(eof)[:-2]+(nlat*nlon,))
+    is_x=np.isfinite(x)
+    xz=np.where(is_x,x,0).astype(np.float64,copy=False)
+    ez=np.where(np.isfinite(e),e,0).astype(np.float64,copy=False)
+    et=np.swapaxes(ez,-1,-2)
+    num=np.matmul(xz,et)
+    den=np.sqrt(np.matmul(is_x.astype(np.float64),et*et))
+    return (num/den).astype(dtype,copy=False)
+
+
+def ens_stats(x,axis=0):
+    """Ensemble mean and spread (standard deviation) along the member axis.
+
+    The spread is zero for a single member.
+    """
+    xmean=np.mean(x,axis=axis)
+    if np.shape(x)[axis]>1:
+        xstd=np.std(x,axis=axis,ddof=1)
+    else:
+        xstd=np.zeros(np.shape(xmean),dtype=xmean.dtype)
+    return xmean,xstd
+
+
+def proj_matrix(x,e,nrow=None,ncol=None):
+    """Blocked projection of the rows of x onto the rows of e.
+
+    Same results as proj_fields() for 2-dim arrays, but calculated
+    in blocks of nrow rows of x and ncol patterns so that the
+    temporary arrays stay small. The dot products are accumulated in
+    float64 (one block of x at a time is converted).
+
+    Input parameters:
+        x: (nsample,npoint) array (nan for missing values)
+        e: (npattern,npoint) array (nan for missing values)
+        nrow,ncol: block sizes (default: all rows, all patterns)
+    Returns the projection indices (nsample,npattern)
+    """
+    nx=np.shape(x)[0]
+    ne=np.shape(e)[0]
+    if nrow is None:
+        nrow=nx
+    if ncol is None:
+        ncol=ne
+    proj=np.empty((nx,ne),dtype=np.result_type(x,e))
+    ez=np.where(np.isfinite(e),e,0).astype(np.float64,copy=False)
+    ez2=ez*ez
+    i=0
+    while i<nx:
+        xb=x[i:i+nrow]
+        is_x=np.isfinite(xb)
+        xz=np.where(is_x,xb,0).astype(np.float64,copy=False)
+        is_x=is_x.astype(np.float64)
+        j=0
+        while j<ne:
+            num=np.dot(xz,ez[j:j+ncol].T)
+            den=np.sqrt(np.dot(is_x,ez2[j:j+ncol].T))
+            proj[i:i+nrow,j:j+ncol]=num/den
+            j+=ncol
+        i+=nrow
+    return proj
+
+
+def block_sizes(npoint,nrow,ncol,budget,itemsize=8):
+    """Block sizes (rows,patterns) for proj_matrix within a memory budget.
+
+    The temporary arrays of one block are about
+    (2*rows+patterns)*npoint+2*rows*patterns numbers.
+    """
+    nmax=max(1,int(budget//itemsize))
+    bcol=min(ncol,max(1,nmax//(4*npoint)))
+    brow=max(1,(nmax-bcol*npoint)//(2*npoint+2*bcol))
+    return min(nrow,brow),bcol
+
+
+def regress_indices(idx,field):
+    """Regression of the field on several index time series at once.
+
+    Same results as scipy.stats.linregress(idx[:,m],field[:,j,k]) for
+    every index m and grid point j,k, calculated with one matrix product.
+    Grid points with missing values (nan) return nan.
+
+    Input parameters:
+        idx: index time series (time,nindex)
+        field: field data (time,lat,lon)
+    Returns slope, intercept, correlation r and the two-sided
+    p-value (t-test, time-2 degrees of freedom), each (nindex,lat,lon).
+    The sums are accumulated in float64, the results have the precision
+    of the field.
+    """
+    ntime,nlat,nlon=np.shape(field)
+    x=np.reshape(field,(ntime,nlat*nlon))
+    dtype=x.dtype
+    idx=np.asarray(idx,dtype=np.float64)
+    im=np.mean(idx,axis=0)
+    ia=idx-im[None,:]
+    sxx=np.sum(ia*ia,axis=0)
+    xm=np.mean(x,axis=0,dtype=np.float64)
+    xa=x-xm[None,:].astype(x.dtype)
+    syy=np.sum(xa*xa,axis=0,dtype=np.float64)
+    sxy=np.einsum('tm,tn->mn',ia,xa,dtype=np.float64)
+    slope=sxy/sxx[:,None]
+    intercept=xm[None,:]-slope*im[:,None]
+    with np.errstate(invalid='ignore',divide='ignore'):
+        r=sxy/np.sqrt(sxx[:,None]*syy[None,:])
+        r=np.clip(r,-1.,1.)
+        tval=r*np.sqrt((ntime-2)/((1.-r)*(1.+r)))
+    pval=2.*tdist.sf(np.abs(tval),ntime-2)
+    pval[np.isnan(r)]=np.nan
+    shape=(np.shape(idx)[1],nlat,nlon)
+    return np.reshape(slope,shape).astype(dtype),\
+        np.reshape(intercept,shape).astype(dtype),\
+        np.reshape(r,shape).astype(dtype),np.reshape(pval,shape).astype(dtype)
+
+
+# cache of pseudoinverse matrices (key: design matrix), cleared when it
+# holds _PINV_CACHE_SIZE entries
+_PINV_CACHE={}
+_PINV_CACHE_SIZE=32
+
+
+def design_pinv(g):
+    """Pseudoinverse of the design matrix g (time,npredictor).
+
+    The pseudoinverse is cached: members and grid points with the same
+    design matrix reuse it.
+    """
+    g=np.ascontiguousarray(g,dtype=np.float64)
+    key=(np.shape(g),g.tobytes())
+    if key not in _PINV_CACHE:
+        if len(_PINV_CACHE)>=_PINV_CACHE_SIZE:
+            _PINV_CACHE.clear()
+        _PINV_CACHE[key]=np.linalg.pinv(g)
+    return _PINV_CACHE[key]
+
+
+def lsq_detrend(g,field):
+    """Least-squares fit of the predictors to every grid point at once.
+
+    Input parameters:
+        g: design matrix (time,npredictor) (including a constant column)
+        field: field data (time,lat,lon)
+    Grid points with missing values (nan) return nan.
+    Returns the coefficients (npredictor,lat,lon) and the residual
+    field (time,lat,lon). The products are accumulated in float64, the
+    results have the precision of the field.
+    """
+    ntime,nlat,nlon=np.shape(field)
+    y=np.reshape(field,(ntime,nlat*nlon))
+    is_valid=np.all(np.isfinite(y),axis=0)
+    pinv=design_pinv(g)
+    g=np.asarray(g,dtype=np.float64)
+    coef=np.empty((np.shape(g)[1],nlat*nlon),dtype=y.dtype)
+    coef[:]=np.nan
+    res=np.empty(np.shape(y),dtype=y.dtype)
+    res[:]=np.nan
+    c=np.einsum('pt,tn->pn',pinv,y[:,is_valid],dtype=np.float64)
+    coef[:,is_valid]=c
+    res[:,is_valid]=y[:,is_valid]-np.einsum('tp,pn->tn',g,c,dtype=np.float64)
+    return np.reshape(coef,(np.shape(g)[1],nlat,nlon)),\
+        np.reshape(res,(ntime,nlat,nlon))
+
+
+def lag_windows(x,lags):
+    """Shifted copies of the index for all lags as rows of a matrix.
+
+    Row l of the result is x shifted by lags[l] time steps: element t
+    is x[t-lags[l]] (positive lag: the index leads), zero where the
+    shifted index is outside the time range. The rows are views of one
+    zero-padded array (sliding window), only the selected rows are copied.
+    Returns the shifted index (nlag,time) and the overlap mask (nlag,time).
+    """
+    x=np.asarray(x,dtype=np.float64)
+    ntime=len(x)
+    lags=np.asarray(lags,dtype=int)
+    maxlag=int(np.max(np.abs(lags)))
+    xpad=np.zeros(ntime+2*maxlag)
+    xpad[maxlag:maxlag+ntime]=x
+    mpad=np.zeros(ntime+2*maxlag)
+    mpad[maxlag:maxlag+ntime]=1.
+    rows=maxlag-lags
+    return sliding_window_view(xpad,ntime)[rows],sliding_window_view(mpad,ntime)[rows]
+
+
+def lag_regress(x,field,lags):
+    """Lead/lag correlation and regression of the field on an index
+    for all lags with three matrix products.
+
+    For lag L the index at time t is paired with the field at time t+L
+    (positive lag: the index leads the field), using the overlapping
+    time steps only. Same results as scipy.stats.linregress on the
+    overlapping samples. Grid points with missing values (nan) return nan.
+
+    Input parameters:
+        x: index time series (time)
+        field: field data (time,lat,lon)
+        lags: list of lags (time steps)
+    Returns the correlation r, slope and number of samples
+    ((nlag,lat,lon), (nlag,lat,lon), (nlag)).
+    """
+    ntime,nlat,nlon=np.shape(field)
+    y=np.reshape(field,(ntime,nlat*nlon))
+    is_valid=np.all(np.isfinite(y),axis=0)
+    y=np.where(is_valid[None,:],y,0).astype(np.float64)
+    xl,ml=lag_windows(x,lags)
+    n=np.sum(ml,axis=1)
+    sx=np.sum(xl,axis=1)
+    sxx=np.sum(xl*xl,axis=1)
+    sy=np.dot(ml,y)
+    syy=np.dot(ml,y*y)
+    sxy=np.dot(xl,y)
+    vx=sxx-sx*sx/n
+    vy=syy-sy*sy/n[:,None]
+    cov=sxy-sx[:,None]*sy/n[:,None]
+    with np.errstate(invalid='ignore',divide='ignore'):
+        r=cov/np.sqrt(vx[:,None]*vy)
+        slope=cov/vx[:,None]
+    r[:,~is_valid]=np.nan
+    slope[:,~is_valid]=np.nan
+    shape=(len(n),nlat,nlon)
+    return np.reshape(r,shape),np.reshape(slope,shape),n
+
+
+def phase_masks(x,threshold=1.):
+    """Boolean time masks (2,time) of the positive and negative phase:
+    standardized index above threshold and below -threshold."""
+    x=np.asarray(x,dtype=np.float64)
+    xs=(x-np.mean(x))/np.std(x,ddof=1)
+    return np.stack([xs>threshold,xs<-threshold],axis=0)
+
+
+def composites(masks,field):
+    """Composite means of the field for boolean time masks
+    with one matrix product.
+
+    Input parameters:
+        masks: (ncomp,time) boolean array (see phase_masks)
+        field: field data (time,lat,lon)
+    Returns the composites (ncomp,lat,lon) and the number of time
+    steps of each composite (nan if a mask selects no time step).
+    """
+    ntime,nlat,nlon=np.shape(field)
+    y=np.reshape(field,(ntime,nlat*nlon))
+    w=masks.astype(np.float64)
+    count=np.sum(w,axis=1)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        comp=np.dot(w,y)/count[:,None]
+    return np.reshape(comp,(len(count),nlat,nlon)),count
@@ -14,6 +14,15 @@
 #
 ##################################################################
 # History
+# 2026-10-19:
+#   The length mismatch of field and time series raises ValueError
+#   (the job journal, journal.py, stops the dependent tasks).
+#   Regression loop in function linreg_points() (also used by
+#   precision_check.py).
+#   save_result() gets the model as argument; script loop only
+#   runs when called as script (functions can be imported).
+#   PRECISION option (cmip5.py): the arrays are kept in float32 or
+#   float64 (default); regression at each grid point in float64.
 # 2019-01-15 by OET:
 #   function save_result()
 #   xarray support of NETCDF4 output format is system
@@ -29,10 +38,11 @@ from scipy.stats import linregress
 #sys.path.append("./modules")
 from cmip5 import *
 
-def save_result(scen,run,varname,x,time,lat,lon,copy_from_source,\
+def save_result(scen,model,run,varname,x,time,lat,lon,copy_from_source,\
                 dflt_units='k',realm=None):
     """saves results in netcdf output format
     input parameters:
+        scen,model,run: scenario, model and ensemble member run
         x: field (3dim array) (residuals from linear regression)
             variable name for  netcdf file variable
         time: coordinates from input netcdf file
@@ -52,11 +62,11 @@ def save_result(scen,run,varname,x,time,lat,lon,copy_from_source,\
     model_time=TRANSLATE[scen]['time']
     # adjust outpath to the subfolder structure 
     if realm != None:
-        subdir_out=model_scen+"/"+realm+"/"+v+"/"
+        subdir_out=model_scen+"/"+realm+"/"+varname+"/"
     else:
-        subdir_out=model_scen+"/"+v+"/"
+        subdir_out=model_scen+"/"+varname+"/"
 
-    outfile=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+\
+    outfile=model+"_"+model_scen+"_"+varname+"_"+model_time+"_"+run+\
     "_ann_ano_"+app+".nc" 
 
     ncsrc=copy_from_source # use shorter variable name
@@ -80,6 +90,32 @@ def save_result(scen,run,varname,x,time,lat,lon,copy_from_source,\
     return ds
 
 
+def linreg_points(x,fielddata):
+    """Linear regression of the field on the time series at each grid point
+    (scipy.stats.linregress, float64).
+
+    Returns intercept a, slope b, correlation r (lat,lon) and the
+    residual field (time,lat,lon) in the precision of the field.
+    """
+    a=np.zeros(shape=np.shape(fielddata[0,:,:]),dtype=fielddata.dtype)
+    b=np.zeros(shape=np.shape(a),dtype=fielddata.dtype)
+    r=np.zeros(shape=np.shape(a),dtype=fielddata.dtype)
+    res=np.zeros(shape=np.shape(fielddata),dtype=fielddata.dtype)
+    j=0
+    jmax=np.shape(fielddata[0,:,0])[0] # [0] helps to get number instead tuple
+    kmax=np.shape(fielddata[0,0,:])[0]
+    while j<jmax:
+        k=0
+        while k<kmax:
+            b[j,k],a[j,k],r[j,k],pval,serr=linregress(x,fielddata[:,j,k])
+            res[:,j,k]=fielddata[:,j,k]-(a[j,k]+b[j,k]*x)
+            k=k+1
+        # end loop k
+        j=j+1
+    # end loop j
+    return a,b,r,res
+
+
 def linreg(scen,model,run,v,realm=None):
     """calculated the linear regression at each grid point with the time series and saves the residual
     variability in a netcdf file.
@@ -115,10 +151,10 @@ def linreg(scen,model,run,v,realm=None):
     ### open the data sets ###
     nc1=xarray.open_dataset(OUTPATH+subdir_out+infile)
     ntime1=nc1.time.size
-    fielddata=(nc1[v].values[:]).squeeze()
+    fielddata=(nc1[v].values[:]).squeeze().astype(PRECISION,copy=False)
     nc2=xarray.open_dataset(OUTPATH+subdir_out+infile_ts)
     ntime2=nc2.time.size
-    x=(nc2[v].values[:]).squeeze()
+    x=(nc2[v].values[:]).squeeze().astype(PRECISION,copy=False)
     if ntime1 != ntime2:
         print ("Error: input files do not have same number of samples in time dimension")
         print("fielddata:")
@@ -127,6 +163,8 @@ def linreg(scen,model,run,v,realm=None):
         print("time series:")
         print(type(x))
         print(np.shape(x))
+        raise ValueError("time dimension of "+infile+" ("+str(ntime1)+\
+            ") and "+infile_ts+" ("+str(ntime2)+") do not match")
     else:
     ### apply linregress to
         print("apply linear regression and remove the signal (saving residual variability) ...")
@@ -135,42 +173,27 @@ def linreg(scen,model,run,v,realm=None):
         print("time series:")
         print(type(x))
         print(np.shape(x))
-        a=np.zeros(shape=np.shape(fielddata[0,:,:]))
-        b=np.zeros(shape=np.shape(a))
-        r=np.zeros(shape=np.shape(a))
-        res=np.zeros(shape=np.shape(fielddata))
-        j=0
-        jmax=np.shape(fielddata[0,:,0])[0] # [0] helps to get number instead tuple
-        kmax=np.shape(fielddata[0,0,:])[0]
-        while j<jmax:
-            k=0
-            while k<kmax:
-                b[j,k],a[j,k],r[j,k],pval,serr=linregress(x,fielddata[:,j,k])
-                res[:,j,k]=fielddata[:,j,k]-(a[j,k]+b[j,k]*x)
-                #print(j,k)
-                k=k+1
-            # end loop k
-            j=j+1
-        # end loop j
-        ds=save_result(scen,run,v,res,time=nc1.time,\
+        a,b,r,res=linreg_points(x,fielddata)
+        ds=save_result(scen,model,run,v,res,time=nc1.time,\
         lat=nc1.lat,\
         lon=nc1.lon,\
-        copy_from_source=nc1[v],realm='ocn')
+        copy_from_source=nc1[v],realm=realm)
 
 
-# Loop over scenarios
-iscen=0
-for scen in SCENARIOLIST:
-    print ("scenario: "+scen)
-    nmodel=0
-    for model in MODELLIST:
-        for run in ENSEMBLELIST:
-            i=0
-            for v in VARLIST:
-                linreg(scen,model,run,v,realm='ocn')
-                i+=1
-        nmodel+=1
-    print ("----------------------------------------------------------")
-    print ("stats for simulations "+scen+" : variable "+v)
-    print ("models: "+str(nmodel)+" variables: "+str(i))
-    iscen+=1
+if __name__ == "__main__":
+    # Loop over scenarios
+    iscen=0
+    for scen in SCENARIOLIST:
+        print ("scenario: "+scen)
+        nmodel=0
+        for model in MODELLIST:
+            for run in ENSEMBLELIST:
+                i=0
+                for v in VARLIST:
+                    linreg(scen,model,run,v,realm='ocn')
+                    i+=1
+            nmodel+=1
+        print ("----------------------------------------------------------")
+        print ("stats for simulations "+scen+" : variable "+v)
+        print ("models: "+str(nmodel)+" variables: "+str(i))
+        iscen+=1
@@ -4,12 +4,22 @@
 # linux command (using annual mean data)
 # The resulting netcdf file contains a single time series
 # (but lon, lat coordinate dimensions will still exist in the output file)
+# NATIVE=True: area-weighted means calculated in python (no CDO call)
+# with cached grid cell areas (grid_area.py). The output file contains
+# the global mean as 1-dim time series (variable name as in the input
+# file) and the regional means of FLDMEAN_REGIONS (variable name
+# with the region name appended, for example tos_npac).
 ###############################################################################
 
 import os
+import xarray
+import numpy as np
 #import sys
 #sys.path.append("./modules")
 from cmip5 import *
+from cdo_chain import run_cdo
+import cmip5_io
+import grid_area
 
 def global_mean(scen,model,run,v,realm='None'):
     """Calculates the global mean (time series) using CDO.
@@ -38,31 +48,58 @@ def global_mean(scen,model,run,v,realm='None'):
     "_ann_ano_"+app+".nc" 
     cdo="cdo  -v fldmean "+\
     OUTPATH+subdir_out+infile+" "+OUTPATH+subdir_out+outfile
-    print(cdo)
-    os.system(cdo)
+    run_cdo(cdo)
     print ("Infile:  "+infile)
     print ("Outfile: "+outfile)
     print ("Folder:  "+OUTPATH+subdir_out)
     return
 
-# Loop over scenarios
-iscen=0
-for scen in SCENARIOLIST:
-    print ("scenario: "+scen)
-    nmodel=0
-    for model in MODELLIST:
-        print ("model: "+model)
-        for run in ENSEMBLELIST:
-            i=0
-            for v in VARLIST:
-                global_mean(scen,model,run,v,realm='ocn')
-                i+=1
-        nmodel+=1
-    print ("----------------------------------------------------------")
-    print ("stats for simulations "+scen+" : variable "+v)
-    print ("models: "+str(nmodel)+" variables: "+str(i))
-    iscen+=1
-
+def global_mean_native(scen,model,run,v,realm=None):
+    """Calculates the area-weighted global and regional means (time series).
+    
+    Input variables:
+        scen,model,run,v: strings indicating the scenario, 
+            model,ensemble member run, and the variable name.
+            These variables are used to form the netcdf file names.
+        realm: optional string argument corresponding to the 
+            variable processed that is used for the subfolder structure
+            of the CMIP5 model.
+    """
+    infile=cmip5_io.fpath(scen,model,run,v,"ann_ano",realm)
+    outfile=cmip5_io.fpath(scen,model,run,v,"ann_ano_fldmean",realm)
+    nc=xarray.open_dataset(infile)
+    field=(nc[v].values[:]).squeeze()
+    names,regions=grid_area.fldmean_regions()
+    w=grid_area.region_weights(nc.lat.values,nc.lon.values,regions)
+    x=grid_area.fld_means(field,w)
+    ds=grid_area.fldmean_dataset(x,nc.time,v,names,nc[v].attrs.get('units'))
+    nc.close()
+    cmip5_io.to_netcdf(ds,outfile)
+    print ("Infile:  "+infile)
+    print ("Outfile: "+outfile)
+    return
 
+# NATIVE: python area-weighted means (True) or CDO fldmean (False)
+NATIVE=True
 
- 
+if __name__ == "__main__":
+    # Loop over scenarios
+    iscen=0
+    for scen in SCENARIOLIST:
+        print ("scenario: "+scen)
+        nmodel=0
+        for model in MODELLIST:
+            print ("model: "+model)
+            for run in ENSEMBLELIST:
+                i=0
+                for v in VARLIST:
+                    if NATIVE:
+                        global_mean_native(scen,model,run,v,realm='ocn')
+                    else:
+                        global_mean(scen,model,run,v,realm='ocn')
+                    i+=1
+            nmodel+=1
+        print ("----------------------------------------------------------")
+        print ("stats for simulations "+scen+" : variable "+v)
+        print ("models: "+str(nmodel)+" variables: "+str(i))
+        iscen+=1
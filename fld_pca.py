@@ -6,10 +6,20 @@
 # (no latitude weighting at the moment)
 ###############################################################################
 # Results are saved in netcdf format:
-# Eigenvectors (PCA pattern) in eof.nc
-# PC time series and explained variance in pc.nc
+# Eigenvectors (PCA pattern) in *_eof.nc
+# PC time series and explained variance in *_pc.nc
 ###############################################################################
 # HISTORY
+# 2026-10-19:
+#   Analysis of one model run in function calc_pca() (can be imported,
+#   for example by journal.py); save_result() writes the output files
+#   directly (cmip5_io.to_netcdf: temporary file in the output folder
+#   and rename) instead of eof.nc and pc.nc in the working directory,
+#   so parallel tasks do not overwrite each other.
+#   PCA and PC time series in function pca_modes() (also used by
+#   obs_pipeline.py and precision_check.py).
+#   PRECISION option (cmip5.py): the arrays are kept in float32 or
+#   float64 (default); dot products are accumulated in float64.
 # 2019-01-15 by OET:
 #   function save_result()
 #   xarray support of NETCDF4 output format is system
@@ -28,6 +38,7 @@ import numpy as np
 import os
 from sklearn.decomposition import PCA
 from cmip5 import *
+import cmip5_io
 
 def field2matrix(x3d):
     """Convert shape of 3dim array into 2dim array.
@@ -57,7 +68,7 @@ def matrix2field(x2d,nlat,nlon,valid_index):
     """
     # inverse transform
     # first expand
-    buffer=np.empty(shape=(len(x2d[:,0]),nlat*nlon))
+    buffer=np.empty(shape=(len(x2d[:,0]),nlat*nlon),dtype=x2d.dtype)
     buffer[:]=np.nan
     i=0
     while i< len(valid_index):
@@ -80,10 +91,49 @@ def proj_field(x,e):
     is_x=~np.isnan(vx)
     is_e=~np.isnan(ve)
     is_use=np.logical_and(is_x,is_e)
-    rhelp=np.dot(vx[is_use],ve[is_use])/np.sqrt(np.dot(ve[is_use],ve[is_use]))
+    # accumulate in float64 (also for float32 input data)
+    vx=vx[is_use].astype(np.float64)
+    ve=ve[is_use].astype(np.float64)
+    rhelp=np.dot(vx,ve)/np.sqrt(np.dot(ve,ve))
     return rhelp
 
-def save_result(eof,pc,time,lat,lon,expvar,copy_from_source,dflt_units='k'):
+def pca_modes(res_npac,nmodes=10):
+    """PCA (EOF) analysis of a (time,lat,lon) field.
+
+    Grid points with missing values are excluded.
+    Returns the EOFs (nmodes,lat,lon), the PC time series (time,nmodes),
+    the explained variance and the fraction of the total variance.
+    """
+    # need a 2dim array with time and grid coordinate as 2nd dim
+    # and have to get rid of grid points with nan
+    nlat,nlon=np.shape(res_npac)[1:]
+    x2d,valid_index=field2matrix(res_npac)
+    #################################################
+    # PCA analysis
+    #################################################
+    print ("calculate PCA ...")
+    pca = PCA().fit(x2d)
+    eof= pca.components_[0:nmodes,:] # leading modes
+    # 1s EOF should represent PDO mode
+    field_eof=matrix2field(eof,nlat,nlon,valid_index)
+    #################################################
+    # Projection of field data onto eigenvector
+    #################################################
+    t=0
+    ntime=len(res_npac[:,0,0])
+    pc=np.zeros((ntime,nmodes),dtype=res_npac.dtype)
+    while t<ntime:
+        m=0
+        while m<nmodes:
+            pc[t,m]=proj_field(res_npac[t,:,:],field_eof[m,:,:])
+            m+=1
+        t+=1
+    return field_eof,pc,pca.explained_variance_[0:nmodes],\
+        pca.explained_variance_ratio_[0:nmodes]
+
+
+def save_result(eof,pc,time,lat,lon,expvar,copy_from_source,dflt_units='k',\
+                expfrac=None,outfile_eof="eof.nc",outfile_pc="pc.nc"):
     """Saves the results from the EOF analysis in netcdf files
 
     Input parameters:
@@ -93,9 +143,12 @@ def save_result(eof,pc,time,lat,lon,expvar,copy_from_source,dflt_units='k'):
         time: coordinates from input netcdf file
         lat,lon: the sub-domain lat, lon coordinates
         expvar: array with explained variance (fractions)
+        expfrac: optional array with the explained variance as
+            fraction of the total variance
         copy_from_source: the field variable from the source  netcdf file
             The copy_from_source provides a netcdf source file (the input field
             data file to copy the information about dimensions, variables, units etc.
+        outfile_eof,outfile_pc: output files (full path)
     """
     ncsrc=copy_from_source # use shorter variable name
     lev=np.arange(1,(len(eof[:,0,0])+1),1)
@@ -105,12 +158,7 @@ def save_result(eof,pc,time,lat,lon,expvar,copy_from_source,dflt_units='k'):
     xeof.attrs['long_name']="eigenvector" # check if that is right
     xeof.attrs['units']='1' # eigenvectors of unit length
     ds1=xarray.Dataset({'eof':xeof})
-    try:
-        ds1.to_netcdf("eof.nc",format="NETCDF4")
-    except:
-        ds1.to_netcdf("eof.nc")
-        print("Note: could not save with format='NETCDF4'")
-        print("Use default netcdf format associated with to_netcdf()")
+    cmip5_io.to_netcdf(ds1,outfile_eof)
 
     # issues with level dimension in ferret so write to separate file
     # but include expvar in here
@@ -126,15 +174,85 @@ def save_result(eof,pc,time,lat,lon,expvar,copy_from_source,dflt_units='k'):
     xexpvar.attrs['long_name']='explained variance'
     xexpvar.attrs['units']='percent'
     ds2=xarray.Dataset({'pc':xpc,'expvar':xexpvar})
-    try:
-        ds2.to_netcdf("pc.nc",format="NETCDF4")
-    except:
-        ds2.to_netcdf("pc.nc")
-        print("Note: could not save with format='NETCDF4'")
-        print("Use default netcdf format associated with to_netcdf()")
+    if expfrac is not None:
+        xexpfrac=xarray.DataArray(expfrac,coords=[lev],dims=['lev'])
+        xexpfrac.attrs['long_name']='fraction of total variance'
+        xexpfrac.attrs['units']='1'
+        ds2['expfrac']=xexpfrac
+    cmip5_io.to_netcdf(ds2,outfile_pc)
     return ds1,ds2
 
 
+def calc_pca(scen,model,run,v,realm=None,resid=True,nmodes=10):
+    """PCA (EOF) analysis of the REGION_PDO domain of one model run.
+
+    Input variables:
+        scen,model,run,v: strings indicating the scenario,
+            model,ensemble member run, and the variable name.
+        realm: optional string argument corresponding to the
+            variable processed that is used for the subfolder structure
+            of the CMIP5 model.
+        resid: use the regression residuals (True) or the anomalies
+        nmodes: number of saved modes
+    """
+    print (v)
+    model_scen=TRANSLATE[scen]['scen']
+    model_time=TRANSLATE[scen]['time']
+    # adjust outpath to the subfolder structure 
+    if realm != None:
+        subdir_out=model_scen+"/"+realm+"/"+v+"/"
+    else:
+        subdir_out=model_scen+"/"+v+"/"
+    # 3-dim field
+    if resid:
+        infile=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano_resid.nc"
+        outfile_eof=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano_resid_eof.nc"
+        outfile_pc=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano_resid_pc.nc"
+    else:
+        infile=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano.nc" 
+        outfile_eof=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano_eof.nc"
+        outfile_pc=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano_pc.nc"
+    ### open the data sets ###
+    nc1=xarray.open_dataset(OUTPATH+subdir_out+infile)
+    ntime1=nc1.time.size
+    fielddata=(nc1[v].values[:]).astype(PRECISION,copy=False)
+    ###nc2=xarray.open_dataset(OUTPATH+infile)
+    #################################################
+    # select North Pacific Domain and apply PCA
+    # to the residuals
+    #################################################
+    sellon=REGION_PDO[0:2]
+    sellat=REGION_PDO[2:4]
+    is_lon=np.logical_and(nc1.lon.values>=sellon[0],nc1.lon.values<=sellon[1])
+    nlon=np.sum(is_lon)
+    is_lat=np.logical_and(nc1.lat.values>=sellat[0],nc1.lat.values<=sellat[1])
+    nlat=np.sum(is_lat)
+    buffer=fielddata[:,:,is_lon]
+    res_npac=buffer[:,is_lat,:]
+    field_eof,pc,expvar,expfrac=pca_modes(res_npac,nmodes)
+    #################################################
+    # savc results into netcdf file
+    #################################################
+    ds1,ds2=save_result(eof=field_eof,pc=pc,\
+    time=nc1.time,lat=nc1.lat[is_lat],\
+    lon=nc1.lon[is_lon],\
+    expvar=expvar,\
+    copy_from_source=nc1[v],\
+    expfrac=expfrac,\
+    outfile_eof=OUTPATH+subdir_out+outfile_eof,\
+    outfile_pc=OUTPATH+subdir_out+outfile_pc)
+
+    # figures (EOF map, explained variance): see plot_pdo.py
+    print ("Input file for PCA (EOF) analysis: ")
+    print(OUTPATH+subdir_out+infile)
+    print ("EOF pattern written to:")
+    print (OUTPATH+subdir_out+outfile_eof)
+    print ("PC time series and explained variances written to:")
+    print (OUTPATH+subdir_out+outfile_pc)
+    nc1.close()
+    return
+
+
 # APPLIED OPERATION
 # (used in output file name, added just before input file name '*.nc')
 app="pca"
@@ -149,119 +267,16 @@ app="pca"
 RESID=True
 
 realm='ocn' # or set to None, depending of sub-folder structure
-iscen=0
-# LOOP OVER SCENARIOS: (usually only historical, but keep loop structure)
-for scen in ['historical']:
-    nmodel=0
-    i=-1
-    for model in MODELLIST:
-        for run in ENSEMBLELIST:
-            for v in VARLIST:
-                print (v)
-                model_scen=TRANSLATE[scen]['scen']
-                model_time=TRANSLATE[scen]['time']
-                # adjust outpath to the subfolder structure 
-                if realm != None:
-                    subdir_out=model_scen+"/"+realm+"/"+v+"/"
-                else:
-                    subdir_out=model_scen+"/"+v+"/"
-                # 3-dim field
-                if RESID:
-                    infile=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano_resid.nc"
-                    outfile_eof=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano_resid_eof.nc"
-                    outfile_pc=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano_resid_pc.nc"
-                else:
-                    infile=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano.nc" 
-                    outfile_eof=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano_eof.nc"
-                    outfile_pc=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano_pc.nc"
-                ### open the data sets ###
-                nc1=xarray.open_dataset(OUTPATH+subdir_out+infile)
-                ntime1=nc1.time.size
-                fielddata=nc1[v].values[:]
-                ###nc2=xarray.open_dataset(OUTPATH+infile)
-                #################################################
-                # select North Pacific Domain and apply PCA
-                # to the residuals
-                #################################################
-                sellon=REGION_PDO[0:2]
-                sellat=REGION_PDO[2:4]
-                is_lon=np.logical_and(nc1.lon.values>=sellon[0],nc1.lon.values<=sellon[1])
-                nlon=np.sum(is_lon)
-                is_lat=np.logical_and(nc1.lat.values>=sellat[0],nc1.lat.values<=sellat[1])
-                nlat=np.sum(is_lat)
-                buffer=fielddata[:,:,is_lon]
-                res_npac=buffer[:,is_lat,:]
-                # need a 2dim array with time and grid coordinate as 2nd dim
-                # and have to get rid of grid points with nan
-                x2d,valid_index=field2matrix(res_npac)
-                #################################################
-                # PCA analysis
-                #################################################
-                nmodes=10
-                print ("calculate PCA ...")
-                pca = PCA().fit(x2d)
-                eof= pca.components_[0:nmodes,:] # leading modes
-                # 1s EOF should represent PDO mode
-                field_eof=matrix2field(eof,nlat,nlon,valid_index)
-                #################################################
-                # Projection of field data onto eigenvector
-                #################################################
-                t=0
-                ntime=len(res_npac[:,0,0])
-                pc=np.zeros((ntime,nmodes))
-                while t<ntime:
-                    m=0
-                    while m<nmodes:
-                        pc[t,m]=proj_field(res_npac[t,:,:],field_eof[m,:,:])
-                        m+=1
-                    t+=1
-                #################################################
-                # savc results into netcdf file
-                #################################################
-                ds1,ds2=save_result(eof=field_eof,pc=pc,\
-                time=nc1.time,lat=nc1.lat[is_lat],\
-                lon=nc1.lon[is_lon],\
-                expvar=pca.explained_variance_[0:nmodes],\
-                copy_from_source=nc1[v])
-
-                if False:
-                    fig,ax=plt.subplots(2,2)
-                    ax[0,0].bar(range(10),pca.explained_variance_[0:10]/np.sum(pca.explained_variance_)*100)
-                    ax[0,0].set_xlabel('PCA mode #')
-                    ax[0,0].set_ylabel('explained variance [%]')
-                    ax[1,0].contourf(nc1.lon[is_lon],nc1.lat[is_lat],field_eof[0,:,:],cmap=plt.cm.coolwarm)
-                    plt.show()
-                i=i+1
-                # renaming the files eof.nc and pc.nc
-                #
-                print ("Input file for PCA (EOF) analysis: ")
-                print(OUTPATH+subdir_out+infile)
-                print ("EOF pattern written to:")
-                print (OUTPATH+subdir_out+outfile_eof)
-                print ("PC time series and explained variances written to:")
-                print (OUTPATH+subdir_out+outfile_pc)
-                os.system("mv eof.nc "+OUTPATH+subdir_out+outfile_eof)
-                os.system("mv pc.nc "+OUTPATH+subdir_out+outfile_pc)
-            nmodel+=1
-    iscen+=1
-print ("done")
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
 
+if __name__ == "__main__":
+    iscen=0
+    # LOOP OVER SCENARIOS: (usually only historical, but keep loop structure)
+    for scen in ['historical']:
+        nmodel=0
+        for model in MODELLIST:
+            for run in ENSEMBLELIST:
+                for v in VARLIST:
+                    calc_pca(scen,model,run,v,realm=realm,resid=RESID)
+                nmodel+=1
+        iscen+=1
+    print ("done")
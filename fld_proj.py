@@ -9,6 +9,19 @@
 # Results: netcdf time series output
 ###############################################################################
 # HISTORY
+# 2026-10-19:
+#   EOFs on another grid than the field are interpolated to the field
+#   grid with a cached operator (regrid.py); additional EOF files
+#   in EOF_PATTERNS.
+#   Projection of one model run in function calc_proj() (can be imported,
+#   for example by journal.py); save_result() writes the output file
+#   directly (cmip5_io.to_netcdf: temporary file in the output folder
+#   and rename) instead of proj.nc in the working directory, so
+#   parallel tasks do not overwrite each other.
+#   Projection loop in function proj_modes() (also used by
+#   precision_check.py).
+#   PRECISION option (cmip5.py): the arrays are kept in float32 or
+#   float64 (default); dot products are accumulated in float64.
 # 2019-01-15 by OET:
 #   function save_result()
 #   xarray support of NETCDF4 output format is system
@@ -22,6 +35,8 @@ import os
 #import sys
 #sys.path.append("./modules")
 from cmip5 import *
+import cmip5_io
+import regrid
 
 
 def proj_field(x,e):
@@ -39,10 +54,28 @@ def proj_field(x,e):
     is_e=~np.isnan(ve)
     is_use=np.logical_and(is_x,is_e)
     ve=np.reshape(e,np.size(x))
-    rhelp=np.dot(vx[is_use],ve[is_use])/np.sqrt(np.dot(ve[is_use],ve[is_use]))
+    # accumulate in float64 (also for float32 input data)
+    vx=vx[is_use].astype(np.float64)
+    ve=ve[is_use].astype(np.float64)
+    rhelp=np.dot(vx,ve)/np.sqrt(np.dot(ve,ve))
     return rhelp
 
-def save_result(x,time,lev,copy_from_source,dflt_units='k'):
+def proj_modes(field_npac,field_eof):
+    """Projection indices (time,mode) of all time steps of the field
+    (time,lat,lon) onto all patterns (mode,lat,lon) with proj_field()."""
+    t=0
+    ntime=len(field_npac[:,0,0])
+    nmodes=len(field_eof[:,0,0])
+    proj=np.zeros((ntime,nmodes),dtype=field_npac.dtype)
+    while t<ntime:
+        m=0
+        while m <nmodes:
+            proj[t,m]=proj_field(field_npac[t,:,:],field_eof[m,:,:])
+            m+=1
+        t=t+1
+    return proj
+
+def save_result(x,time,lev,copy_from_source,dflt_units='k',outfile="proj.nc"):
     """Saves results from projection in netcdf output format.
     
     Input parameters:
@@ -50,6 +83,7 @@ def save_result(x,time,lev,copy_from_source,dflt_units='k'):
         time: coordinates from input netcdf file
         lev: level coordinates (PCA modes)
         copy_from_source: the field variable from the source  netcdf file 
+        outfile: output file (full path)
      
     The copy_from_source provides a netcdf source file (the input field
     data file to copy the information about dimensions, variables, units etc.
@@ -69,14 +103,108 @@ def save_result(x,time,lev,copy_from_source,dflt_units='k'):
         xproj.attrs['units']=dflt_units # eigenvectors of unit length
         xproj.attrs['info']="projection onto ensemble mean EOF pattern in eof_ens_mean.nc"
     ds=xarray.Dataset({'proj':xproj})
-    try:
-        ds.to_netcdf("proj.nc",format="NETCDF4")
-    except:
-        ds.to_netcdf("proj.nc")
-        print("Note: could not save with format='NETCDF4'")
-        print("Use default netcdf format associated with to_netcdf()")
+    cmip5_io.to_netcdf(ds,outfile)
     return ds
 
+
+def calc_proj(scen,model,run,v,realm=None,resid=True,eof_file=None,eof_name=None):
+    """Projection of the field of one model run onto the historical EOFs.
+
+    Input variables:
+        scen,model,run,v: strings indicating the scenario,
+            model,ensemble member run, and the variable name.
+        realm: optional string argument corresponding to the
+            variable processed that is used for the subfolder structure
+            of the CMIP5 model.
+        resid: use the regression residuals (True) or the anomalies
+        eof_file: optional EOF file (variable eof(lev,lat,lon)) used instead
+            of the model EOFs, for example an observed pattern on another
+            grid; the output file name ends with _pdo_proj_<eof_name>.nc
+    """
+    # 3-dim field
+    # EOF projection eignevectors 
+    # The projection vector is in standard application from historical scenario 
+    # eof_scen eof_time is set as default to the historical scenario
+    eof_scen=TRANSLATE['historical']['scen']
+    eof_time=TRANSLATE['historical']['time']
+    model_scen=TRANSLATE[scen]['scen']
+    model_time=TRANSLATE[scen]['time']
+    # adjust outpath to the subfolder structure 
+    if realm != None:
+        subdir_out=model_scen+"/"+realm+"/"+v+"/"
+        subdir_eof=eof_scen+"/"+realm+"/"+v+"/"
+    else:
+        subdir_out=model_scen+"/"+v+"/"
+        subdir_eof=model_scen+"/"+v+"/"
+
+    infile_eof=model+"_"+eof_scen+"_"+v+"_"+eof_time+"_"+run+'_ann_ano_resid_eof.nc'
+    if resid:
+        infile=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano_resid.nc"
+        outfile=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano_resid_"+app+".nc"
+    else:
+        infile=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano.nc" 
+        outfile=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano_"+app+".nc"
+    eofpath=OUTPATH+subdir_eof+infile_eof
+    if eof_file is not None:
+        eofpath=eof_file
+        outfile=outfile.replace(".nc","_"+eof_name+".nc")
+    print("field data: "+OUTPATH+subdir_out+infile)
+    print("eigenvectors from "+eofpath)
+    print("output file: "+OUTPATH+subdir_out+outfile)
+    print ("call function to read the netcdf files")
+    ### open the data sets ###
+    nc1=xarray.open_dataset(OUTPATH+subdir_out+infile)
+    ntime1=nc1.time.size
+    field=(nc1[v].values[:]).squeeze().astype(PRECISION,copy=False)  # save use for annual anomaly data
+    nc2=xarray.open_dataset(eofpath)
+    eof=(nc2['eof'].values[:]).astype(PRECISION,copy=False)
+    nmodes=len(eof[:,0,0])
+    #######################################################################
+    # select North Pacific Domain and apply PCA
+    # to the residuals
+    #######################################################################
+    sellon=REGION_PDO[0:2]
+    sellat=REGION_PDO[2:4]
+    is_lon1=np.logical_and(nc1.lon.values>=sellon[0],nc1.lon.values<=sellon[1])
+    nlon1=np.sum(is_lon1)
+    is_lat1=np.logical_and(nc1.lat.values>=sellat[0],nc1.lat.values<=sellat[1])
+    nlat1=np.sum(is_lat1)
+    buffer=field[:,:,is_lon1]
+    field_npac=buffer[:,is_lat1,:]
+    # make this check here, in case we combine with other domain
+    # sizes
+    is_lon2=np.logical_and(nc2.lon.values>=sellon[0],nc2.lon.values<=sellon[1])
+    nlon2=np.sum(is_lon2)
+    is_lat2=np.logical_and(nc2.lat.values>=sellat[0],nc2.lat.values<=sellat[1])
+    nlat2=np.sum(is_lat2)
+    buffer=eof[:,:,is_lon2]
+    field_eof=buffer[:,is_lat2,:]
+    # EOFs on a different grid (for example observed or native-grid
+    # patterns) are interpolated from the whole EOF grid to the field
+    # grid of the region (the operator is cached, see regrid.py)
+    lat1=nc1.lat.values[is_lat1]
+    lon1=nc1.lon.values[is_lon1]
+    lat2=nc2.lat.values[is_lat2]
+    lon2=nc2.lon.values[is_lon2]
+    if not regrid.same_grid(lat1,lon1,lat2,lon2):
+        print("interpolate EOFs to the field grid")
+        field_eof=regrid.regrid_patterns(eof,nc2.lat.values,nc2.lon.values,\
+            lat1,lon1).astype(PRECISION)
+
+    #######################################################################
+    # Projection of field data onto eigenvector
+    # (1st EOF should represent PDO mode)
+    #######################################################################
+    proj=proj_modes(field_npac,field_eof)
+    ds=save_result(proj,nc1.time,nc2.lev,copy_from_source=nc1[v],\
+        outfile=OUTPATH+subdir_out+outfile)
+    # figures (projection index time series): see plot_pdo.py
+    print ("outfile: "+OUTPATH+subdir_out+outfile)
+    nc1.close()
+    nc2.close()
+    return
+
+
 # APPLIED OPERATION 
 # (used in output file name, added just before input file name '*.nc')
 app="pdo_proj"
@@ -92,115 +220,29 @@ app="pdo_proj"
 ###############################################################################
 RESID=True
 
-realm='ocn' # or set to None, depending of sub-folder structure
-
-# LOOP OVER SCENARIOS
-iscen=-1
-for scen in SCENARIOLIST:
-    iscen=iscen+1
-    nmodel=0
-    i=-1
-    for model in MODELLIST:
-        print ("model: "+model)
-        for run in ENSEMBLELIST:
-            for v in VARLIST:
-                # 3-dim field
-                # EOF projection eignevectors 
-                # The projection vector is in standard application from historical scenario 
-                # eof_scen eof_time is set as default to the historical scenario
-                eof_scen=TRANSLATE['historical']['scen']
-                eof_time=TRANSLATE['historical']['time']
-                model_scen=TRANSLATE[scen]['scen']
-                model_time=TRANSLATE[scen]['time']
-                # adjust outpath to the subfolder structure 
-                if realm != None:
-                    subdir_out=model_scen+"/"+realm+"/"+v+"/"
-                    subdir_eof=eof_scen+"/"+realm+"/"+v+"/"
-                else:
-                    subdir_out=model_scen+"/"+v+"/"
-                    subdir_eof=model_scen+"/"+v+"/"
-                
-                infile_eof=model+"_"+eof_scen+"_"+v+"_"+eof_time+"_"+run+'_ann_ano_resid_eof.nc'
-                if RESID:
-                    infile=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano_resid.nc"
-                    outfile=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano_resid_"+app+".nc"
-                else:
-                    infile=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano.nc" 
-                    outfile=model+"_"+model_scen+"_"+v+"_"+model_time+"_"+run+"_ann_ano_"+app+".nc"
-                print("field data: "+OUTPATH+subdir_out+infile)
-                print("eigenvectors from "+OUTPATH+subdir_eof+infile_eof)
-                print("output file: "+OUTPATH+subdir_out+outfile)
-                print ("call function to read the netcdf files")
-                ### open the data sets ###
-                nc1=xarray.open_dataset(OUTPATH+subdir_out+infile)
-                ntime1=nc1.time.size
-                field=(nc1[v].values[:]).squeeze()  # save use for annual anomaly data
-                nc2=xarray.open_dataset(OUTPATH+subdir_eof+infile_eof)
-                eof=(nc2['eof'].values[:])
-                nmodes=len(eof[:,0,0])
-                #######################################################################
-                # select North Pacific Domain and apply PCA
-                # to the residuals
-                #######################################################################
-                sellon=REGION_PDO[0:2]
-                sellat=REGION_PDO[2:4]
-                is_lon1=np.logical_and(nc1.lon.values>=sellon[0],nc1.lon.values<=sellon[1])
-                nlon1=np.sum(is_lon1)
-                is_lat1=np.logical_and(nc1.lat.values>=sellat[0],nc1.lat.values<=sellat[1])
-                nlat1=np.sum(is_lat1)
-                buffer=field[:,:,is_lon1]
-                field_npac=buffer[:,is_lat1,:]
-                # make this check here, in case we combine with other domain
-                # sizes
-                is_lon2=np.logical_and(nc2.lon.values>=sellon[0],nc2.lon.values<=sellon[1])
-                nlon2=np.sum(is_lon2)
-                is_lat2=np.logical_and(nc2.lat.values>=sellat[0],nc2.lat.values<=sellat[1])
-                nlat2=np.sum(is_lat2)
-                buffer=eof[:,:,is_lon2]
-                field_eof=buffer[:,is_lat2,:]
-
-                #######################################################################
-                # Projection of field data onto eigenvector
-                # (1st EOF should represent PDO mode)
-                #######################################################################
-                t=0
-                ntime=len(field_npac[:,0,0])
-                proj=np.zeros((ntime,nmodes))
-                while t<ntime:
-                    m=0
-                    while m <nmodes:
-                        proj[t,m]=proj_field(field_npac[t,:,:],field_eof[m,:,:])
-                        m+=1
-                    #print(t)
-                    t=t+1
-                ds=save_result(proj,nc1.time,nc2.lev,copy_from_source=nc1[v]) 
-                if False:
-                    fig,ax=plt.subplots(2,2)
-                    ax[0,0].plot(nc1['time'],proj[:,MODE_PDO])
-                    ax[0,0].set_xlabel('PCA mode #')
-                    ax[0,0].set_ylabel('projection index')
-                    ax[1,0].contourf(nc2.lon[is_lon2],nc2.lat[is_lat2],field_eof[MODE_PDO,:,:],cmap=plt.cm.coolwarm)
-                    plt.show()      
-                i=i+1
-                os.system("mv proj.nc "+OUTPATH+subdir_out+outfile)
-                print ("outfile: "+OUTPATH+subdir_out+outfile)
-        nmodel+=1
-print ("done")
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+###############################################################################
+# EOF_PATTERNS: additional EOF files name:file (variable eof(lev,lat,lon),
+# any regular lon-lat grid), for example the observed EOFs of
+# obs_pipeline.py. Each field is also projected onto these patterns
+# (output *_pdo_proj_<name>.nc).
+###############################################################################
+EOF_PATTERNS={}
 
+realm='ocn' # or set to None, depending of sub-folder structure
 
+if __name__ == "__main__":
+    # LOOP OVER SCENARIOS
+    iscen=-1
+    for scen in SCENARIOLIST:
+        iscen=iscen+1
+        nmodel=0
+        for model in MODELLIST:
+            print ("model: "+model)
+            for run in ENSEMBLELIST:
+                for v in VARLIST:
+                    calc_proj(scen,model,run,v,realm=realm,resid=RESID)
+                    for name in EOF_PATTERNS:
+                        calc_proj(scen,model,run,v,realm=realm,resid=RESID,\
+                            eof_file=EOF_PATTERNS[name],eof_name=name)
+            nmodel+=1
+    print ("done")
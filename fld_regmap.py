@@ -0,0 +1,119 @@
+#!/usr/bin/python
+###############################################################################
+# Regression and correlation maps of the PDO index (and the other
+# PCA modes) onto the global field (teleconnection maps).
+# The projection indices from fld_proj.py (all modes) are regressed
+# on the (time,lat,lon) field with one matrix product for all modes.
+# Results: slope, intercept, correlation r and p-value maps
+# (lev,lat,lon) in *_<indices>_pdo_regmap_<field>.nc (lev: PCA mode),
+# for example *_ann_ano_resid_pdo_regmap_ann_ano.nc for the indices of
+# the residuals (RESID=True) regressed on the anomalies
+# (REGMAP_FIELD='ann_ano')
+###############################################################################
+
+import xarray
+import numpy as np
+import os
+from cmip5 import *
+import cmip5_io
+import fld_engine
+
+
+def regmap(scen,model,run,v,realm=None,resid=True,standardize=True,\
+    field_app="ann_ano"):
+    """Regression maps of all projection indices on the anomaly field.
+
+    Input variables:
+        scen,model,run,v: strings indicating the scenario,
+            model,ensemble member run, and the variable name.
+        realm: optional string argument corresponding to the
+            variable processed that is used for the subfolder structure
+            of the CMIP5 model.
+        resid: indices from the regression residuals (True)
+            or from the anomalies
+        standardize: regression on the standardized indices
+            (slope in field units per standard deviation)
+        field_app: field that is regressed on the indices
+            (see REGMAP_FIELD)
+    """
+    if resid:
+        app="ann_ano_resid"
+    else:
+        app="ann_ano"
+    infile=cmip5_io.fpath(scen,model,run,v,field_app,realm)
+    infile_idx=cmip5_io.fpath(scen,model,run,v,app+"_pdo_proj",realm)
+    outfile=cmip5_io.fpath(scen,model,run,v,app+"_pdo_regmap_"+field_app,realm)
+    print("field data : "+infile)
+    print("indices    : "+infile_idx)
+    nc1=xarray.open_dataset(infile)
+    nc2=xarray.open_dataset(infile_idx)
+    if nc1.time.size != nc2.time.size:
+        print("Error: input files do not have same number of samples in time dimension")
+        nc1.close()
+        nc2.close()
+        return None
+    field=(nc1[v].values[:]).squeeze().astype(PRECISION,copy=False)
+    idx=nc2['proj'].values
+    if standardize:
+        idx=(idx-np.mean(idx,axis=0))/np.std(idx,axis=0,ddof=1)
+    slope,intercept,r,pval=fld_engine.regress_indices(idx,field)
+    coords=[nc2.lev,nc1.lat,nc1.lon]
+    dims=['lev','lat','lon']
+    try:
+        units=nc1[v].units
+    except:
+        units='k'
+    xslope=xarray.DataArray(slope,coords=coords,dims=dims)
+    xslope.attrs['long_name']='regression coefficient (slope)'
+    if standardize:
+        xslope.attrs['units']=units+' per standard deviation'
+    else:
+        xslope.attrs['units']=units+' per index unit'
+    xint=xarray.DataArray(intercept,coords=coords,dims=dims)
+    xint.attrs['long_name']='intercept'
+    xint.attrs['units']=units
+    xr=xarray.DataArray(r,coords=coords,dims=dims)
+    xr.attrs['long_name']='correlation coefficient'
+    xr.attrs['units']='1'
+    xp=xarray.DataArray(pval,coords=coords,dims=dims)
+    xp.attrs['long_name']='p-value (two-sided t-test)'
+    xp.attrs['units']='1'
+    ds=xarray.Dataset({'slope':xslope,'intercept':xint,'r':xr,'pval':xp})
+    cmip5_io.to_netcdf(ds,outfile)
+    nc1.close()
+    nc2.close()
+    print("output file: "+outfile)
+    return ds
+
+
+###############################################################################
+# REGMAP_FIELD: field that is regressed on the indices
+#   ('ann_ano': anomalies, 'ann_ano_resid': regression residuals)
+# RESID: indices from the regression residuals (fld_proj.py RESID=True)
+# STANDARDIZE: regression on standardized indices
+###############################################################################
+REGMAP_FIELD="ann_ano"
+RESID=True
+STANDARDIZE=True
+
+realm='ocn' # or set to None, depending of sub-folder structure
+
+if __name__ == "__main__":
+    iscen=0
+    for scen in SCENARIOLIST:
+        print ("scenario: "+scen)
+        nmodel=0
+        for model in MODELLIST:
+            print ("model: "+model)
+            for run in ENSEMBLELIST:
+                i=0
+                for v in VARLIST:
+                    regmap(scen,model,run,v,realm=realm,resid=RESID,\
+                        standardize=STANDARDIZE,field_app=REGMAP_FIELD)
+                    i+=1
+            nmodel+=1
+        print ("----------------------------------------------------------")
+        print ("stats for simulations "+scen+" : variable "+v)
+        print ("models: "+str(nmodel)+" variables: "+str(i))
+        iscen+=1
+    print ("done")
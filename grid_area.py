@@ -0,0 +1,155 @@
+###############################################################################
+# Grid cell area weights for the regular lon-lat grid OUTGRID
+# and area-weighted field means (global and regional means)
+# The weights are calculated once and cached in memory and in
+# a netcdf file in OUTPATH (gridarea_<OUTGRID file name>).
+###############################################################################
+
+import xarray
+import numpy as np
+import os
+from cmip5 import *
+import cmip5_io
+import fld_engine
+
+# earth radius in m
+REARTH=6.371e6
+
+# in-memory cache of the cell areas (key: lat,lon coordinates)
+_AREA_CACHE={}
+
+
+def cell_bounds(x,xmin=None,xmax=None):
+    """Cell boundaries (midpoints between coordinates) of a regular axis."""
+    x=np.asarray(x,dtype=np.float64)
+    dx=np.diff(x)
+    bnds=np.empty(len(x)+1)
+    bnds[1:-1]=x[:-1]+0.5*dx
+    bnds[0]=x[0]-0.5*dx[0]
+    bnds[-1]=x[-1]+0.5*dx[-1]
+    if xmin is not None:
+        bnds=np.clip(bnds,xmin,xmax)
+    return bnds
+
+
+def cell_area(lat,lon):
+    """Area (m2) of the grid cells of a regular lon-lat grid (2dim lat,lon)."""
+    latb=np.deg2rad(cell_bounds(lat,-90.,90.))
+    lonb=np.deg2rad(cell_bounds(lon))
+    dsin=np.abs(np.diff(np.sin(latb)))
+    dlon=np.abs(np.diff(lonb))
+    return REARTH*REARTH*np.outer(dsin,dlon)
+
+
+def area_file():
+    """File name of the cached cell areas."""
+    name=os.path.basename(OUTGRID)
+    return OUTPATH+"gridarea_"+name
+
+
+def get_area(lat,lon):
+    """Returns the cell areas (2dim lat,lon) for the field coordinates.
+
+    The areas are read from the cache (memory or netcdf file) if the
+    coordinates match, otherwise calculated and the file cache is
+    updated.
+    """
+    lat=np.asarray(lat,dtype=np.float64)
+    lon=np.asarray(lon,dtype=np.float64)
+    key=(lat.tobytes(),lon.tobytes())
+    if key in _AREA_CACHE:
+        return _AREA_CACHE[key]
+    cachefile=area_file()
+    area=None
+    if os.path.exists(cachefile):
+        nc=xarray.open_dataset(cachefile)
+        if np.array_equal(nc.lat.values,lat) and np.array_equal(nc.lon.values,lon):
+            area=nc['cell_area'].values
+        nc.close()
+    if area is None:
+        print("calculate grid cell areas, cache file: "+cachefile)
+        area=cell_area(lat,lon)
+        xarea=xarray.DataArray(area,coords=[lat,lon],dims=['lat','lon'])
+        xarea.attrs['long_name']='grid cell area'
+        xarea.attrs['units']='m2'
+        cmip5_io.to_netcdf(xarray.Dataset({'cell_area':xarea}),cachefile)
+    _AREA_CACHE[key]=area
+    return area
+
+
+def region_weights(lat,lon,regions):
+    """Weight matrix (nregion,lat*lon) with the cell areas of each region.
+
+    Input parameters:
+        lat,lon: 1-dim coordinates
+        regions: list of region tuples (lonw,lone,lats,latn),
+            None for the global domain
+    """
+    area=get_area(lat,lon)
+    w=np.zeros((len(regions),np.size(area)))
+    i=0
+    for region in regions:
+        if region is None:
+            w[i]=np.reshape(area,-1)
+        else:
+            is_lon,is_lat=fld_engine.region_mask(np.asarray(lon),np.asarray(lat),region)
+            mask=np.outer(is_lat,is_lon)
+            w[i]=np.reshape(np.where(mask,area,0.),-1)
+        i+=1
+    return w
+
+
+def fld_means(field,w):
+    """Area-weighted means of all regions in one pass over the field.
+
+    Grid cells with missing values (nan) are excluded from the
+    weighted mean of each time step.
+
+    Input parameters:
+        field: (time,lat,lon) array
+        w: (nregion,lat*lon) weights (see region_weights)
+    Returns the (time,nregion) array of the field means.
+    """
+    ntime=np.shape(field)[0]
+    x=np.reshape(field,(ntime,-1))
+    is_x=np.isfinite(x)
+    xz=np.where(is_x,x,0)
+    num=np.dot(xz,w.T)
+    den=np.dot(is_x.astype(np.float64),w.T)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        return num/den
+
+
+def fldmean_regions():
+    """Region names and regions of the field means: the global mean
+    (name None) and FLDMEAN_REGIONS (sorted by name)."""
+    names=sorted(FLDMEAN_REGIONS)
+    return [None]+names,[None]+[FLDMEAN_REGIONS[name] for name in names]
+
+
+def fldmean_dataset(x,time,v,names,units=None):
+    """Dataset with the field mean time series (fld_mean.py layout).
+
+    Input parameters:
+        x: (time,nregion) field means (see fld_means)
+        time: time coordinate
+        v: variable name of the global mean; the regional means are
+            named v_<region>, for example tos_npac
+        names: region names (see fldmean_regions)
+        units: optional units attribute
+    """
+    ds=xarray.Dataset()
+    i=0
+    for name in names:
+        xts=xarray.DataArray(x[:,i],coords=[time],dims=['time'])
+        if name is None:
+            xts.name=v
+            xts.attrs['long_name']='global mean'
+        else:
+            xts.name=v+"_"+name
+            xts.attrs['long_name']='regional mean '+str(FLDMEAN_REGIONS[name])
+        if units is not None:
+            xts.attrs['units']=units
+        ds[xts.name]=xts
+        i+=1
+    return ds
@@ -0,0 +1,215 @@
+#!/usr/bin/python
+###############################################################################
+# Job journal of the processing pipeline
+# The (stage,scenario,model,run,var) tasks of tasks.py are run in
+# processing order and the status, start time, duration and error message
+# of each task are recorded in a SQLite data base
+# (default OUTPATH+"journal.sqlite").
+# A task fails if the stage raises an error (for example a CDO call
+# with non-zero exit status, cdo_chain.CdoError, or the length mismatch
+# in fld_linreg.py), if an input file is missing or fails the catalog
+# check (catalog.check_input, JOURNAL_CATALOG), or if an output file
+# was not rewritten by the stage (size, modification time and inode are
+# compared with a snapshot taken before the run). A task only runs if
+# all the tasks it depends on are done (status 'blocked' otherwise).
+# Tasks left 'running' by a crashed journal run are marked 'interrupted'
+# at the start of the next run and are run again.
+# Status: running, done, failed, blocked, interrupted
+#
+# Usage:
+#   python journal.py run [stage ...]     run all tasks (of the stages)
+#   python journal.py resume [stage ...]  retry only the tasks that are
+#                                         not done (failed, blocked,
+#                                         interrupted or new)
+#   python journal.py status              task counts and failed tasks
+###############################################################################
+
+import os
+import sqlite3
+import sys
+import time
+from cmip5 import *
+import tasks
+import catalog
+
+# check the task inputs with the metadata catalog (catalog.py)
+JOURNAL_CATALOG=True
+
+
+def journal_file():
+    """Default journal data base."""
+    return OUTPATH+"journal.sqlite"
+
+
+def connect(dbfile=None):
+    """Opens (and creates) the journal data base."""
+    if dbfile is None:
+        dbfile=journal_file()
+    db=sqlite3.connect(dbfile)
+    db.execute("CREATE TABLE IF NOT EXISTS tasks (key TEXT PRIMARY KEY, "+\
+        "stage TEXT, scen TEXT, model TEXT, run TEXT, var TEXT, "+\
+        "status TEXT, start REAL, duration REAL, message TEXT)")
+    return db
+
+
+def get_status(db,key):
+    """Status of a task (None if the task is not in the journal)."""
+    row=db.execute("SELECT status FROM tasks WHERE key=?",(key,)).fetchone()
+    if row is None:
+        return None
+    return row[0]
+
+
+def set_status(db,task,status,start=None,duration=None,message=""):
+    """Records the status of a task (committed immediately)."""
+    db.execute("INSERT OR REPLACE INTO tasks VALUES (?,?,?,?,?,?,?,?,?,?)",\
+        (task['key'],task['stage'],task['scen'],task['model'],task['run'],\
+        task['var'],status,start,duration,message))
+    db.commit()
+
+
+def run_stage(task,realm=None):
+    """Runs the stage function of one task.
+
+    The stage modules are imported here (only the stages that are run).
+    """
+    stage=task['stage']
+    args=(task['scen'],task['model'],task['run'],task['var'])
+    if stage=='mon2ann':
+        import mon2ann
+        mon2ann.calc_ann_mean(*args,realm=realm)
+    elif stage=='climatology':
+        import climatology
+        climatology.calc_clim(*args,startyr=START,endyr=END,realm=realm)
+    elif stage=='anomaly':
+        import anomaly
+        anomaly.calc_ano(*args,startyr=START,endyr=END,realm=realm)
+    elif stage=='fld_mean':
+        import fld_mean
+        if fld_mean.NATIVE:
+            fld_mean.global_mean_native(*args,realm=realm)
+        else:
+            fld_mean.global_mean(*args,realm=realm)
+    elif stage=='fld_linreg':
+        import fld_linreg
+        fld_linreg.linreg(*args,realm=realm)
+    elif stage=='fld_pca':
+        import fld_pca
+        fld_pca.calc_pca(*args,realm=realm,resid=True)
+    elif stage=='fld_proj':
+        import fld_proj
+        fld_proj.calc_proj(*args,realm=realm,resid=True)
+    else:
+        raise ValueError("unknown stage "+stage)
+    return
+
+
+def file_state(f):
+    """Snapshot (size, modification time, inode) of a file (None if missing)."""
+    try:
+        st=os.stat(f)
+    except OSError:
+        return None
+    return (st.st_size,st.st_mtime_ns,st.st_ino)
+
+
+def run_task(task,realm=None):
+    """Runs one task with checked inputs and outputs.
+    Returns the error message ('' if the task was successful)."""
+    missing=[f for f in task['inputs'] if not os.path.exists(f)]
+    if missing:
+        return "missing input: "+", ".join(missing)
+    if JOURNAL_CATALOG:
+        # header scan of new or changed inputs only
+        catalog.update_catalog(task['inputs'])
+        for f in task['inputs']:
+            if f.endswith("_eof.nc"):
+                v='eof'
+            else:
+                v=task['var']
+            msg=catalog.check_input(f,v=v)
+            if msg:
+                return "input "+f+": "+msg
+    for f in task['outputs']:
+        if not os.path.exists(os.path.dirname(f)):
+            os.makedirs(os.path.dirname(f))
+    before=[file_state(f) for f in task['outputs']]
+    try:
+        run_stage(task,realm)
+    except Exception as e:
+        return type(e).__name__+": "+str(e)
+    missing=[f for f,state in zip(task['outputs'],before) if \
+        file_state(f) is None or file_state(f)==state]
+    if missing:
+        return "output not written: "+", ".join(missing)
+    return ""
+
+
+def run_journal(tasklist,dbfile=None,resume=True,realm=None):
+    """Runs the tasks in order and records them in the journal.
+
+    Input parameters:
+        tasklist: list of tasks (tasks.make_tasks), dependencies first
+        dbfile: journal data base (default journal_file())
+        resume: skip the tasks that are done (and whose outputs exist)
+        realm: optional subfolder (see cmip5_io.subdir)
+    Returns the number of tasks in each status.
+    """
+    db=connect(dbfile)
+    # 'running' tasks are left from a journal run that did not finish
+    db.execute("UPDATE tasks SET status='interrupted', "+\
+        "message='journal run interrupted' WHERE status='running'")
+    db.commit()
+    count={'done':0,'skipped':0,'failed':0,'blocked':0}
+    for task in tasklist:
+        status=get_status(db,task['key'])
+        if resume and status=='done' and \
+            all([os.path.exists(f) for f in task['outputs']]):
+            count['skipped']+=1
+            continue
+        bad=[k for k in task['deps'] if get_status(db,k)!='done']
+        if bad:
+            print("blocked: "+task['key']+" (dependency "+bad[0]+")")
+            set_status(db,task,'blocked',message="dependency not done: "+", ".join(bad))
+            count['blocked']+=1
+            continue
+        print("run: "+task['key'])
+        t0=time.time()
+        set_status(db,task,'running',start=t0)
+        msg=run_task(task,realm)
+        if msg:
+            print("failed: "+task['key']+": "+msg)
+            set_status(db,task,'failed',t0,time.time()-t0,msg)
+            count['failed']+=1
+        else:
+            set_status(db,task,'done',t0,time.time()-t0)
+            count['done']+=1
+    db.close()
+    return count
+
+
+def report(dbfile=None):
+    """Prints the number of tasks in each status and the failed tasks."""
+    db=connect(dbfile)
+    for status,n,total in db.execute("SELECT status,COUNT(*),SUM(duration) "+\
+        "FROM tasks GROUP BY status"):
+        print("%-8s %6d tasks %10.1f s" % (status,n,total or 0.))
+    for key,msg in db.execute("SELECT key,message FROM tasks "+\
+        "WHERE status IN ('failed','blocked','interrupted') ORDER BY key"):
+        print("  "+key+": "+msg)
+    db.close()
+    return
+
+
+realm='ocn' # or set to None, depending of sub-folder structure
+
+if __name__ == "__main__":
+    cmd=sys.argv[1]
+    stages=sys.argv[2:]
+    if not stages:
+        stages=tasks.STAGES
+    if cmd in ['run','resume']:
+        count=run_journal(tasks.make_tasks(stages,realm=realm),\
+            resume=(cmd=='resume'),realm=realm)
+        print(count)
+    report()
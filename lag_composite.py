@@ -0,0 +1,126 @@
+#!/usr/bin/python
+###############################################################################
+# Lead/lag correlation maps and phase composites of the PDO index
+# (projection index mode MODE_PDO from fld_proj.py) with the global
+# anomaly field.
+#   - correlation and regression maps for all lags in LAGS in one pass
+#     (shifted index windows, three matrix products, fld_engine.lag_regress)
+#     lag > 0: the index leads the field
+#   - composites of the positive and negative PDO phase (standardized
+#     index above COMP_THRESHOLD / below -COMP_THRESHOLD) and their
+#     difference, from boolean time masks (fld_engine.composites)
+# Results (float32, compressed) in *_ann_ano_pdo_lagcomp.nc
+###############################################################################
+
+import xarray
+import numpy as np
+import os
+from cmip5 import *
+import cmip5_io
+import fld_engine
+
+
+def lag_composite(scen,model,run,v,lags,threshold,realm=None,resid=True):
+    """Lag correlation, lag regression and phase composites of one run.
+
+    Input variables:
+        scen,model,run,v: strings indicating the scenario,
+            model,ensemble member run, and the variable name.
+        lags: list of lags (years)
+        threshold: phase threshold (standard deviations of the index)
+        realm: optional string argument corresponding to the
+            variable processed that is used for the subfolder structure
+            of the CMIP5 model.
+        resid: index from the regression residuals (True)
+            or from the anomalies
+    """
+    if resid:
+        app="ann_ano_resid"
+    else:
+        app="ann_ano"
+    infile=cmip5_io.fpath(scen,model,run,v,LAG_FIELD,realm)
+    infile_idx=cmip5_io.fpath(scen,model,run,v,app+"_pdo_proj",realm)
+    outfile=cmip5_io.fpath(scen,model,run,v,"ann_ano_pdo_lagcomp",realm)
+    if not (os.path.exists(infile) and os.path.exists(infile_idx)):
+        print("missing input (skipped): "+infile+" "+infile_idx)
+        return None
+    print("field data : "+infile)
+    print("index      : "+infile_idx)
+    nc1=xarray.open_dataset(infile)
+    nc2=xarray.open_dataset(infile_idx)
+    if nc1.time.size != nc2.time.size:
+        print("Error: input files do not have same number of samples in time dimension")
+        nc1.close()
+        nc2.close()
+        return None
+    field=(nc1[v].values[:]).squeeze().astype(PRECISION,copy=False)
+    idx=nc2['proj'].values[:,MODE_PDO]
+    idx=(idx-np.mean(idx))/np.std(idx,ddof=1)
+    r,slope,n=fld_engine.lag_regress(idx,field,lags)
+    masks=fld_engine.phase_masks(idx,threshold)
+    comp,count=fld_engine.composites(masks,field)
+    try:
+        units=nc1[v].units
+    except:
+        units='k'
+    coords=[np.asarray(lags),nc1.lat,nc1.lon]
+    dims=['lag','lat','lon']
+    xr=xarray.DataArray(r.astype(np.float32),coords=coords,dims=dims)
+    xr.attrs['long_name']='lag correlation (lag>0: index leads)'
+    xr.attrs['units']='1'
+    xslope=xarray.DataArray(slope.astype(np.float32),coords=coords,dims=dims)
+    xslope.attrs['long_name']='lag regression coefficient'
+    xslope.attrs['units']=units+' per standard deviation'
+    xn=xarray.DataArray(n.astype(np.int32),coords=[np.asarray(lags)],dims=['lag'])
+    xn.attrs['long_name']='number of overlapping time steps'
+    phase=['positive','negative','difference']
+    comp=np.concatenate([comp,comp[0:1]-comp[1:2]],axis=0)
+    xcomp=xarray.DataArray(comp.astype(np.float32),coords=[phase,nc1.lat,nc1.lon],\
+        dims=['phase','lat','lon'])
+    xcomp.attrs['long_name']='composite of the PDO phase'
+    xcomp.attrs['units']=units
+    xcount=xarray.DataArray(np.append(count,np.nan),coords=[phase],dims=['phase'])
+    xcount.attrs['long_name']='number of time steps in the composite'
+    ds=xarray.Dataset({'r':xr,'slope':xslope,'nlag':xn,'comp':xcomp,'ncomp':xcount})
+    ds.attrs['threshold']=threshold
+    ds.attrs['mode']=MODE_PDO+1
+    encoding={name:{'zlib':True,'complevel':4} for name in ['r','slope','comp']}
+    cmip5_io.to_netcdf(ds,outfile,encoding=encoding)
+    nc1.close()
+    nc2.close()
+    print("output file: "+outfile)
+    return ds
+
+
+###############################################################################
+# LAGS: lags in years (lag > 0: the PDO index leads the field)
+# COMP_THRESHOLD: phase threshold in standard deviations of the index
+# LAG_FIELD: field ('ann_ano': anomalies, 'ann_ano_resid': residuals)
+# RESID: index from the regression residuals (fld_proj.py RESID=True)
+###############################################################################
+LAGS=list(range(-5,6))
+COMP_THRESHOLD=1.0
+LAG_FIELD="ann_ano"
+RESID=True
+
+realm='ocn' # or set to None, depending of sub-folder structure
+
+if __name__ == "__main__":
+    iscen=0
+    for scen in SCENARIOLIST:
+        print ("scenario: "+scen)
+        nmodel=0
+        for model in MODELLIST:
+            print ("model: "+model)
+            for run in ENSEMBLELIST:
+                i=0
+                for v in VARLIST:
+                    lag_composite(scen,model,run,v,LAGS,COMP_THRESHOLD,\
+                        realm=realm,resid=RESID)
+                    i+=1
+            nmodel+=1
+        print ("----------------------------------------------------------")
+        print ("stats for simulations "+scen+" : variable "+v)
+        print ("models: "+str(nmodel)+" variables: "+str(i))
+        iscen+=1
+    print ("done")
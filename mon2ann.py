@@ -21,6 +21,7 @@ import os
 #import sys
 #sys.path.append("./modules")
 from cmip5 import *
+from cdo_chain import run_cdo
 
 
 def calc_ann_mean(scen,model,run,v,realm=None):
@@ -53,20 +54,20 @@ def calc_ann_mean(scen,model,run,v,realm=None):
     first_year=str(TRANSLATE[scen]['first_year'])
     last_year=str(TRANSLATE[scen]['last_year'])
     if CORRECT_ANN_CALENDAR:
-        os.system("rm buffer.nc buffer2.nc")
+        for tmp in ["buffer.nc","buffer2.nc"]:
+            if os.path.exists(tmp):
+                os.remove(tmp)
         cdo="cdo -v -selyear,"+first_year+"/"+last_year+" -timselmean,12 "+DPATH+infile+" buffer.nc"
-        print(cdo)
-        os.system(cdo)
+        run_cdo(cdo)
         print("use cdo to overwrite time dimension / correct the calendar")
         cdo="cdo -v -settaxis,"+first_year+"-01-01,00:00:00,365day buffer.nc buffer2.nc\n"
         cdo=cdo+"cdo  -setcalendar,standard buffer2.nc "+OUTPATH+subdir_out+outfile
-        print(cdo)
-        os.system(cdo)
+        for cmd in cdo.splitlines():
+            run_cdo(cmd)
     else:
         cdo="cdo -v -selyear,"+first_year+"/"+last_year+" -yearmean "+DPATH+infile\
         +" "+OUTPATH+subdir_out+outfile
-        print(cdo)
-        os.system(cdo)
+        run_cdo(cdo)
     
     print ("Infile: "+infile)
     print ("Outfile:"+outfile)
@@ -74,23 +75,19 @@ def calc_ann_mean(scen,model,run,v,realm=None):
     return
 
 
-# Loop over scenarios
-iscen=0
-for scen in SCENARIOLIST:
-    nmodel=0
-    for model in MODELLIST:
-        for run in ENSEMBLELIST:
-            i=0
-            for v in VARLIST:
-                calc_ann_mean(scen,model,run,v,realm="ocn")
-                i+=1
-        nmodel+=1
-    print ("----------------------------------------------------------")
-    print ("stats for simulations "+scen+" : variable "+v)
-    print ("models: "+str(nmodel)+" variables: "+str(i))
-    iscen+=1
-
-
- 
- 
- 
+if __name__ == "__main__":
+    # Loop over scenarios
+    iscen=0
+    for scen in SCENARIOLIST:
+        nmodel=0
+        for model in MODELLIST:
+            for run in ENSEMBLELIST:
+                i=0
+                for v in VARLIST:
+                    calc_ann_mean(scen,model,run,v,realm="ocn")
+                    i+=1
+            nmodel+=1
+        print ("----------------------------------------------------------")
+        print ("stats for simulations "+scen+" : variable "+v)
+        print ("models: "+str(nmodel)+" variables: "+str(i))
+        iscen+=1
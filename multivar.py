@@ -0,0 +1,158 @@
+#!/usr/bin/python
+###############################################################################
+# Multi-variable processing: the variables of VARGROUPS (cmip5.py) that are
+# stored in one source file are processed together, each file is read
+# once for all variables:
+#   1. annual means and anomalies of all variables of the group in one
+#      CDO call (cdo_chain.py, -selname,v1,v2,... on the source files,
+#      only the variables of the group are read); the climatology of
+#      the group (*_ann_clim.nc in the historical group folder) is
+#      computed once per model/run and reused by all scenarios
+#      -> group file *_ann_ano_group.nc in the group folder
+#   2. one read of the group file; for all variables at once
+#      (leading variable dimension, fld_engine.py):
+#        - global and regional (FLDMEAN_REGIONS) area-weighted means
+#          (one weight matrix for all variables, grid_area.py)
+#        - regression on the global mean and residuals
+#        - REGION_PDO domain of the residuals: PCA (historical) and
+#          projection onto the historical EOFs
+#      -> per variable, in the layout of the single-variable scripts:
+#         *_ann_ano_fldmean.nc, *_ann_ano_resid.nc,
+#         *_ann_ano_resid_eof.nc, *_ann_ano_resid_pc.nc (historical),
+#         *_ann_ano_resid_pdo_proj.nc
+# The anomalies are kept in the group file only; MULTIVAR_SAVE_ANO=True
+# also writes the per-variable *_ann_ano.nc (input of fld_detrend.py
+# and fld_regmap.py).
+# The variables of a group must be on the same grid (OUTGRID).
+###############################################################################
+
+import xarray
+import numpy as np
+import os
+from cmip5 import *
+from cdo_chain import cdo_command,run_cdo,ano_chain,calc_clim_pipe
+import cmip5_io
+import fld_engine
+import fld_pca
+import fld_proj
+import grid_area
+
+
+def group_ano(scen,model,run,group,varlist,startyr,endyr,realm=None):
+    """Annual anomalies of all variables of a group with one CDO call.
+
+    Input variables:
+        scen,model,run: strings indicating the scenario, model and
+            ensemble member run
+        group: name of the group (source file
+            DPATH+cmip5_scen_group_model_run.nc, see VARGROUPS)
+        varlist: variables of the group
+        startyr, endyr: first and last year of the climatology
+        realm: optional subfolder (see cmip5_io.subdir)
+    Returns the CDO run time (seconds).
+    """
+    outdir=OUTPATH+cmip5_io.subdir(scen,group,realm)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    climfile,t=calc_clim_pipe(model,run,group,startyr,endyr,realm,select=varlist)
+    ops=ano_chain(scen,model,run,group,startyr,endyr,select=varlist,\
+        climfile=climfile)
+    outfile=cmip5_io.fpath(scen,model,run,group,"ann_ano_group",realm)
+    return t+run_cdo(cdo_command(ops,outfile))
+
+
+def save_field(x,nc,scen,model,run,v,app,realm=None):
+    """Saves a (time,lat,lon) field of variable v (fld_linreg.py layout)."""
+    xfld=xarray.DataArray(x,coords=[nc.time,nc.lat,nc.lon],dims=['time','lat','lon'])
+    xfld.name=v
+    xfld.attrs.update(nc[v].attrs)
+    outfile=cmip5_io.fpath(scen,model,run,v,app,realm)
+    cmip5_io.to_netcdf(xarray.Dataset({v:xfld}),outfile)
+    print("Output file: "+outfile)
+    return
+
+
+def group_stages(scen,model,run,group,varlist,realm=None,nmodes=10,save_ano=False):
+    """Field means, regression residuals, PCA (historical) and projection
+    indices of all variables of a group from one read of the group
+    anomaly file (per-variable output files, see header).
+    With save_ano the per-variable anomaly files are also written."""
+    infile=cmip5_io.fpath(scen,model,run,group,"ann_ano_group",realm)
+    print("group file: "+infile)
+    nc=xarray.open_dataset(infile)
+    field=np.stack([(nc[v].values[:]).squeeze().astype(PRECISION,copy=False) \
+        for v in varlist],axis=0)
+    nvar,ntime,nlat,nlon=np.shape(field)
+    names,regions=grid_area.fldmean_regions()
+    w=grid_area.region_weights(nc.lat.values,nc.lon.values,regions)
+    # (variable*time,lat,lon) -> (variable,time,region)
+    x=np.reshape(grid_area.fld_means(np.reshape(field,(nvar*ntime,nlat,nlon)),w),\
+        (nvar,ntime,len(regions)))
+    a,b,r,res=fld_engine.linreg_field(x[:,:,0],field)
+    # REGION_PDO domain of the residuals of all variables
+    is_lon,is_lat=fld_engine.region_mask(nc.lon.values,nc.lat.values,REGION_PDO)
+    res_npac=fld_engine.sel_region(res,is_lon,is_lat)
+    f=lambda s,v,app: cmip5_io.fpath(s,model,run,v,app,realm)
+    i=0
+    for v in varlist:
+        outdir=OUTPATH+cmip5_io.subdir(scen,v,realm)
+        if not os.path.exists(outdir):
+            os.makedirs(outdir)
+        if save_ano:
+            save_field(field[i],nc,scen,model,run,v,"ann_ano",realm)
+        ds=grid_area.fldmean_dataset(x[i],nc.time,v,names,nc[v].attrs.get('units'))
+        cmip5_io.to_netcdf(ds,f(scen,v,"ann_ano_fldmean"))
+        save_field(res[i],nc,scen,model,run,v,"ann_ano_resid",realm)
+        if scen=='historical':
+            eof,pc,expvar,expfrac=fld_pca.pca_modes(res_npac[i],nmodes)
+            fld_pca.save_result(eof=eof,pc=pc,time=nc.time,lat=nc.lat[is_lat],\
+                lon=nc.lon[is_lon],expvar=expvar,copy_from_source=nc[v],\
+                expfrac=expfrac,outfile_eof=f(scen,v,"ann_ano_resid_eof"),\
+                outfile_pc=f(scen,v,"ann_ano_resid_pc"))
+            print("EOFs: "+f(scen,v,"ann_ano_resid_eof"))
+        else:
+            eoffile=f('historical',v,"ann_ano_resid_eof")
+            if not os.path.exists(eoffile):
+                print("missing EOF file (no projection): "+eoffile)
+                i+=1
+                continue
+            nc2=xarray.open_dataset(eoffile)
+            eof=nc2['eof'].values
+            nc2.close()
+        proj=fld_proj.proj_modes(res_npac[i],eof)
+        fld_proj.save_result(proj,nc.time,np.arange(1,len(eof)+1),nc[v],\
+            outfile=f(scen,v,"ann_ano_resid_pdo_proj"))
+        print("projection: "+f(scen,v,"ann_ano_resid_pdo_proj"))
+        i+=1
+    nc.close()
+    return
+
+
+###############################################################################
+# MULTIVAR_STAGES: 'ano' (CDO) and 'fields' (field means, residuals,
+#   PCA and projection)
+# MULTIVAR_SAVE_ANO: also write the per-variable anomaly files *_ann_ano.nc
+# MULTIVAR_NMODES: number of saved PCA modes
+###############################################################################
+MULTIVAR_STAGES=['ano','fields']
+MULTIVAR_SAVE_ANO=False
+MULTIVAR_NMODES=10
+
+realm='ocn' # or set to None, depending of sub-folder structure
+
+if __name__ == "__main__":
+    # historical first (climatology and EOFs for all scenarios)
+    scenlist=['historical']+[s for s in SCENARIOLIST if s != 'historical']
+    for scen in scenlist:
+        print ("scenario: "+scen)
+        for model in MODELLIST:
+            print ("model: "+model)
+            for run in ENSEMBLELIST:
+                for group in VARGROUPS:
+                    varlist=VARGROUPS[group]
+                    if 'ano' in MULTIVAR_STAGES:
+                        group_ano(scen,model,run,group,varlist,START,END,realm=realm)
+                    if 'fields' in MULTIVAR_STAGES:
+                        group_stages(scen,model,run,group,varlist,realm=realm,\
+                            nmodes=MULTIVAR_NMODES,save_ano=MULTIVAR_SAVE_ANO)
+    print ("done")
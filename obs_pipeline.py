@@ -0,0 +1,226 @@
+#!/usr/bin/python
+###############################################################################
+# Observational reference: the gridded SST products in OBSLIST (cmip5.py)
+# are processed with the same code as the model data:
+#   'ano':     annual means remapped to OUTGRID and anomalies relative to
+#              START-END in one CDO call (cdo_chain.py)
+#              -> *_ann_ano.nc
+#   'fldmean': area-weighted global and regional (FLDMEAN_REGIONS) means
+#              with the cached grid cell areas (grid_area.py)
+#              -> *_ann_ano_fldmean.nc
+#   'detrend': least-squares removal of OBS_PREDICTORS (fld_detrend.py);
+#              the default ['fldmean'] is the regression on the global
+#              mean of fld_linreg.py, as for the model residuals
+#              -> *_ann_ano_resid.nc, *_ann_ano_detrend_coef.nc
+#   'pca':     EOFs of the REGION_PDO domain and the PC time series
+#              (fld_pca.pca_modes and fld_pca.save_result)
+#              -> *_ann_ano_resid_eof.nc, *_ann_ano_resid_pc.nc
+#   'proj':    projection indices onto the observed EOFs and onto the
+#              PDO pattern (MODE_PDO) of each model in MODELLIST
+#              (interpolated to the observational grid if needed, regrid.py)
+#              -> *_ann_ano_resid_pdo_proj.nc
+# The region masks (fld_engine.region_mask) and grid cell areas are cached
+# and shared with the model data on OUTGRID.
+# Output files: OUTPATH+obs/realm/var/+obs_obs_var_time_app.nc
+# (cmip5_io.obs_fpath). The eof file can be used as an extra pattern
+# in cross_proj.py (XPROJ_PATTERNS).
+###############################################################################
+
+import xarray
+import numpy as np
+import os
+from cmip5 import *
+from cdo_chain import operator,chain,cdo_command,run_cdo
+import cmip5_io
+import fld_engine
+import grid_area
+import fld_pca
+import cross_proj
+import regrid
+from fld_detrend import design_matrix,column_names
+
+
+def obs_ann_chain(obs,v):
+    """Operator chain for the annual means of an observational product
+    on the model grid OUTGRID (variable renamed to v)."""
+    spec=OBSLIST[obs]
+    ops=[operator("remapbil",OUTGRID)]
+    if spec['var'] != v:
+        ops.append(operator("chname",spec['var'],v))
+    ops.append(operator("selyear",str(spec['first_year'])+"/"+str(spec['last_year'])))
+    ops.append(operator("yearmean"))
+    return chain(ops,OBSPATH+spec['file'])
+
+
+def obs_ano(obs,v,startyr,endyr,realm=None):
+    """Annual anomalies (relative to startyr-endyr) on OUTGRID with
+    one CDO call. Returns the CDO run time (seconds)."""
+    outdir=OUTPATH+cmip5_io.obs_subdir(v,realm)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    ops=chain(operator("sub"),obs_ann_chain(obs,v),operator("timmean"),\
+        operator("selyear",str(startyr)+"/"+str(endyr)),obs_ann_chain(obs,v))
+    outfile=cmip5_io.obs_fpath(obs,v,"ann_ano",realm)
+    return run_cdo(cdo_command(ops,outfile))
+
+
+def obs_fldmean(obs,v,realm=None):
+    """Area-weighted global and regional means of the annual anomalies
+    (same output as fld_mean.py with NATIVE=True).
+    Returns a dictionary with the time series (keys 'fldmean' and
+    'fldmean_<region>' as used by fld_detrend.design_matrix)."""
+    infile=cmip5_io.obs_fpath(obs,v,"ann_ano",realm)
+    nc=xarray.open_dataset(infile)
+    field=(nc[v].values[:]).squeeze()
+    names,regions=grid_area.fldmean_regions()
+    w=grid_area.region_weights(nc.lat.values,nc.lon.values,regions)
+    x=grid_area.fld_means(field,w)
+    ds=grid_area.fldmean_dataset(x,nc.time,v,names,nc[v].attrs.get('units'))
+    ts={}
+    i=0
+    for name in names:
+        if name is None:
+            ts['fldmean']=x[None,:,i]
+        else:
+            ts['fldmean_'+name]=x[None,:,i]
+        i+=1
+    nc.close()
+    outfile=cmip5_io.obs_fpath(obs,v,"ann_ano_fldmean",realm)
+    cmip5_io.to_netcdf(ds,outfile)
+    print("Outfile: "+outfile)
+    return ts
+
+
+def obs_detrend(obs,v,ts,predictors,realm=None):
+    """Removes the predictors (see fld_detrend.py) from the anomalies.
+
+    Input parameters:
+        ts: dictionary with the field mean time series (obs_fldmean)
+        predictors: list of predictor names (OBS_PREDICTORS)
+    """
+    infile=cmip5_io.obs_fpath(obs,v,"ann_ano",realm)
+    nc=xarray.open_dataset(infile)
+    field=(nc[v].values[:]).squeeze().astype(PRECISION,copy=False)
+    ntime=np.shape(field)[0]
+    g=design_matrix(predictors,ts,0,ntime)
+    coef,res=fld_engine.lsq_detrend(g,field)
+    xres=xarray.DataArray(res,coords=[nc.time,nc.lat,nc.lon],dims=['time','lat','lon'])
+    xres.name=v
+    xres.attrs['long_name']='residual ('+", ".join(predictors)+' removed)'
+    outfile=cmip5_io.obs_fpath(obs,v,"ann_ano_resid",realm)
+    cmip5_io.to_netcdf(xarray.Dataset({v:xres}),outfile)
+    print("Outfile: "+outfile)
+    lev=column_names(predictors)
+    xcoef=xarray.DataArray(coef,coords=[lev,nc.lat,nc.lon],dims=['predictor','lat','lon'])
+    xcoef.attrs['long_name']='least-squares coefficients'
+    outfile=cmip5_io.obs_fpath(obs,v,"ann_ano_detrend_coef",realm)
+    cmip5_io.to_netcdf(xarray.Dataset({'coef':xcoef}),outfile)
+    nc.close()
+    return
+
+
+def obs_pca(obs,v,nmodes=10,realm=None):
+    """EOFs and PCs of the residuals in the REGION_PDO domain
+    (PCA and output files of fld_pca.py)."""
+    infile=cmip5_io.obs_fpath(obs,v,"ann_ano_resid",realm)
+    nc=xarray.open_dataset(infile)
+    is_lon,is_lat=fld_engine.region_mask(nc.lon.values,nc.lat.values,REGION_PDO)
+    field=fld_engine.sel_region((nc[v].values[:]).squeeze().astype(PRECISION,copy=False),\
+        is_lon,is_lat)
+    eof,pc,expvar,expfrac=fld_pca.pca_modes(field,nmodes)
+    outfile_eof=cmip5_io.obs_fpath(obs,v,"ann_ano_resid_eof",realm)
+    outfile_pc=cmip5_io.obs_fpath(obs,v,"ann_ano_resid_pc",realm)
+    fld_pca.save_result(eof=eof,pc=pc,time=nc.time,lat=nc.lat[is_lat],\
+        lon=nc.lon[is_lon],expvar=expvar,copy_from_source=nc[v],expfrac=expfrac,\
+        outfile_eof=outfile_eof,outfile_pc=outfile_pc)
+    print("EOF pattern written to: "+outfile_eof)
+    print("PC time series and explained variances written to: "+outfile_pc)
+    nc.close()
+    return
+
+
+def obs_proj(obs,v,models,run,realm=None):
+    """Projection of the observed residuals onto the observed EOFs
+    (variable proj(time,lev), as fld_proj.py) and onto the PDO pattern
+    of each model (variable proj_model(model,time), as cross_proj.py)."""
+    infile=cmip5_io.obs_fpath(obs,v,"ann_ano_resid",realm)
+    nc=xarray.open_dataset(infile)
+    is_lon,is_lat=fld_engine.region_mask(nc.lon.values,nc.lat.values,REGION_PDO)
+    field=fld_engine.sel_region((nc[v].values[:]).squeeze().astype(PRECISION,copy=False),\
+        is_lon,is_lat)
+    nc2=xarray.open_dataset(cmip5_io.obs_fpath(obs,v,"ann_ano_resid_eof",realm))
+    eof=nc2['eof'].values
+    lev=nc2.lev.values
+    nc2.close()
+    xproj=xarray.DataArray(fld_engine.proj_fields(field,eof),coords=[nc.time,lev],\
+        dims=['time','lev'])
+    xproj.attrs['long_name']="projection index"
+    ds=xarray.Dataset({'proj':xproj})
+    names,patterns,lat,lon=cross_proj.load_patterns(models,run,v,realm)
+    if len(names)>0:
+        olat=nc.lat.values[is_lat]
+        olon=nc.lon.values[is_lon]
+        if not regrid.same_grid(lat,lon,olat,olon):
+            # model patterns on another grid (regrid.py)
+            x=np.reshape(patterns,(len(names),len(lat),len(lon)))
+            patterns=np.reshape(regrid.regrid_patterns(x,lat,lon,olat,olon),\
+                (len(names),-1))
+        x=np.reshape(field,(np.shape(field)[0],-1))
+        nrow,ncol=fld_engine.block_sizes(np.shape(x)[1],np.shape(x)[0],\
+            len(names),MEMORY_BUDGET)
+        proj=fld_engine.proj_matrix(x,patterns,nrow,ncol).T
+        xmodel=xarray.DataArray(proj,coords=[names,nc.time],dims=['model','time'])
+        xmodel.attrs['long_name']="projection index onto the model PDO pattern"
+        ds['proj_model']=xmodel
+    else:
+        print("model PDO patterns not found")
+    outfile=cmip5_io.obs_fpath(obs,v,"ann_ano_resid_pdo_proj",realm)
+    cmip5_io.to_netcdf(ds,outfile)
+    print("outfile: "+outfile)
+    nc.close()
+    return ds
+
+
+def obs_pipeline(obs,v,stages,realm=None):
+    """Runs the stages (see OBS_STAGES) for one observational product."""
+    print("observations: "+obs+" ("+OBSPATH+OBSLIST[obs]['file']+")")
+    if 'ano' in stages:
+        obs_ano(obs,v,START,END,realm)
+    ts=None
+    if 'fldmean' in stages:
+        ts=obs_fldmean(obs,v,realm)
+    if 'detrend' in stages:
+        if ts is None:
+            nc=xarray.open_dataset(cmip5_io.obs_fpath(obs,v,"ann_ano_fldmean",realm))
+            ts={'fldmean':nc[v].values[None,:]}
+            for name in FLDMEAN_REGIONS:
+                if v+"_"+name in nc:
+                    ts['fldmean_'+name]=nc[v+"_"+name].values[None,:]
+            nc.close()
+        obs_detrend(obs,v,ts,OBS_PREDICTORS,realm)
+    if 'pca' in stages:
+        obs_pca(obs,v,OBS_NMODES,realm)
+    if 'proj' in stages:
+        obs_proj(obs,v,MODELLIST,OBS_PROJ_RUN,realm)
+    return
+
+
+###############################################################################
+# OBS_STAGES: stages in processing order (see header)
+# OBS_PREDICTORS: predictors removed in 'detrend' (see fld_detrend.py)
+#   ['fldmean'] gives the same residuals as fld_linreg.py (model pipeline)
+# OBS_NMODES: number of saved EOF modes
+# OBS_PROJ_RUN: ensemble member of the model EOFs in 'proj'
+###############################################################################
+OBS_STAGES=['ano','fldmean','detrend','pca','proj']
+OBS_PREDICTORS=['fldmean']
+OBS_NMODES=10
+OBS_PROJ_RUN=ENSEMBLELIST[0]
+
+realm='ocn' # or set to None, depending of sub-folder structure
+
+if __name__ == "__main__":
+    for obs in OBSLIST:
+        for v in VARLIST:
+            obs_pipeline(obs,v,OBS_STAGES,realm=realm)
+    print ("done")
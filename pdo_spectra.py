@@ -0,0 +1,203 @@
+#!/usr/bin/python
+###############################################################################
+# Spectral analysis of the PDO index time series (mode MODE_PDO) of all
+# models, ensemble members and scenarios:
+#   PC time series from fld_pca.py (historical)
+#   projection indices from fld_proj.py (all scenarios)
+# The series are stacked into one (series,time) array and analysed
+# with vectorized calls (series of equal length are processed together):
+#   - Welch power spectra (scipy.signal.welch)
+#   - multitaper power spectra (DPSS tapers, scipy.signal.windows.dpss)
+#   - AR1 (red noise) spectra and SPEC_SIGLEVEL significance levels
+#   - ratio of the variance in the decadal band SPEC_BAND
+#     to the total variance
+# All spectra use the same frequency axis (annual data): nfft is the
+# next power of two >= the longest series (at least SPEC_NFFT), so no
+# series is truncated.
+###############################################################################
+# Results: one netcdf file OUTPATH+"cmip5_var_pdo_spectra.nc"
+###############################################################################
+
+import xarray
+import numpy as np
+import os
+from scipy import signal
+from scipy.stats import chi2
+from cmip5 import *
+import cmip5_io
+
+# segment length for Welch spectra (years)
+SPEC_NPERSEG=64
+# minimum FFT length (common frequency axis of all spectra)
+SPEC_NFFT=128
+# multitaper time-bandwidth product and number of tapers
+SPEC_NW=3.
+SPEC_NTAPER=5
+# significance level of the red noise spectrum
+SPEC_SIGLEVEL=0.95
+# decadal band (frequency in 1/year)
+SPEC_BAND=(1./30.,1./10.)
+
+
+def collect_series(v,realm=None,resid=True):
+    """Reads the PDO index series of all models, runs and scenarios.
+
+    Returns a list of dictionaries with the labels and the time series.
+    """
+    if resid:
+        app="ann_ano_resid"
+    else:
+        app="ann_ano"
+    files=[]
+    for model in MODELLIST:
+        for run in ENSEMBLELIST:
+            files.append(('pc','historical',model,run,'pc',\
+                cmip5_io.fpath('historical',model,run,v,app+"_pc",realm)))
+            for scen in SCENARIOLIST:
+                files.append(('proj',scen,model,run,'proj',\
+                    cmip5_io.fpath(scen,model,run,v,app+"_pdo_proj",realm)))
+    series=[]
+    for kind,scen,model,run,varname,infile in files:
+        if not os.path.exists(infile):
+            print("missing file (skipped): "+infile)
+            continue
+        nc=xarray.open_dataset(infile)
+        x=nc[varname].values[:,MODE_PDO].astype(np.float64)
+        nc.close()
+        series.append({'kind':kind,'scen':scen,'model':model,'run':run,'x':x})
+    return series
+
+
+def ar1_coef(x):
+    """Lag-1 autocorrelation of each row of x (series,time)."""
+    xa=x-np.mean(x,axis=-1,keepdims=True)
+    return np.sum(xa[:,1:]*xa[:,:-1],axis=-1)/np.sum(xa*xa,axis=-1)
+
+
+def red_noise(freq,r1,psd):
+    """AR1 spectra with the same mean power as the spectra psd.
+
+    Input parameters:
+        freq: frequencies (1/time step)
+        r1: lag-1 autocorrelation (series)
+        psd: power spectra (series,freq)
+    """
+    shape=(1.-r1[:,None]**2)/(1.-2.*r1[:,None]*np.cos(2.*np.pi*freq[None,:])+\
+        r1[:,None]**2)
+    scale=np.mean(psd[:,1:],axis=-1)/np.mean(shape[:,1:],axis=-1)
+    return shape*scale[:,None]
+
+
+def mtm_psd(x,nfft,nw=SPEC_NW,ntaper=SPEC_NTAPER):
+    """Multitaper power spectra of the rows of x (series,time).
+
+    One-sided power spectral density (sampling frequency 1).
+    """
+    ntime=np.shape(x)[-1]
+    tapers=signal.windows.dpss(ntime,nw,ntaper) # (ntaper,time), unit energy
+    xa=x-np.mean(x,axis=-1,keepdims=True)
+    xf=np.fft.rfft(xa[:,None,:]*tapers[None,:,:],n=nfft,axis=-1)
+    psd=np.mean(np.abs(xf)**2,axis=1)
+    psd[:,1:]=2.*psd[:,1:]
+    if nfft%2==0:
+        psd[:,-1]=psd[:,-1]/2.
+    return psd
+
+
+def fft_length(ntime):
+    """FFT length: next power of two >= ntime (at least SPEC_NFFT)."""
+    return max(SPEC_NFFT,int(2**np.ceil(np.log2(ntime))))
+
+
+def band_ratio(freq,psd,band):
+    """Fraction of the variance (without frequency 0) in the frequency band."""
+    is_band=np.logical_and(freq>=band[0],freq<=band[1])
+    return np.sum(psd[:,is_band],axis=-1)/np.sum(psd[:,1:],axis=-1)
+
+
+def spectra(x,nfft):
+    """Welch and multitaper spectra, red noise levels and band ratios
+    for series of equal length (series,time), FFT length nfft.
+    """
+    ntime=np.shape(x)[-1]
+    nperseg=min(SPEC_NPERSEG,ntime)
+    freq,psd_w=signal.welch(x,fs=1.0,nperseg=nperseg,nfft=nfft,axis=-1)
+    psd_m=mtm_psd(x,nfft)
+    r1=ar1_coef(x)
+    # degrees of freedom: Welch segments with 50% overlap, 2 per taper
+    nseg=(ntime-nperseg)//(nperseg//2)+1
+    dof_w=2.*nseg
+    dof_m=2.*SPEC_NTAPER
+    red_w=red_noise(freq,r1,psd_w)*chi2.ppf(SPEC_SIGLEVEL,dof_w)/dof_w
+    red_m=red_noise(freq,r1,psd_m)*chi2.ppf(SPEC_SIGLEVEL,dof_m)/dof_m
+    return {'freq':freq,'psd_welch':psd_w,'psd_mtm':psd_m,'ar1':r1,\
+        'red_welch':red_w,'red_mtm':red_m,\
+        'band_ratio_welch':band_ratio(freq,psd_w,SPEC_BAND),\
+        'band_ratio_mtm':band_ratio(freq,psd_m,SPEC_BAND)}
+
+
+def pdo_spectra(v,realm=None,resid=True):
+    """Spectra of all PDO index series, saved in one netcdf file."""
+    series=collect_series(v,realm,resid)
+    if len(series)==0:
+        print("Error: no PDO index files found")
+        return None
+    nseries=len(series)
+    result={}
+    lengths=np.array([len(s['x']) for s in series])
+    nfft=fft_length(np.max(lengths))
+    # one vectorized call for each group of series with the same length
+    for n in np.unique(lengths):
+        idx=np.where(lengths==n)[0]
+        x=np.stack([series[i]['x'] for i in idx],axis=0)
+        spec=spectra(x,nfft)
+        for key in spec:
+            if key=='freq':
+                freq=spec[key]
+                continue
+            if key not in result:
+                result[key]=np.empty((nseries,)+np.shape(spec[key])[1:])
+            result[key][idx]=spec[key]
+    labels=[s['kind']+"_"+s['scen']+"_"+s['model']+"_"+s['run'] for s in series]
+    ds=xarray.Dataset(coords={'series':labels,'freq':freq})
+    ds['freq'].attrs['units']='1/year'
+    ds['model']=('series',[s['model'] for s in series])
+    ds['scen']=('series',[s['scen'] for s in series])
+    ds['run']=('series',[s['run'] for s in series])
+    ds['kind']=('series',[s['kind'] for s in series])
+    ds['nsample']=('series',lengths)
+    names={'psd_welch':'Welch power spectrum',\
+        'psd_mtm':'multitaper power spectrum',\
+        'red_welch':'AR1 spectrum significance level (Welch)',\
+        'red_mtm':'AR1 spectrum significance level (multitaper)',\
+        'ar1':'lag-1 autocorrelation',\
+        'band_ratio_welch':'decadal band variance ratio (Welch)',\
+        'band_ratio_mtm':'decadal band variance ratio (multitaper)'}
+    for key in names:
+        if np.ndim(result[key])==2:
+            ds[key]=(('series','freq'),result[key])
+        else:
+            ds[key]=('series',result[key])
+        ds[key].attrs['long_name']=names[key]
+    ds.attrs['mode']=MODE_PDO+1
+    ds.attrs['siglevel']=SPEC_SIGLEVEL
+    ds.attrs['band']=str(SPEC_BAND)
+    outfile=OUTPATH+"cmip5_"+v+"_pdo_spectra.nc"
+    cmip5_io.to_netcdf(ds,outfile)
+    print("series: "+str(nseries))
+    print("output file: "+outfile)
+    return ds
+
+
+###############################################################################
+# If RESID is True then the PDO indices of the
+# linear regression residuals are used
+###############################################################################
+RESID=True
+
+realm='ocn' # or set to None, depending of sub-folder structure
+
+if __name__ == "__main__":
+    for v in VARLIST:
+        pdo_spectra(v,realm=realm,resid=RESID)
+    print ("done")
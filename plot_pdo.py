@@ -0,0 +1,236 @@
+#!/usr/bin/python
+###############################################################################
+# Figures of the PDO analysis from the saved netcdf output
+# (off-screen rendering with the matplotlib 'Agg' backend,
+# figures rendered in parallel with a process pool):
+#   - EOF map of mode MODE_PDO and explained variance bar chart
+#     for each model (fld_pca.py output)
+#   - PDO projection index for each model and scenario
+#     (fld_proj.py output)
+#   - ensemble summary: EOF maps of all models and the PDO indices
+#     of all models in multi-panel figures (models without output file
+#     are skipped; with the eof_similarity.py output the patterns and
+#     indices are multiplied by the aligned sign of each model)
+# Figures are written to PLOT_PATH (png).
+###############################################################################
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import xarray
+import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
+from cmip5 import *
+import cmip5_io
+import fld_engine
+
+# output folder of the figures
+PLOT_PATH=OUTPATH+"figures/"
+# number of processes
+PLOT_WORKERS=8
+# resolution of the png files
+PLOT_DPI=120
+# panels per row in the ensemble summary figures
+PLOT_NCOL=6
+
+
+def app_name(resid):
+    if resid:
+        return "ann_ano_resid"
+    return "ann_ano"
+
+
+def read_eof(model,run,v,realm=None,resid=True):
+    """Reads EOF (mode MODE_PDO, REGION_PDO domain) and explained variance."""
+    app=app_name(resid)
+    nc=xarray.open_dataset(cmip5_io.fpath('historical',model,run,v,app+"_eof",realm))
+    is_lon,is_lat=fld_engine.region_mask(nc.lon.values,nc.lat.values,REGION_PDO)
+    eof=fld_engine.sel_region(nc['eof'].values[MODE_PDO],is_lon,is_lat)
+    lat=nc.lat.values[is_lat]
+    lon=nc.lon.values[is_lon]
+    nc.close()
+    nc=xarray.open_dataset(cmip5_io.fpath('historical',model,run,v,app+"_pc",realm))
+    if 'expfrac' in nc:
+        expvar=nc['expfrac'].values*100.
+        label='explained variance [%]'
+    else:
+        expvar=nc['expvar'].values/np.sum(nc['expvar'].values)*100.
+        label='explained variance [% of saved modes]'
+    nc.close()
+    return eof,lat,lon,expvar,label
+
+
+def read_signs(run,v,realm=None,resid=True):
+    """Signs that align the PDO patterns of the models (eof_similarity.py
+    output, residuals only). Returns a dictionary model:sign (empty if
+    the similarity file is missing)."""
+    infile=cmip5_io.fpath('historical',"cmip5",run,v,\
+        app_name(resid)+"_eof_similarity",realm)
+    if not resid or not os.path.exists(infile):
+        print("no sign alignment (missing "+infile+")")
+        return {}
+    nc=xarray.open_dataset(infile)
+    sign=dict(zip([str(m) for m in nc.model.values],nc['sign'].values))
+    nc.close()
+    return sign
+
+
+def existing_models(models,scen,run,v,apps,realm=None):
+    """Models with the output files of all apps (list); the other
+    models are skipped."""
+    found=[]
+    for model in models:
+        missing=[f for f in [cmip5_io.fpath(scen,model,run,v,app,realm) \
+            for app in apps] if not os.path.exists(f)]
+        if missing:
+            print("missing file (skipped): "+", ".join(missing))
+        else:
+            found.append(model)
+    return found
+
+
+def read_index(scen,model,run,v,realm=None,resid=True):
+    """Reads the PDO projection index (mode MODE_PDO) and the years."""
+    app=app_name(resid)
+    nc=xarray.open_dataset(cmip5_io.fpath(scen,model,run,v,app+"_pdo_proj",realm))
+    x=nc['proj'].values[:,MODE_PDO]
+    years=nc['time'].dt.year.values
+    nc.close()
+    return years,x
+
+
+def plot_eof(model,run,v,realm=None,resid=True):
+    """EOF map and explained variance bar chart of one model."""
+    eof,lat,lon,expvar,label=read_eof(model,run,v,realm,resid)
+    fig,ax=plt.subplots(1,2,figsize=(11,3.5),gridspec_kw={'width_ratios':[3,1]})
+    vmax=np.nanmax(np.abs(eof))
+    cs=ax[0].contourf(lon,lat,eof,levels=np.linspace(-vmax,vmax,21),\
+        cmap=plt.cm.coolwarm)
+    fig.colorbar(cs,ax=ax[0])
+    ax[0].set_title(model+" EOF "+str(MODE_PDO+1))
+    ax[0].set_xlabel('longitude')
+    ax[0].set_ylabel('latitude')
+    ax[1].bar(np.arange(1,len(expvar)+1),expvar)
+    ax[1].set_xlabel('PCA mode #')
+    ax[1].set_ylabel(label)
+    outfile=PLOT_PATH+model+"_"+v+"_"+run+"_eof.png"
+    fig.savefig(outfile,dpi=PLOT_DPI,bbox_inches='tight')
+    plt.close(fig)
+    return outfile
+
+
+def plot_index(scen,model,run,v,realm=None,resid=True):
+    """PDO projection index time series of one model and scenario."""
+    years,x=read_index(scen,model,run,v,realm,resid)
+    fig,ax=plt.subplots(1,1,figsize=(8,3))
+    ax.bar(years,x,color=np.where(x>=0,'tab:red','tab:blue'),width=1.0)
+    ax.axhline(0.,color='k',lw=0.5)
+    ax.set_title(model+" "+scen+" PDO index (mode "+str(MODE_PDO+1)+")")
+    ax.set_xlabel('year')
+    ax.set_ylabel('projection index')
+    outfile=PLOT_PATH+model+"_"+scen+"_"+v+"_"+run+"_pdo_index.png"
+    fig.savefig(outfile,dpi=PLOT_DPI,bbox_inches='tight')
+    plt.close(fig)
+    return outfile
+
+
+def panel_grid(n):
+    nrow=int(np.ceil(n/float(PLOT_NCOL)))
+    ncol=min(n,PLOT_NCOL)
+    fig,ax=plt.subplots(nrow,ncol,figsize=(3.2*ncol,2.2*nrow),squeeze=False)
+    for k in range(n,nrow*ncol):
+        ax.flat[k].axis('off')
+    return fig,ax
+
+
+def plot_summary_eof(models,run,v,realm=None,resid=True):
+    """EOF maps of all models in one multi-panel figure."""
+    models=existing_models(models,'historical',run,v,\
+        [app_name(resid)+"_eof",app_name(resid)+"_pc"],realm)
+    if len(models)==0:
+        return "no EOF files for run "+run
+    sign=read_signs(run,v,realm,resid)
+    fig,ax=panel_grid(len(models))
+    k=0
+    for model in models:
+        eof,lat,lon,expvar,label=read_eof(model,run,v,realm,resid)
+        eof=eof*sign.get(model,1.)
+        vmax=np.nanmax(np.abs(eof))
+        ax.flat[k].contourf(lon,lat,eof,levels=np.linspace(-vmax,vmax,21),\
+            cmap=plt.cm.coolwarm)
+        ax.flat[k].set_title(model+" (%.0f%%)" % expvar[MODE_PDO],fontsize=9)
+        ax.flat[k].tick_params(labelsize=7)
+        k+=1
+    outfile=PLOT_PATH+"ensemble_"+v+"_"+run+"_eof.png"
+    fig.tight_layout()
+    fig.savefig(outfile,dpi=PLOT_DPI)
+    plt.close(fig)
+    return outfile
+
+
+def plot_summary_index(scen,models,run,v,realm=None,resid=True):
+    """PDO indices of all models (one scenario) in one multi-panel figure."""
+    models=existing_models(models,scen,run,v,[app_name(resid)+"_pdo_proj"],realm)
+    if len(models)==0:
+        return "no projection files for "+scen+" run "+run
+    sign=read_signs(run,v,realm,resid)
+    fig,ax=panel_grid(len(models))
+    k=0
+    for model in models:
+        years,x=read_index(scen,model,run,v,realm,resid)
+        x=x*sign.get(model,1.)
+        ax.flat[k].plot(years,x,lw=0.8)
+        ax.flat[k].axhline(0.,color='k',lw=0.5)
+        ax.flat[k].set_title(model,fontsize=9)
+        ax.flat[k].tick_params(labelsize=7)
+        k+=1
+    outfile=PLOT_PATH+"ensemble_"+scen+"_"+v+"_"+run+"_pdo_index.png"
+    fig.tight_layout()
+    fig.savefig(outfile,dpi=PLOT_DPI)
+    plt.close(fig)
+    return outfile
+
+
+def render(job):
+    """Renders one figure (job: function name and arguments).
+
+    Errors (for example missing files) are returned, not raised,
+    so that the other figures are rendered.
+    """
+    name,args=job
+    try:
+        return globals()[name](*args)
+    except Exception as e:
+        return "failed "+name+str(args)+": "+str(e)
+
+
+def make_jobs(v,realm=None,resid=True):
+    """List of all figures for the models, runs and scenarios in cmip5.py."""
+    jobs=[]
+    for model in MODELLIST:
+        for run in ENSEMBLELIST:
+            jobs.append(('plot_eof',(model,run,v,realm,resid)))
+            for scen in SCENARIOLIST:
+                jobs.append(('plot_index',(scen,model,run,v,realm,resid)))
+    for run in ENSEMBLELIST:
+        jobs.append(('plot_summary_eof',(MODELLIST,run,v,realm,resid)))
+        for scen in SCENARIOLIST:
+            jobs.append(('plot_summary_index',(scen,MODELLIST,run,v,realm,resid)))
+    return jobs
+
+
+RESID=True
+
+realm='ocn' # or set to None, depending of sub-folder structure
+
+if __name__ == "__main__":
+    if not os.path.exists(PLOT_PATH):
+        os.makedirs(PLOT_PATH)
+    for v in VARLIST:
+        jobs=make_jobs(v,realm=realm,resid=RESID)
+        print("figures: "+str(len(jobs)))
+        with ProcessPoolExecutor(max_workers=PLOT_WORKERS) as pool:
+            for result in pool.map(render,jobs):
+                print(result)
+    print ("done")
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+###############################################################################
+# Comparison of the float32 and float64 results
+# of the regression (residuals), the PCA (EOFs, explained variance)
+# and the projection indices for one model run, calculated with the
+# functions of the stage scripts (fld_linreg.linreg_points,
+# fld_pca.pca_modes, fld_proj.proj_modes).
+# Input files: *_ann_ano.nc and *_ann_ano_fldmean.nc
+# The differences are printed; run this before switching PRECISION
+# in cmip5.py to 'float32'.
+###############################################################################
+
+import xarray
+import numpy as np
+from cmip5 import *
+import cmip5_io
+import fld_engine
+import fld_linreg
+import fld_pca
+import fld_proj
+
+
+def run_stages(field,x,is_lon,is_lat,dtype,nmodes=10):
+    """Regression (fld_linreg.py), PCA (fld_pca.py) and projection
+    (fld_proj.py) in the given precision, with the functions of the
+    stage scripts.
+
+    Returns the residuals, EOFs (nmodes,npoint), explained variance
+    (fractions) and the projection indices (time,nmodes).
+    """
+    field=field.astype(dtype)
+    x=x.astype(dtype)
+    a,b,r,res=fld_linreg.linreg_points(x,field)
+    res_npac=fld_engine.sel_region(res,is_lon,is_lat)
+    field_eof,pc,expvar,expfrac=fld_pca.pca_modes(res_npac,nmodes)
+    proj=fld_proj.proj_modes(res_npac,field_eof.astype(dtype))
+    eof=np.reshape(field_eof,(np.shape(field_eof)[0],-1))
+    eof=eof[:,np.all(np.isfinite(eof),axis=0)]
+    return res,eof,expfrac,proj
+
+
+def compare(scen,model,run,v,realm=None,nmodes=10):
+    """Prints the differences between the float32 and float64 results.
+
+    Input variables:
+        scen,model,run,v: strings indicating the scenario,
+            model,ensemble member run, and the variable name.
+        realm: optional string argument corresponding to the
+            variable processed that is used for the subfolder structure
+            of the CMIP5 model.
+    Returns a dictionary with the differences.
+    """
+    nc1=xarray.open_dataset(cmip5_io.fpath(scen,model,run,v,"ann_ano",realm))
+    nc2=xarray.open_dataset(cmip5_io.fpath(scen,model,run,v,"ann_ano_fldmean",realm))
+    field=(nc1[v].values[:]).squeeze()
+    x=(nc2[v].values[:]).squeeze()
+    is_lon,is_lat=fld_engine.region_mask(nc1.lon.values,nc1.lat.values,REGION_PDO)
+    nc1.close()
+    nc2.close()
+    res64,eof64,var64,proj64=run_stages(field,x,is_lon,is_lat,np.float64,nmodes)
+    res32,eof32,var32,proj32=run_stages(field,x,is_lon,is_lat,np.float32,nmodes)
+    diff={}
+    valid=np.isfinite(res64)
+    diff['resid_max_abs']=float(np.max(np.abs(res32[valid]-res64[valid])))
+    diff['resid_rel_rms']=float(np.sqrt(np.mean((res32[valid]-res64[valid])**2)/\
+        np.mean(res64[valid]**2)))
+    # EOF signs are arbitrary: compare the absolute pattern correlation
+    corr=np.abs(np.sum(eof32*eof64,axis=1))/np.sqrt(np.sum(eof32**2,axis=1)*\
+        np.sum(eof64**2,axis=1))
+    diff['eof_min_abs_corr']=float(np.min(corr))
+    diff['eof_pdo_abs_corr']=float(corr[MODE_PDO])
+    diff['expvar_max_rel']=float(np.max(np.abs(var32-var64)/var64))
+    sign=np.sign(np.sum(eof32*eof64,axis=1))
+    p32=proj32*sign[None,:]
+    diff['proj_pdo_rel_rms']=float(np.sqrt(np.mean((p32[:,MODE_PDO]-proj64[:,MODE_PDO])**2)/\
+        np.mean(proj64[:,MODE_PDO]**2)))
+    diff['bytes_float64']=int(res64.nbytes)
+    diff['bytes_float32']=int(res32.nbytes)
+    print("precision check "+model+" "+scen+" "+run+" "+v)
+    for key in sorted(diff):
+        print("  "+key+": "+str(diff[key]))
+    return diff
+
+
+realm='ocn' # or set to None, depending of sub-folder structure
+
+if __name__ == "__main__":
+    for model in MODELLIST:
+        for v in VARLIST:
+            compare('historical',model,ENSEMBLELIST[0],v,realm=realm)
+    print ("done")
@@ -5,6 +5,9 @@
 # of TOS from CMIP5 models stored at APDRC
 #
 import os
+import shutil
+import catalog
+from cdo_chain import run_cdo,CdoError
 
 OPENDAP_PATH="http://apdrc.soest.hawaii.edu:80/dods/public_data/CMIP5/"
 WORKHOST="snow"
@@ -37,12 +40,14 @@ for SCENARIO in SCENARIOLIST:
         for VAR in VARLIST:
             SOURCE=OPENDAP_PATH+"/"+SCENARIO+"/"+VAR+"/"+MODEL+"_"+RUN
             print("process model data from source "+SOURCE)
-            cmd="rm check_units+"+SCENARIO+"_"+VAR+".tmp"
-            os.system(cmd)
             i=i+1
-            # check units
-            cmd="ncdump -h "+SOURCE+" | grep -i "+VAR+":units >> check_units+"+SCENARIO+"_"+VAR+".tmp"
-            os.system(cmd)
+            # check units: header information is stored in the catalog
+            catalog.update_catalog([SOURCE],dbfile=OUTPATH+"catalog.sqlite")
+            info=catalog.lookup(SOURCE,dbfile=OUTPATH+"catalog.sqlite")
+            if info is None:
+                print("could not read the header of "+SOURCE)
+            else:
+                print(VAR+":units = "+str(info['units'].get(VAR)))
             # extract variable
             #cdo="cdo -selvar,"+VAR+" "+SOURCE+" buffer"+str(ifile)+".tmp"
             #print cdo
@@ -50,14 +55,17 @@ for SCENARIO in SCENARIOLIST:
            
 
             # remap to 2.5 x 2.5 NCEP grid
+            # (a failed cdo call skips this model and variable)
             cdo="cdo -remapbil,"+OUTGRID+" "+SOURCE+" remap.nc"
-            print (cdo)
-            os.system(cdo)
+            try:
+                run_cdo(cdo)
+            except CdoError as e:
+                print("Error: "+str(e))
+                continue
             outfile="cmip5_"+SCENARIO+"_"+VAR+"_"+MODEL+"_"+RUN+".nc"
             print (outfile)
-            cmd="cp -p remap.nc "+OUTPATH+outfile
-            os.system(cmd)
-            os.system("rm buffer*.tmp buffer.nc remap.nc")
+            shutil.copy2("remap.nc",OUTPATH+outfile)
+            os.remove("remap.nc")
     nmodel+=1
     print ("----------------------------------------------------------")
     print ("stats for CMIP5 simulations "+SCENARIO+" : variable "+VAR)
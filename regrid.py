@@ -0,0 +1,149 @@
+###############################################################################
+# Bilinear interpolation operators between regular lon-lat grids
+# for patterns (EOFs) that are not on the grid of the field data,
+# for example observed patterns or patterns from a native-grid PCA.
+# The operator of a source and target grid is a sparse matrix
+# (target points x source points). It is calculated once and cached in
+# memory and in OUTPATH+"regrid/" (one .npz file per pair of grids), so
+# all scenarios and runs projected onto the same patterns reuse it.
+# Missing values (nan) in the patterns are excluded: the weights of the
+# valid neighbours are renormalized (at least REGRID_MIN_WEIGHT of the
+# bilinear weight must come from valid source points).
+###############################################################################
+
+import hashlib
+import os
+import numpy as np
+import scipy.sparse
+from cmip5 import *
+
+# minimum bilinear weight of the valid source points
+REGRID_MIN_WEIGHT=0.5
+
+# in-memory cache of the operators (key: source and target coordinates)
+_REGRID_CACHE={}
+
+
+def regrid_folder():
+    """Folder of the cached operators."""
+    return OUTPATH+"regrid/"
+
+
+def is_periodic(lon):
+    """True if the longitudes cover the full circle."""
+    lon=np.sort(np.asarray(lon,dtype=np.float64))
+    if len(lon)<2:
+        return False
+    dlon=np.median(np.diff(lon))
+    return lon[-1]-lon[0]+dlon>=360.-1e-6
+
+
+def axis_weights(src,dst,period=None):
+    """Linear interpolation weights along one axis.
+
+    Input parameters:
+        src,dst: 1-dim source and target coordinates (any order)
+        period: period of a cyclic axis (360 for global longitudes)
+    Returns for each target coordinate the two source indices, their
+    weights and a flag if the target is inside the source range.
+    """
+    src=np.asarray(src,dtype=np.float64)
+    dst=np.asarray(dst,dtype=np.float64)
+    order=np.argsort(src)
+    s=src[order]
+    if period is not None:
+        dst=(dst-s[0])%period+s[0]
+        s=np.append(s,s[0]+period)
+        order=np.append(order,order[0])
+    if len(s)==1:
+        i=np.zeros(len(dst),dtype=int)
+        return order[i],order[i],np.ones(len(dst)),np.zeros(len(dst)),\
+            np.isclose(dst,s[0])
+    j=np.clip(np.searchsorted(s,dst,side='right')-1,0,len(s)-2)
+    w1=(dst-s[j])/(s[j+1]-s[j])
+    valid=(w1>=-1e-6)&(w1<=1.+1e-6)
+    w1=np.clip(w1,0.,1.)
+    return order[j],order[j+1],1.-w1,w1,valid
+
+
+def bilinear_operator(lat_src,lon_src,lat_dst,lon_dst):
+    """Sparse bilinear interpolation matrix (lat_dst*lon_dst, lat_src*lon_src).
+
+    Target points outside the source grid have no weights (nan after
+    interpolation).
+    """
+    nlon_src=len(lon_src)
+    period=None
+    if is_periodic(lon_src):
+        period=360.
+    ia0,ia1,wa0,wa1,va=axis_weights(lat_src,lat_dst)
+    io0,io1,wo0,wo1,vo=axis_weights(lon_src,lon_dst,period)
+    nlat=len(lat_dst)
+    nlon=len(lon_dst)
+    row=np.arange(nlat*nlon).reshape(nlat,nlon)
+    valid=np.outer(va,vo)
+    rows=[]
+    cols=[]
+    vals=[]
+    for ia,wa in [(ia0,wa0),(ia1,wa1)]:
+        for io,wo in [(io0,wo0),(io1,wo1)]:
+            col=ia[:,None]*nlon_src+io[None,:]
+            w=np.outer(wa,wo)
+            use=valid&(w>0.)
+            rows.append(row[use])
+            cols.append(col[use])
+            vals.append(w[use])
+    shape=(nlat*nlon,len(lat_src)*nlon_src)
+    op=scipy.sparse.coo_matrix((np.concatenate(vals),\
+        (np.concatenate(rows),np.concatenate(cols))),shape=shape)
+    return op.tocsr()
+
+
+def get_operator(lat_src,lon_src,lat_dst,lon_dst):
+    """Returns the interpolation operator from the cache (memory or
+    file in regrid_folder()) or calculates and caches it."""
+    coords=[np.asarray(c,dtype=np.float64) for c in [lat_src,lon_src,lat_dst,lon_dst]]
+    sha=hashlib.sha1()
+    for c in coords:
+        sha.update(str(len(c)).encode())
+        sha.update(c.tobytes())
+    key=sha.hexdigest()
+    if key in _REGRID_CACHE:
+        return _REGRID_CACHE[key]
+    cachefile=regrid_folder()+"bilinear_"+key+".npz"
+    if os.path.exists(cachefile):
+        op=scipy.sparse.load_npz(cachefile).tocsr()
+    else:
+        print("calculate interpolation operator, cache file: "+cachefile)
+        op=bilinear_operator(*coords)
+        if not os.path.exists(regrid_folder()):
+            os.makedirs(regrid_folder())
+        scipy.sparse.save_npz(cachefile,op)
+    _REGRID_CACHE[key]=op
+    return op
+
+
+def regrid_patterns(x,lat_src,lon_src,lat_dst,lon_dst):
+    """Interpolates patterns to the target grid.
+
+    Input parameters:
+        x: patterns (...,lat_src,lon_src), nan for missing values
+        lat_src,lon_src: 1-dim coordinates of the patterns
+        lat_dst,lon_dst: 1-dim coordinates of the target grid
+    Returns the patterns on the target grid (...,lat_dst,lon_dst).
+    """
+    op=get_operator(lat_src,lon_src,lat_dst,lon_dst)
+    lead=np.shape(x)[:-2]
+    x2d=np.reshape(x,(-1,len(lat_src)*len(lon_src))).astype(np.float64)
+    is_x=np.isfinite(x2d)
+    num=op.dot(np.where(is_x,x2d,0.).T)
+    den=op.dot(is_x.astype(np.float64).T)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        y=np.where(den>=REGRID_MIN_WEIGHT,num/den,np.nan).T
+    return np.reshape(y,lead+(len(lat_dst),len(lon_dst))).astype(np.result_type(x,np.float32))
+
+
+def same_grid(lat1,lon1,lat2,lon2):
+    """True if the two grids have the same coordinates."""
+    return np.array_equal(np.asarray(lat1),np.asarray(lat2)) and \
+        np.array_equal(np.asarray(lon1),np.asarray(lon2))
@@ -0,0 +1,95 @@
+###############################################################################
+# Task list of the processing pipeline for the configuration in cmip5.py
+# Each task is one (stage,scenario,model,run,var) combination with its
+# input and output files and the tasks it depends on.
+# Stages (scripts) in processing order:
+#   mon2ann      source (DPATH) -> *_ann.nc
+#   climatology  *_ann.nc (historical) -> *_ann_clim.nc
+#   anomaly      *_ann.nc, *_ann_clim.nc -> *_ann_ano.nc
+#   fld_mean     *_ann_ano.nc -> *_ann_ano_fldmean.nc
+#   fld_linreg   *_ann_ano.nc, *_ann_ano_fldmean.nc -> *_ann_ano_resid.nc
+#   fld_pca      *_ann_ano_resid.nc (historical) -> *_eof.nc, *_pc.nc
+#   fld_proj     *_ann_ano_resid.nc, *_eof.nc (historical) -> *_pdo_proj.nc
+###############################################################################
+
+from cmip5 import *
+import cmip5_io
+
+STAGES=['mon2ann','climatology','anomaly','fld_mean','fld_linreg',\
+    'fld_pca','fld_proj']
+
+# stages that are only applied to the historical scenario
+HISTORICAL_ONLY=['climatology','fld_pca']
+
+
+def source_file(scen,model,run,v):
+    """Source file (DPATH) of the monthly data."""
+    model_scen=TRANSLATE[scen]['scen']
+    return DPATH+"cmip5_"+model_scen+"_"+v+"_"+model+"_"+run+".nc"
+
+
+def task_key(stage,scen,model,run,v):
+    """Unique name of a task."""
+    return "/".join([stage,scen,model,run,v])
+
+
+def make_task(stage,scen,model,run,v,realm=None):
+    """Input files, output files and dependencies of one task.
+
+    Returns a dictionary with the keys stage,scen,model,run,var,key,
+    inputs,outputs and deps (list of task keys).
+    """
+    def f(s,app):
+        return cmip5_io.fpath(s,model,run,v,app,realm)
+    def k(st,s):
+        return task_key(st,s,model,run,v)
+    hist='historical'
+    if stage=='mon2ann':
+        inputs=[source_file(scen,model,run,v)]
+        outputs=[f(scen,"ann")]
+        deps=[]
+    elif stage=='climatology':
+        inputs=[f(hist,"ann")]
+        outputs=[f(hist,"ann_clim")]
+        deps=[k('mon2ann',hist)]
+    elif stage=='anomaly':
+        inputs=[f(scen,"ann"),f(hist,"ann_clim")]
+        outputs=[f(scen,"ann_ano")]
+        deps=[k('mon2ann',scen),k('climatology',hist)]
+    elif stage=='fld_mean':
+        inputs=[f(scen,"ann_ano")]
+        outputs=[f(scen,"ann_ano_fldmean")]
+        deps=[k('anomaly',scen)]
+    elif stage=='fld_linreg':
+        inputs=[f(scen,"ann_ano"),f(scen,"ann_ano_fldmean")]
+        outputs=[f(scen,"ann_ano_resid")]
+        deps=[k('anomaly',scen),k('fld_mean',scen)]
+    elif stage=='fld_pca':
+        inputs=[f(hist,"ann_ano_resid")]
+        outputs=[f(hist,"ann_ano_resid_eof"),f(hist,"ann_ano_resid_pc")]
+        deps=[k('fld_linreg',hist)]
+    elif stage=='fld_proj':
+        inputs=[f(scen,"ann_ano_resid"),f(hist,"ann_ano_resid_eof")]
+        outputs=[f(scen,"ann_ano_resid_pdo_proj")]
+        deps=[k('fld_linreg',scen),k('fld_pca',hist)]
+    else:
+        raise ValueError("unknown stage "+stage)
+    return {'stage':stage,'scen':scen,'model':model,'run':run,'var':v,\
+        'key':task_key(stage,scen,model,run,v),\
+        'inputs':inputs,'outputs':outputs,'deps':deps}
+
+
+def make_tasks(stages=STAGES,realm=None):
+    """All tasks of the stages in processing order (dependencies first)."""
+    tasks=[]
+    for stage in stages:
+        if stage in HISTORICAL_ONLY:
+            scenlist=['historical']
+        else:
+            scenlist=SCENARIOLIST
+        for scen in scenlist:
+            for model in MODELLIST:
+                for run in ENSEMBLELIST:
+                    for v in VARLIST:
+                        tasks.append(make_task(stage,scen,model,run,v,realm))
+    return tasks
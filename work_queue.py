@@ -0,0 +1,421 @@
+#!/usr/bin/python
+###############################################################################
+# Work queue on a shared file system (no central service)
+# for multi-node runs: the (stage,scenario,model,run,var) tasks from
+# cmip5.py are files in the queue folder (default OUTPATH+"queue/"):
+#   pending/  tasks waiting for a worker
+#   running/  claimed tasks (the file modification time is the lease)
+#   done/     finished tasks
+#   failed/   tasks that failed MAX_ATTEMPTS times
+#   status.json  number of tasks in each state and the workers
+# A worker claims a task with a rename pending/ -> running/ (the task
+# file records the worker), renews the lease (touches the file) while
+# the task runs, and moves it to done/ (or back to pending/ if the task
+# failed). Tasks with an expired lease (dead worker) are moved back to
+# pending/ by the next worker that looks for work. Lease ages are
+# measured against the file server clock (modification time of the
+# freshly touched file queue.clock), so clock skew between the nodes
+# does not expire live leases.
+# All moves are done under the queue lock (queue.lock, fcntl.flock) and
+# the task file is updated before it is moved, so a task is never in
+# two folders. A worker only renews or releases a task that it owns
+# (a worker whose lease expired gets LeaseLost).
+#
+# Usage:
+#   python work_queue.py init [queue folder] [stage]
+#   python work_queue.py worker [queue folder] ["command template"]
+#   python work_queue.py status [queue folder]
+#   python work_queue.py requeue [queue folder]   (also re-queues failed/)
+#   python work_queue.py selftest [number of workers]
+# Without a command template the worker runs the stage functions
+# (run_stage: 'ano_pipe' -> cdo_chain.calc_ano_pipe, the stages
+# mon2ann ... fld_proj -> journal.run_stage).
+# The command template is formatted with the task fields, for example
+#   "python my_stage.py {stage} {scen} {model} {run} {var}"
+# Local test with several worker processes in a temporary folder
+# (selftest: every task done exactly once, abandoned task re-queued,
+# stale worker refused):
+#   python work_queue.py selftest 4
+###############################################################################
+
+import fcntl
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from cmip5 import *
+
+# lease time (seconds) after which a running task counts as abandoned
+LEASE_TIMEOUT=300.
+# number of attempts before a task is moved to failed/
+MAX_ATTEMPTS=3
+
+STATES=['pending','running','done','failed']
+
+
+def task_name(task):
+    """File name of a task."""
+    return "__".join([task['stage'],task['scen'],task['model'],\
+        task['run'],task['var']])+".json"
+
+
+def make_tasks(stage):
+    """List of tasks of one stage for the configuration in cmip5.py."""
+    tasks=[]
+    for scen in SCENARIOLIST:
+        for model in MODELLIST:
+            for run in ENSEMBLELIST:
+                for v in VARLIST:
+                    tasks.append({'stage':stage,'scen':scen,'model':model,\
+                        'run':run,'var':v,'attempts':0})
+    return tasks
+
+
+class LeaseLost(RuntimeError):
+    """The task is no longer owned by the worker (lease expired)."""
+    pass
+
+
+class QueueLock(object):
+    """Exclusive lock (fcntl.flock) on the file queue.lock."""
+
+    def __init__(self,qdir):
+        self.lockfile=os.path.join(qdir,"queue.lock")
+
+    def __enter__(self):
+        self.fd=open(self.lockfile,"a")
+        fcntl.flock(self.fd,fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self,*args):
+        fcntl.flock(self.fd,fcntl.LOCK_UN)
+        self.fd.close()
+
+
+def write_json(path,data):
+    """Writes a json file atomically (temporary file and rename)."""
+    tmp=path+".tmp"+str(os.getpid())
+    with open(tmp,"w") as f:
+        json.dump(data,f,indent=1)
+    os.rename(tmp,path)
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def init_queue(qdir,tasks):
+    """Creates the queue folders and adds the tasks that are not yet queued."""
+    for state in STATES:
+        os.makedirs(os.path.join(qdir,state),exist_ok=True)
+    nnew=0
+    with QueueLock(qdir):
+        for task in tasks:
+            name=task_name(task)
+            if any([os.path.exists(os.path.join(qdir,state,name)) for state in STATES]):
+                continue
+            write_json(os.path.join(qdir,"pending",name),task)
+            nnew+=1
+    update_status(qdir)
+    print("tasks added: "+str(nnew))
+    return nnew
+
+
+def update_status(qdir,worker=None,info=None):
+    """Updates status.json with the task counts (and worker information)."""
+    path=os.path.join(qdir,"status.json")
+    with QueueLock(qdir):
+        try:
+            status=read_json(path)
+        except (IOError,ValueError):
+            status={'workers':{}}
+        for state in STATES:
+            names=[f for f in os.listdir(os.path.join(qdir,state)) if f.endswith(".json")]
+            status[state]=len(names)
+        if worker is not None:
+            status['workers'][worker]={'time':time.strftime("%Y-%m-%d %H:%M:%S"),\
+                'info':info}
+        status['updated']=time.strftime("%Y-%m-%d %H:%M:%S")
+        write_json(path,status)
+    return status
+
+
+def move_task(qdir,name,task,state,src_state="running"):
+    """Moves a task file to another state folder.
+    The content is written before the rename (call under QueueLock)."""
+    src=os.path.join(qdir,src_state,name)
+    write_json(src,task)
+    os.rename(src,os.path.join(qdir,state,name))
+    return state
+
+
+def next_state(task,ok,msg=""):
+    """State of a released task (counts the failed attempts)."""
+    task['message']=msg
+    if ok:
+        return "done"
+    task['attempts']=task.get('attempts',0)+1
+    if task['attempts']>=MAX_ATTEMPTS:
+        return "failed"
+    return "pending"
+
+
+def server_time(qdir):
+    """Current time of the file server (modification time of the
+    touched file queue.clock, call under QueueLock)."""
+    clock=os.path.join(qdir,"queue.clock")
+    with open(clock,"a"):
+        pass
+    os.utime(clock,None)
+    return os.path.getmtime(clock)
+
+
+def requeue_expired(qdir,timeout=LEASE_TIMEOUT):
+    """Moves running tasks with an expired lease back to pending/."""
+    nreq=0
+    rdir=os.path.join(qdir,"running")
+    with QueueLock(qdir):
+        now=server_time(qdir)
+        for name in sorted(os.listdir(rdir)):
+            if not name.endswith(".json"):
+                continue
+            src=os.path.join(rdir,name)
+            try:
+                if now-os.path.getmtime(src) < timeout:
+                    continue
+                task=read_json(src)
+            except (OSError,ValueError):
+                continue
+            move_task(qdir,name,task,next_state(task,False,"lease expired"))
+            nreq+=1
+    return nreq
+
+
+def claim(qdir,worker):
+    """Claims the next pending task. Returns (name,task) or None."""
+    pdir=os.path.join(qdir,"pending")
+    with QueueLock(qdir):
+        for name in sorted(os.listdir(pdir)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                task=read_json(os.path.join(pdir,name))
+            except (OSError,ValueError):
+                continue
+            task['worker']=worker
+            # the new file starts the lease (rename keeps the time stamp)
+            move_task(qdir,name,task,"running","pending")
+            return name,task
+    return None
+
+
+def check_owner(qdir,name,worker):
+    """Raises LeaseLost if the running task is not owned by the worker
+    (call under QueueLock)."""
+    try:
+        owner=read_json(os.path.join(qdir,"running",name)).get('worker')
+    except (OSError,ValueError):
+        owner=None
+    if owner!=worker:
+        raise LeaseLost(name+" is not owned by "+str(worker))
+
+
+def renew(qdir,name,worker):
+    """Renews the lease of a running task owned by the worker."""
+    with QueueLock(qdir):
+        check_owner(qdir,name,worker)
+        os.utime(os.path.join(qdir,"running",name),None)
+
+
+def release(qdir,name,task,ok,msg="",worker=None):
+    """Moves a running task owned by the worker to done/, back to
+    pending/ or to failed/. Raises LeaseLost if the task is not owned
+    by the worker (default task['worker'])."""
+    if worker is None:
+        worker=task.get('worker')
+    with QueueLock(qdir):
+        check_owner(qdir,name,worker)
+        return move_task(qdir,name,task,next_state(task,ok,msg))
+
+
+class Lease(threading.Thread):
+    """Renews the lease of a running task (touches the task file)."""
+
+    def __init__(self,qdir,name,worker,interval):
+        threading.Thread.__init__(self)
+        self.daemon=True
+        self.qdir=qdir
+        self.name=name
+        self.worker=worker
+        self.interval=interval
+        self.stopped=threading.Event()
+        self.lost=False
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                renew(self.qdir,self.name,self.worker)
+            except (OSError,LeaseLost):
+                self.lost=True
+                return
+
+    def stop(self):
+        self.stopped.set()
+
+
+def run_stage(task):
+    """Runs the stage function of a task ('ano_pipe': one CDO call per
+    member, see cdo_chain.py; other stages: see journal.run_stage)."""
+    if task['stage']=='ano_pipe':
+        import cdo_chain
+        cdo_chain.calc_ano_pipe(task['scen'],task['model'],task['run'],\
+            task['var'],START,END,realm=realm)
+    else:
+        import journal
+        journal.run_stage(task,realm=realm)
+    return True
+
+
+def run_command(template,task):
+    """Runs the command template formatted with the task fields."""
+    cmd=template.format(**task)
+    print(cmd)
+    return subprocess.call(cmd,shell=True)==0
+
+
+def worker(qdir,func,timeout=LEASE_TIMEOUT,wid=None):
+    """Processes tasks until the queue has no pending tasks.
+
+    Input parameters:
+        qdir: queue folder
+        func: function called with the task dictionary, returns True
+            if the task was successful
+        timeout: lease time in seconds (renewed every timeout/4 seconds)
+        wid: worker name (default host:pid)
+    """
+    if wid is None:
+        wid=socket.gethostname()+":"+str(os.getpid())
+    ndone=0
+    while True:
+        requeue_expired(qdir,timeout)
+        claimed=claim(qdir,wid)
+        if claimed is None:
+            break
+        name,task=claimed
+        update_status(qdir,wid,"running "+name)
+        lease=Lease(qdir,name,wid,timeout/4.)
+        lease.start()
+        t0=time.time()
+        try:
+            ok=func(task)
+            msg=""
+        except Exception as e:
+            ok=False
+            msg=str(e)
+        lease.stop()
+        lease.join()
+        task['duration']=time.time()-t0
+        if lease.lost:
+            print("lease lost (task re-queued by another worker): "+name)
+        else:
+            try:
+                state=release(qdir,name,task,ok,msg,wid)
+                print(wid+" "+name+" -> "+state)
+            except LeaseLost:
+                print("lease lost (task re-queued by another worker): "+name)
+        ndone+=1
+        update_status(qdir,wid,"finished "+name)
+    update_status(qdir,wid,"idle, tasks processed: "+str(ndone))
+    return ndone
+
+
+def requeue_failed(qdir):
+    """Moves failed tasks back to pending/ (attempts reset)."""
+    fdir=os.path.join(qdir,"failed")
+    with QueueLock(qdir):
+        for name in os.listdir(fdir):
+            if not name.endswith(".json"):
+                continue
+            task=read_json(os.path.join(fdir,name))
+            task['attempts']=0
+            move_task(qdir,name,task,"pending","failed")
+
+
+def selftest(nworker=4,ntask=40):
+    """Local test of the queue with several worker processes in a
+    temporary folder. Returns True if all checks passed."""
+    qdir=tempfile.mkdtemp(prefix="queue_")+"/"
+    tasks=[{'stage':'test','scen':'s','model':'m%03d' % i,'run':'r','var':'v',\
+        'attempts':0} for i in range(ntask)]
+    init_queue(qdir,tasks)
+    # a task abandoned by a dead worker (expired lease)
+    name,task=claim(qdir,"dead:0")
+    old=time.time()-2*LEASE_TIMEOUT
+    os.utime(os.path.join(qdir,"running",name),(old,old))
+    # a stale worker must not release a task claimed by another worker
+    requeue_expired(qdir)
+    name2,task2=claim(qdir,"new:0")
+    stale=dict(task2,worker="dead:0")
+    try:
+        release(qdir,name2,stale,True)
+        refused=False
+    except LeaseLost:
+        refused=True
+    release(qdir,name2,task2,False,"selftest")
+    log=os.path.join(qdir,"log.txt")
+    template="echo {model} >> "+log
+    procs=[subprocess.Popen([sys.executable,os.path.abspath(__file__),"worker",\
+        qdir,template]) for i in range(nworker)]
+    for p in procs:
+        p.wait()
+    with open(log) as f:
+        processed=sorted(f.read().split())
+    status=update_status(qdir)
+    ok={'stale worker refused':refused,\
+        'all tasks done':status['done']==ntask,\
+        'no pending, running or failed tasks':\
+            status['pending']+status['running']+status['failed']==0,\
+        'each task processed once':processed==sorted([t['model'] for t in tasks])}
+    for check in ok:
+        print(check+": "+str(ok[check]))
+    shutil.rmtree(qdir)
+    return all(ok.values())
+
+
+realm='ocn' # or set to None, depending of sub-folder structure
+
+if __name__ == "__main__":
+    cmd=sys.argv[1]
+    if cmd=="selftest":
+        nworker=4
+        if len(sys.argv)>2:
+            nworker=int(sys.argv[2])
+        sys.exit(0 if selftest(nworker) else 1)
+    if len(sys.argv)>2:
+        qdir=sys.argv[2]
+    else:
+        qdir=OUTPATH+"queue/"
+    if cmd=="init":
+        if len(sys.argv)>3:
+            stage=sys.argv[3]
+        else:
+            stage="ano_pipe"
+        init_queue(qdir,make_tasks(stage))
+    elif cmd=="worker":
+        if len(sys.argv)>3:
+            template=sys.argv[3]
+            worker(qdir,lambda task: run_command(template,task))
+        else:
+            worker(qdir,run_stage)
+    elif cmd=="requeue":
+        print("expired leases: "+str(requeue_expired(qdir,LEASE_TIMEOUT)))
+        requeue_failed(qdir)
+        update_status(qdir)
+    elif cmd=="status":
+        print(json.dumps(update_status(qdir),indent=1))